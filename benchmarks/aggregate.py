@@ -0,0 +1,119 @@
+# Detecting "most of the audience flicked up" with per-wand callbacks, versus a FleetAggregator
+#
+# Synthetic positions for every wand at 100 Hz: pointing ahead with a little
+# wobble, then 85% of them flick up 45 degrees at slightly different times.
+# The per-wand way runs a callback per sample that appends to shared state
+# under a lock, and every tick loops over the wands in Python. The aggregator
+# has no callbacks and does each tick with numpy. Samples go through
+# Wand._on_position with made up receive times, so the run is faster than real
+# time. Reports the cost per sample, the cost per tick and when each noticed.
+#
+#   python benchmarks/aggregate.py [wands...]
+
+import collections
+import math
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from kano_wand import FakeDevice, FakeWand, FleetAggregator, WandHub, flicked
+
+RATE = 100
+SECONDS = 4
+TICK_MS = 50
+WINDOW_MS = 300
+FLICK_AT = 2.0
+START = 10 ** 12
+
+def positions(count, rng):
+    """Payloads of every wand for every sample, (samples, wands) bytes of 8"""
+    t = numpy.arange(SECONDS * RATE) / RATE
+    flicking = rng.random(count) < 0.85
+    start = FLICK_AT + rng.uniform(0, 0.1, count)
+    progress = numpy.clip((t[:, None] - start) / 0.15, 0, 1) * flicking
+    pitch = numpy.radians(45) * progress + rng.normal(0, 0.01, (len(t), count))
+    heading = numpy.radians(5) * numpy.sin(t[:, None] * 2 + rng.uniform(0, 6, count))
+    # Heading turns about z, then pitch about y, which points the wand up as it grows
+    half_h, half_p = heading / 2, pitch / 2
+    q = numpy.stack([
+        -numpy.sin(half_h) * numpy.sin(half_p),
+        numpy.cos(half_h) * numpy.sin(half_p),
+        numpy.sin(half_h) * numpy.cos(half_p),
+        numpy.cos(half_h) * numpy.cos(half_p),
+    ], -1)
+    raw = numpy.rint(q * [-1, 1, 1, -1] * 16384)[..., [1, 0, 3, 2]].astype("<i2")
+    return [[row.tobytes() for row in step] for step in raw]
+
+def per_wand(wands, payloads):
+    history = [collections.deque(maxlen=WINDOW_MS * RATE // 1000 + 2) for _ in wands]
+    lock = threading.Lock()
+    for i, wand in enumerate(wands):
+        def on_position(x, y, z, w, wand=wand, samples=history[i]):
+            with lock:
+                samples.append((wand.timestamp, x, y, z, w))
+        wand.on("position", on_position)
+
+    def tick(now):
+        flicked_up = 0
+        with lock:
+            for samples in history:
+                lowest = None
+                rise = 0
+                for timestamp, x, y, z, w in samples:
+                    if now - timestamp > WINDOW_MS * 1000000:
+                        continue
+                    norm = x * x + y * y + z * z + w * w
+                    up = math.degrees(math.asin(max(-1, min(1, -2 * (x * z - w * y) / norm))))
+                    lowest = up if lowest is None else min(lowest, up)
+                    rise = max(rise, up - lowest)
+                flicked_up += rise >= 30
+        return flicked_up / len(history)
+
+    return run(wands, payloads, tick)
+
+def aggregated(wands, payloads):
+    aggregator = FleetAggregator(wands, window_ms=WINDOW_MS, rate=RATE, tick_ms=TICK_MS)
+    aggregator.add_motion("flick_up", flicked("up", degrees=30, within_ms=WINDOW_MS))
+    return run(wands, payloads, lambda now: aggregator.tick(now)["fractions"]["flick_up"])
+
+def run(wands, payloads, tick):
+    feeding = 0
+    ticking = []
+    noticed = None
+    for step, row in enumerate(payloads):
+        timestamp = START + step * 1000000000 // RATE
+        start = time.perf_counter()
+        for wand, payload in zip(wands, row):
+            wand.timestamp = timestamp
+            wand._on_position(payload)
+        feeding += time.perf_counter() - start
+        if step % (RATE * TICK_MS // 1000) == 0:
+            start = time.perf_counter()
+            fraction = tick(timestamp)
+            ticking.append(time.perf_counter() - start)
+            if noticed is None and fraction >= 0.8:
+                noticed = (timestamp - START) / 1e9 - FLICK_AT
+    return feeding / len(payloads) / len(wands), numpy.median(ticking), noticed
+
+def main(counts=(10, 100, 500)):
+    print("{} Hz, {} ms ticks over a {} ms window, 85% flick up at {} s".format(RATE, TICK_MS, WINDOW_MS, FLICK_AT))
+    print(" wands  method      us/sample   ms/tick   noticed after ms")
+    for count in counts:
+        payloads = positions(count, numpy.random.default_rng(count))
+        for name, method in (("per wand", per_wand), ("aggregator", aggregated)):
+            wands = [FakeWand(FakeDevice("Kano-Wand-{:03d}".format(i))) for i in range(count)]
+            hub = WandHub(wands)
+            hub.start(daemon=True)
+            for wand in wands:
+                wand.connect()
+            sample, tick, noticed = method(wands, payloads)
+            hub.stop()
+            print("{:6d}  {}{:9.2f}{:10.3f}{:>12}".format(count, name.ljust(10), sample * 1e6, tick * 1000,
+                "never" if noticed is None else "{:.0f}".format(noticed * 1000)))
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or (10, 100, 500))
@@ -0,0 +1,141 @@
+# Throughput of WandBridge on localhost
+#
+# Fake wands are fed position samples as fast as the bridge takes them. A UDP
+# client subscribes to every wand and a WebSocket client to half of them, and
+# both count the records and frames they receive and any sequence gaps.
+#
+#   python benchmarks/bridge.py [seconds] [wands]
+
+import base64
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from kano_wand import FakeWand, WandBridge, decode_frame
+
+class Counter(object):
+    def __init__(self):
+        self.records = 0
+        self.frames = 0
+        self.bytes = 0
+        self.gaps = 0
+        self.seq = {}
+
+    def frame(self, data):
+        self.frames += 1
+        self.bytes += len(data)
+        for _, wand, seq, _, _ in decode_frame(data):
+            last = self.seq.get(wand)
+            if last is not None and seq != last + 1:
+                self.gaps += 1
+            self.seq[wand] = seq
+            self.records += 1
+
+def udp_client(address, counter, stop):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.settimeout(0.1)
+    sock.sendto(json.dumps({"subscribe": None}).encode("utf-8"), address)
+    while not stop.is_set():
+        try:
+            data = sock.recv(65536)
+        except socket.timeout:
+            continue
+        if data.startswith(b"{"):
+            continue
+        counter.frame(data)
+    sock.close()
+
+def recv_exactly(sock, count):
+    data = b""
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+def websocket_client(address, wands, counter, stop):
+    sock = socket.create_connection(address)
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+    sock.sendall((
+        "GET / HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        "Sec-WebSocket-Key: {}\r\nSec-WebSocket-Version: 13\r\n\r\n".format(key)
+    ).encode("ascii"))
+    response = b""
+    while b"\r\n\r\n" not in response:
+        response += sock.recv(1)
+
+    message = json.dumps({"subscribe": wands}).encode("utf-8")
+    mask = os.urandom(4)
+    sock.sendall(struct.pack("!BB", 0x81, 0x80 | len(message)) + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(message)))
+
+    sock.settimeout(0.1)
+    while not stop.is_set():
+        try:
+            header = recv_exactly(sock, 2)
+        except socket.timeout:
+            continue
+        except EOFError:
+            break
+        sock.settimeout(None)
+        length = header[1] & 0x7f
+        if length == 126:
+            length = struct.unpack("!H", recv_exactly(sock, 2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", recv_exactly(sock, 8))[0]
+        payload = recv_exactly(sock, length)
+        sock.settimeout(0.1)
+        if header[0] & 0x0f == 0x2:
+            counter.frame(payload)
+    sock.close()
+
+def main(seconds=3.0, count=10):
+    wands = [FakeWand() for _ in range(count)]
+    for wand in wands:
+        wand.connect()
+    bridge = WandBridge(wands, udp_port=0, ws_port=0)
+    bridge.start()
+
+    stop = threading.Event()
+    udp, ws = Counter(), Counter()
+    clients = [
+        threading.Thread(target=udp_client, args=(bridge.udp_address, udp, stop)),
+        threading.Thread(target=websocket_client, args=(bridge.ws_address, list(range(0, count, 2)), ws, stop)),
+    ]
+    for client in clients:
+        client.start()
+    time.sleep(0.3)
+
+    sent = 0
+    data = struct.pack("<4h", 1, 2, 3, 4)
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for wand in wands:
+            wand.handleNotification(41, data)
+        sent += count
+        # Roughly 1 kHz per wand, well past what a real wand sends
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    time.sleep(0.3)
+    stop.set()
+    for client in clients:
+        client.join()
+    bridge.stop()
+    for wand in wands:
+        wand.disconnect()
+
+    print("{} wands, {} samples in {:.2f}s ({:.0f}/s)".format(count, sent, elapsed, sent / elapsed))
+    for name, counter in (("udp", udp), ("websocket", ws)):
+        print("{}{:9d} records {:7d} frames {:6.1f} bytes/record {:8.0f} records/s  gaps {}".format(
+            name.ljust(10), counter.records, counter.frames, counter.bytes / max(counter.records, 1),
+            counter.records / elapsed, counter.gaps))
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 3.0, int(sys.argv[2]) if len(sys.argv) > 2 else 10)
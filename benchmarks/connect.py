@@ -0,0 +1,35 @@
+# Connect time per wand with full GATT discovery versus the handle cache
+#
+# Needs real wands in range. The cache is written to a temporary file so the
+# first connect always discovers and the second one uses the cache.
+#
+#   python benchmarks/connect.py [timeout]
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from kano_wand import HandleCache, Shop
+
+def main(timeout=3.0):
+    cache = HandleCache(os.path.join(tempfile.mkdtemp(), "handles.json"))
+    shop = Shop(handle_cache=cache)
+    wands = shop.scan(timeout=timeout)
+    if len(wands) == 0:
+        print("No wands found")
+        return
+
+    print("wand                 discover s   cached s")
+    for wand in wands:
+        times = []
+        for _ in range(2):
+            wand.connect()
+            times.append((wand.connect_time, wand.handles_cached))
+            wand.disconnect()
+        (discover, _), (cached, hit) = times
+        print("{}{:11.3f}{:11.3f}{}".format(wand.name.ljust(21), discover, cached, "" if hit else "  (cache missed)"))
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 3.0)
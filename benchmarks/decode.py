@@ -0,0 +1,47 @@
+# Micro-benchmark for position decoding
+#
+# Compares the original per-sample numpy decode against the struct fast path
+# and the batched numpy.frombuffer decoder.
+#
+#   python benchmarks/decode.py [samples]
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from kano_wand import decode_position, decode_positions
+
+def legacy_decode(data):
+    """The per-sample decode Wand._on_position used to do"""
+    y = numpy.int16(numpy.uint16(int.from_bytes(data[0:2], byteorder='little')))
+    x = -1 * numpy.int16(numpy.uint16(int.from_bytes(data[2:4], byteorder='little')))
+    w = -1 * numpy.int16(numpy.uint16(int.from_bytes(data[4:6], byteorder='little')))
+    z = numpy.int16(numpy.uint16(int.from_bytes(data[6:8], byteorder='little')))
+    return x, y, z, w
+
+def main(samples=10000):
+    rng = numpy.random.default_rng(0)
+    raw = rng.integers(-1000, 1000, size=(samples, 4), dtype=numpy.int16).astype("<i2")
+    buffer = raw.tobytes()
+    payloads = [buffer[i * 8:(i + 1) * 8] for i in range(samples)]
+
+    # Sanity check that every path agrees before timing anything
+    batch = decode_positions(buffer)
+    for i in (0, samples // 2, samples - 1):
+        assert tuple(legacy_decode(payloads[i])) == decode_position(payloads[i]) == tuple(batch[i])
+
+    repeat = 5
+    legacy = min(timeit.repeat(lambda: [legacy_decode(p) for p in payloads], number=1, repeat=repeat))
+    fast = min(timeit.repeat(lambda: [decode_position(p) for p in payloads], number=1, repeat=repeat))
+    batched = min(timeit.repeat(lambda: decode_positions(buffer), number=1, repeat=repeat))
+
+    print("Decoding {} samples".format(samples))
+    for name, seconds in (("legacy", legacy), ("struct", fast), ("batch", batched)):
+        print("{}{:10.1f} ns/sample{:8.1f}x".format(
+            name.ljust(8), seconds / samples * 1e9, legacy / seconds))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,85 @@
+# How many simulated wands one host handles before callbacks lag
+#
+# Runs a WandSimulator with more and more wands, each with a position callback
+# that works out where the wand points and a button callback. Reports the host
+# CPU per wand, leaving out the simulator's own driver thread, and the latency
+# from a sample being taken, or reaching the host, to its callbacks returning.
+# The largest fleet whose p99 dispatch latency stays within the target is
+# narrowed down by bisecting. The driver shares the GIL with the wands, so the
+# result is a lower bound of what the host manages with real radios.
+#
+#   python benchmarks/fleet.py [seconds] [target_ms] [max_wands]
+
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from kano_wand import WandSimulator
+
+RATE = 100
+
+def run(count, seconds):
+    with WandSimulator(count, rate=RATE, seed=count) as simulator:
+        pointed = [0]
+        def on_position(x, y, z, w):
+            # Heading and pitch, about what a pointer callback does per sample
+            norm = math.sqrt(x * x + y * y + z * z + w * w) or 1
+            x, y, z, w = x / norm, y / norm, z / norm, w / norm
+            heading = math.atan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+            pitch = math.asin(max(-1, min(1, 2 * (w * y - x * z))))
+            pointed[0] += heading > 0 and pitch > 0
+        for wand in simulator.wands:
+            wand.on("position", on_position)
+            wand.on("button", lambda pressed: None)
+
+        time.sleep(min(1.0, seconds / 4))
+        simulator.reset()
+        start = time.monotonic()
+        cpu = time.process_time()
+        time.sleep(seconds)
+        cpu = time.process_time() - cpu - simulator.driver_cpu
+        elapsed = time.monotonic() - start
+        return simulator.stats(), cpu, elapsed
+
+def measure(count, seconds, target_ms):
+    stats, cpu, elapsed = run(count, seconds)
+    latency = stats["latency"]
+    dispatch = stats["dispatch_latency"]
+    # Falling behind shows up as missing notifications before the latency catches up
+    kept_up = stats["delivered"] >= 0.95 * count * RATE * elapsed
+    ok = kept_up and dispatch["p99_ms"] is not None and dispatch["p99_ms"] <= target_ms
+    print("{:6d}{:12.3f}{:8.1f}%{:10.1f}{:8.1f}{:10.2f}{:8.2f}  {}".format(
+        count, cpu / elapsed / count * 1000, cpu / elapsed * 100,
+        latency["p50_ms"] or 0, latency["p99_ms"] or 0, dispatch["p50_ms"] or 0, dispatch["p99_ms"] or 0,
+        "ok" if ok else "lagging" if kept_up else "behind"))
+    return ok
+
+def main(seconds=5.0, target_ms=5.0, most=1600):
+    print("{} Hz per wand, p99 dispatch target {} ms, {} s per run".format(RATE, target_ms, seconds))
+    print(" wands  cpu ms/s/wand  host cpu  e2e p50     p99  disp p50     p99")
+    good = 0
+    bad = None
+    count = 25
+    while count <= most:
+        if not measure(count, seconds, target_ms):
+            bad = count
+            break
+        good = count
+        count *= 2
+
+    while bad is not None and bad - good > max(good // 8, 1):
+        count = (good + bad) // 2
+        if measure(count, seconds, target_ms):
+            good = count
+        else:
+            bad = count
+
+    print("most wands within {} ms: {}{}".format(target_ms, good, "" if bad is not None else " (stopped at {})".format(most)))
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5.0,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 5.0,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 1600)
@@ -0,0 +1,119 @@
+# A hub per wand (one thread each) versus a single WandHub for every wand
+#
+# Each fake wand's bluepy connection gets a pipe standing in for the bluepy
+# helper, so the real bluepy parsing and Wand.handleNotification path runs
+# without a radio. One
+# producer thread writes position notifications to every pipe at a fixed rate.
+#
+# This reaches into bluepy's Peripheral (its _helper and _poller), so it needs
+# bluepy installed and isn't run in CI like the fake backend benchmarks are.
+#
+#   python benchmarks/hub.py [seconds] [rate_hz]
+
+import binascii
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from kano_wand import Wand, WandHub, _HelperOutput
+
+try:
+    import bluepy.btle
+except ImportError:
+    sys.exit("benchmarks/hub.py needs bluepy installed")
+
+class FakeDevice(object):
+    """Just enough of a bluepy.ScanEntry to build a Wand"""
+    def __init__(self, index):
+        self.addr = "00:00:00:00:{:02x}:{:02x}".format(index >> 8, index & 255)
+        self.rssi = -50
+
+    def getValueText(self, sdid):
+        return "Kano-Wand-{}".format(self.addr[-5:])
+
+class FakeHelper(object):
+    """Stands in for the bluepy-helper subprocess"""
+    def __init__(self):
+        read, write = os.pipe()
+        self.stdout = _HelperOutput(os.fdopen(read, "r"))
+        self.writer = write
+
+    def poll(self):
+        return None
+
+def fake_wand(index):
+    wand = Wand(FakeDevice(index), backend="bluepy")
+    helper = FakeHelper()
+    connection = wand.connection
+    connection._helper = helper
+    connection._poller = select.poll()
+    connection._poller.register(helper.stdout, select.POLLIN)
+    wand.connected = True
+    return wand
+
+def notification(seq):
+    data = struct.pack("<4h", 0, -(seq % 32768), 0, 0)
+    return "rsp=$ntfy hnd=h29 d=b{}\n".format(binascii.b2a_hex(data).decode("utf-8")).encode("utf-8")
+
+def run(count, use_hub, seconds, rate):
+    wands = [fake_wand(i) for i in range(count)]
+    sent = [[] for _ in wands]
+    latencies = []
+
+    def receiver(index):
+        def callback(x, y, z, w):
+            latencies.append(time.perf_counter() - sent[index][x])
+        return callback
+
+    for i, wand in enumerate(wands):
+        wand._position_callbacks[i] = receiver(i)
+
+    if use_hub:
+        hubs = [WandHub(wands)]
+    else:
+        hubs = [WandHub([wand]) for wand in wands]
+    for hub in hubs:
+        hub.start()
+    threads = threading.active_count()
+
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    seq = 0
+    while time.perf_counter() - start < seconds:
+        for i, wand in enumerate(wands):
+            sent[i].append(time.perf_counter())
+            os.write(wand.connection._helper.writer, notification(seq))
+        seq += 1
+        time.sleep(max(0, start + seq / rate - time.perf_counter()))
+    time.sleep(0.1)
+    cpu = time.process_time() - start_cpu
+
+    for hub in hubs:
+        hub.stop()
+    for wand in wands:
+        wand.connected = False
+        helper = wand.connection._helper
+        os.close(helper.writer)
+        helper.stdout.close()
+        wand.connection._helper = None
+
+    latencies = numpy.array(latencies) * 1000
+    return threads, len(latencies), cpu, numpy.percentile(latencies, 50), numpy.percentile(latencies, 99)
+
+def main(seconds=3.0, rate=100):
+    print("{} Hz per wand for {} s".format(rate, seconds))
+    print("mode      wands threads  delivered   cpu s   p50 ms   p99 ms")
+    for count in (1, 10, 50):
+        for use_hub in (False, True):
+            threads, delivered, cpu, p50, p99 = run(count, use_hub, seconds, rate)
+            print("{}{:6d}{:8d}{:11d}{:8.2f}{:9.3f}{:9.3f}".format(
+                ("hub" if use_hub else "thread").ljust(8), count, threads, delivered, cpu, p50, p99))
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 3.0, int(sys.argv[2]) if len(sys.argv) > 2 else 100)
@@ -0,0 +1,65 @@
+# Import time of kano_wand and the heavy modules it only loads when needed
+#
+# A module is only imported once per process, so every measurement runs in a
+# fresh interpreter and the best of several runs is kept. With --check it exits
+# with an error if importing kano_wand pulls in numpy or bluepy.
+#
+#   python benchmarks/imports.py [runs] [--check]
+
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+HEAVY = ("numpy", "bluepy", "asyncio", "concurrent.futures", "multiprocessing.shared_memory", "socket")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+CASES = (
+    ("kano_wand", "import kano_wand"),
+    ("FakeWand", "import kano_wand; kano_wand.FakeWand()"),
+    ("position_batch", "import kano_wand; kano_wand.FakeWand().position_buffer.latest(1)"),
+    ("numpy", "import numpy"),
+    ("bluepy", "import bluepy.btle"),
+)
+
+def measure(statement, runs):
+    best = None
+    loaded = None
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", PROBE.format(statement=statement, heavy=HEAVY)],
+            cwd=ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None, None
+        result = json.loads(result.stdout)
+        best = result["seconds"] if best is None else min(best, result["seconds"])
+        loaded = result["loaded"]
+    return best, loaded
+
+def main(runs=5, check=False):
+    print("case               best ms  loaded")
+    results = {}
+    for name, statement in CASES:
+        seconds, loaded = measure(statement, runs)
+        results[name] = loaded
+        if seconds is None:
+            print("{}{:>9}".format(name.ljust(17), "missing"))
+        else:
+            print("{}{:9.1f}  {}".format(name.ljust(17), seconds * 1000, ", ".join(loaded) or "-"))
+
+    if check:
+        loaded = [name for name in results["kano_wand"] or [] if name in ("numpy", "bluepy")]
+        if results["kano_wand"] is None or loaded:
+            print("import kano_wand failed or loaded {}".format(", ".join(loaded)))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--check"]
+    main(int(args[0]) if args else 5, "--check" in sys.argv[1:])
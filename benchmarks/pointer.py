@@ -0,0 +1,50 @@
+# Cost and jitter of the pointer pipeline
+#
+# A synthetic wand sweeps slowly left and right with sensor noise added. The
+# per-sample cost is the latency PointerFilter adds to every position callback.
+#
+#   python benchmarks/pointer.py [samples]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from kano_wand import PointerFilter, quaternion_pointer
+
+def sweep(samples, rate=100, noise=0.004):
+    """Quaternions turning about the vertical axis, scaled like the wand's"""
+    t = numpy.arange(samples) / rate
+    heading = numpy.radians(20) * numpy.sin(t)
+    q = numpy.zeros((samples, 4))
+    q[:, 2] = numpy.sin(heading / 2)
+    q[:, 3] = numpy.cos(heading / 2)
+    q += numpy.random.default_rng(0).normal(0, noise, q.shape)
+    timestamps = (t * 1e9).astype(numpy.int64)
+    return timestamps, (q * 1000).astype(numpy.int16)
+
+def main(samples=5000):
+    timestamps, quaternions = sweep(samples)
+
+    pointer = PointerFilter()
+    start = time.perf_counter()
+    single = [pointer.update(timestamps[i], *quaternions[i].tolist()) for i in range(samples)]
+    per_sample = (time.perf_counter() - start) / samples
+
+    pointer = PointerFilter()
+    start = time.perf_counter()
+    batch = pointer.process(timestamps, quaternions)
+    per_batch = (time.perf_counter() - start) / samples
+    assert numpy.allclose(batch, numpy.array(single))
+
+    raw = quaternion_pointer(quaternions)
+    jitter = lambda x: numpy.std(numpy.diff(x, n=2))
+    print("{} samples".format(samples))
+    print("update   {:8.1f} us/sample".format(per_sample * 1e6))
+    print("process  {:8.1f} us/sample".format(per_batch * 1e6))
+    print("jitter   {:8.5f} raw, {:.5f} filtered".format(jitter(raw[:, 0]), jitter(batch[:, 0])))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,55 @@
+# Prediction error of MotionPredictor on a trace
+#
+# Without a trace a synthetic one is written: the wand sweeps back and forth
+# while notifications arrive every 15-30 ms, like a busy BLE link. Every
+# look-ahead is scored against the trace itself; "held" is the error of using
+# the newest sample as is, which is what happens without prediction.
+#
+#   python benchmarks/predict.py [trace]
+
+import math
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from kano_wand import MotionPredictor, TraceWriter, evaluate_predictor
+
+def synthetic_trace(path, seconds=30):
+    rng = numpy.random.default_rng(0)
+    with TraceWriter(path) as trace:
+        t = 0.0
+        while t < seconds:
+            heading = math.radians(45) * math.sin(2 * t) + math.radians(10) * math.sin(5.3 * t)
+            x, y, z, w = 0, 0, math.sin(heading / 2), math.cos(heading / 2)
+            # The wire order and signs decode_position undoes
+            data = struct.pack("<4h", int(y * 1000), int(-x * 1000), int(-w * 1000), int(z * 1000))
+            trace.write(int(t * 1e9), 41, data)
+            t += rng.uniform(0.015, 0.03)
+
+def main(path=None):
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "synthetic.kwt")
+        synthetic_trace(path)
+        print("Wrote synthetic trace to {}".format(path))
+
+    print("lookahead ms  predicted deg   p95   held deg   p95")
+    for lookahead in (None, 10, 20, 40, 80):
+        result = evaluate_predictor(path, MotionPredictor(lookahead_ms=lookahead))
+        label = "auto {:.1f}".format(result["lookahead_ms"]) if lookahead is None else str(lookahead)
+        print("{}{:15.3f}{:7.3f}{:11.3f}{:7.3f}".format(label.ljust(12), result["error_deg"],
+            result["error_p95_deg"], result["held_error_deg"], result["held_error_p95_deg"]))
+
+    predictor = MotionPredictor()
+    start = time.perf_counter()
+    for i in range(10000):
+        predictor.update(i * 20000000, 0, 0, math.sin(i / 100), math.cos(i / 100))
+        predictor.predict(i * 20000000)
+    print("update + predict {:.1f} us".format((time.perf_counter() - start) / 10000 * 1e6))
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,99 @@
+# Availability of a fleet of fake wands that keep dropping, with and without a WandSupervisor
+#
+# Every wand gets position notifications at a fixed rate while it's connected.
+# Each second a wand drops with some probability and stays out of range for up
+# to two seconds. Without a supervisor a dropped wand stays down; with one it's
+# reconnected with its subscriptions restored. Delivered counts the callbacks
+# that ran, so a subscription restored twice would show up as more than 100%.
+# Finally checks that a wand disconnected on purpose after dropping stays
+# disconnected, without keep alives.
+#
+#   python benchmarks/recover.py [seconds] [wands] [drop_probability]
+
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from kano_wand import FakeDevice, FakeWand, WandHub, WandSupervisor
+
+RATE = 100
+
+def run(seconds, count, probability, supervise):
+    wands = [FakeWand(FakeDevice("Kano-Wand-{:02d}".format(i), "00:00:00:00:00:{:02x}".format(i))) for i in range(count)]
+    hub = WandHub(wands)
+    hub.start(daemon=True)
+    delivered = [0]
+    for wand in wands:
+        wand.connect()
+        wand.on("position", lambda x, y, z, w: delivered.__setitem__(0, delivered[0] + 1))
+    supervisor = None
+    if supervise:
+        supervisor = WandSupervisor(wands, keep_alive=1.0, min_backoff=0.05, max_backoff=1.0)
+        supervisor.start()
+
+    rng = random.Random(0)
+    data = struct.pack("<4h", 0, 0, 0, 1000)
+    drops = 0
+    start = time.monotonic()
+    tick = 0
+    while time.monotonic() - start < seconds:
+        if tick % RATE == 0:
+            for wand in wands:
+                if wand.connected and rng.random() < probability:
+                    wand.drop(down=rng.uniform(0, 2))
+                    drops += 1
+        for wand in wands:
+            if wand.connected:
+                wand.handleNotification(41, data)
+        tick += 1
+        time.sleep(max(0, start + tick / RATE - time.monotonic()))
+
+    stats = supervisor.stats() if supervisor is not None else {}
+    if supervisor is not None:
+        supervisor.stop()
+    hub.stop()
+    return drops, delivered[0] / (tick * count), stats
+
+def disconnect_after_drop():
+    """A supervisor mustn't reconnect a wand that was disconnected after it dropped"""
+    wand = FakeWand()
+    wand.connect()
+    wand.on("position", lambda x, y, z, w: None)
+    supervisor = WandSupervisor([wand], keep_alive=0.1, min_backoff=0.05, max_backoff=0.1)
+    supervisor.start()
+    wand.drop(down=0.2)
+    wand.disconnect()
+    writes = len(wand.writes)
+    time.sleep(1.0)
+    supervisor.stop()
+    ok = not wand.connected and len(wand.writes) == writes
+    print("disconnect after a drop: {}".format("stays disconnected" if ok else
+        "reconnected={} writes since={}".format(wand.connected, len(wand.writes) - writes)))
+    return ok
+
+def main(seconds=10.0, count=20, probability=0.05):
+    print("{} wands at {} Hz for {} s, {:.0%} chance of dropping each second".format(count, RATE, seconds, probability))
+    print("mode          drops  delivered  recovered  recover p50 ms  p99 ms  max ms")
+    for supervise in (False, True):
+        drops, delivered, stats = run(seconds, count, probability, supervise)
+        if supervise:
+            recovers = [wand["time_to_recover"] for wand in stats.values() if wand["time_to_recover"]["count"]]
+            recovered = sum(recover["count"] for recover in recovers)
+            # Merged per-wand percentiles are only a rough fleet summary
+            p50 = sorted(recover["p50_ms"] for recover in recovers)[len(recovers) // 2] if recovers else 0
+            p99 = max(recover["p99_ms"] for recover in recovers) if recovers else 0
+            worst = max(recover["max_ms"] for recover in recovers) if recovers else 0
+            print("supervised{:9d}{:10.1%}{:11d}{:16.1f}{:8.1f}{:8.1f}".format(drops, delivered, recovered, p50, p99, worst))
+        else:
+            print("none      {:9d}{:10.1%}".format(drops, delivered))
+    if not disconnect_after_drop():
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 10.0,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+        float(sys.argv[3]) if len(sys.argv) > 3 else 0.05)
@@ -0,0 +1,81 @@
+# Matching advertisements against large allow-lists, and a background scan of a venue
+#
+# Times WandFilter.match against a linear check of every MAC, name and prefix
+# on the lists, for advertisements that mostly aren't on them. Then runs a
+# background scan over fake wands that come and go and reports how long the
+# registry took to notice them, next to the blocking scans it replaces.
+#
+#   python benchmarks/registry.py [list_size] [wands]
+
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from kano_wand import FakeBackend, FakeDevice, Shop, WandFilter
+
+def mac(i):
+    return ":".join("{:02x}".format(i >> shift & 0xff) for shift in (40, 32, 24, 16, 8, 0))
+
+def linear_match(macs, names, prefixes, address, name):
+    if address.lower() in macs:
+        return True
+    if name is None:
+        return False
+    return any(name == n for n in names) or any(name.startswith(p) for p in prefixes)
+
+def match(size):
+    rng = random.Random(0)
+    macs = [mac(rng.getrandbits(48)).upper() for _ in range(size)]
+    names = ["Venue-Wand-{}".format(i) for i in range(size)]
+    prefixes = ["Team{}-".format(i) for i in range(size // 10)]
+    ads = [(mac(rng.getrandbits(48)), "Phone-{}".format(i)) for i in range(900)]
+    ads += [(macs[i].lower(), None) for i in range(50)] + [(mac(i), names[i]) for i in range(25)] + [(mac(i), prefixes[i % len(prefixes)] + "x") for i in range(25)]
+    allow = WandFilter(names, prefixes, macs)
+    lower = [m.lower() for m in macs]
+    assert [allow.match(*ad) for ad in ads] == [linear_match(lower, names, prefixes, *ad) for ad in ads]
+
+    repeat = 5
+    linear = min(timeit.repeat(lambda: [linear_match(lower, names, prefixes, *ad) for ad in ads], number=1, repeat=repeat)) / len(ads)
+    indexed = min(timeit.repeat(lambda: [allow.match(*ad) for ad in ads], number=1, repeat=repeat)) / len(ads)
+    print("{} MACs, {} names, {} prefixes".format(len(macs), len(names), len(prefixes)))
+    print("linear     {:10.2f} us/advertisement".format(linear * 1e6))
+    print("WandFilter {:10.2f} us/advertisement {:8.1f}x".format(indexed * 1e6, linear / indexed))
+
+def venue(count):
+    devices = [FakeDevice("Kano-Wand-{:03d}".format(i), mac(i), -60) for i in range(count)]
+    backend = FakeBackend(devices[:count // 2])
+    shop = Shop(backend=backend)
+
+    start = time.monotonic()
+    shop.scan(timeout=0.2)
+    blocking = time.monotonic() - start
+
+    appeared = {}
+    disappeared = {}
+    shop.on("appear", lambda wand: appeared.setdefault(wand.name, time.monotonic()))
+    shop.on("disappear", lambda wand: disappeared.setdefault(wand.name, time.monotonic()))
+    shop.start_scanning(forget_after=0.5)
+    time.sleep(0.3)
+    changed = time.monotonic()
+    backend.devices[:] = devices[count // 2:]
+    while len(disappeared) < count // 2 and time.monotonic() - changed < 5:
+        time.sleep(0.05)
+    shop.stop_scanning()
+
+    arrivals = [appeared[device.name] - changed for device in devices[count // 2:] if device.name in appeared]
+    departures = [disappeared[device.name] - changed for device in devices[:count // 2] if device.name in disappeared]
+    print("{} wands, half of them replaced after 0.3 s of background scanning".format(count))
+    print("blocking scan        {:8.1f} ms, every time".format(blocking * 1000))
+    print("appeared {:4d}, worst {:8.1f} ms after arriving".format(len(arrivals), max(arrivals) * 1000))
+    print("left     {:4d}, worst {:8.1f} ms after leaving, forget_after 500 ms".format(len(departures), max(departures) * 1000))
+
+def main(size=10000, count=200):
+    match(size)
+    venue(count)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000, int(sys.argv[2]) if len(sys.argv) > 2 else 200)
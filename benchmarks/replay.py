@@ -0,0 +1,55 @@
+# Replay a notification trace through a FakeWand as fast as possible
+#
+# Without a trace a synthetic one is written first: position samples at
+# 100 Hz with a button press every second. Every run is repeated with
+# telemetry enabled to show what it costs.
+#
+#   python benchmarks/replay.py [trace] [callbacks]
+
+import math
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from kano_wand import FakeWand, TraceWriter
+
+def synthetic_trace(path, seconds=60, rate=100):
+    with TraceWriter(path) as trace:
+        start = time.monotonic_ns()
+        for i in range(seconds * rate):
+            timestamp = start + i * 1000000000 // rate
+            angle = i / rate
+            y, x, w, z = (int(1000 * math.sin(angle)), int(1000 * math.cos(angle)), 0, 0)
+            trace.write(timestamp, 41, struct.pack("<4h", y, -x, -w, z))
+            if i % rate == 0:
+                trace.write(timestamp, 33, bytes([1 - (i // rate) % 2]))
+
+def replay(path, callbacks, telemetry=False):
+    wand = FakeWand(telemetry=telemetry)
+    wand.connect()
+    for _ in range(callbacks):
+        wand.on("position", lambda x, y, z, w: None)
+    start = time.perf_counter()
+    count = wand.replay(path, speed=None)
+    elapsed = time.perf_counter() - start
+    wand.disconnect()
+    return count, elapsed
+
+def main(path=None, callbacks=1):
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "synthetic.kwt")
+        synthetic_trace(path)
+        print("Wrote synthetic trace to {}".format(path))
+
+    for count in sorted({0, callbacks}):
+        for telemetry in (False, True):
+            notifications, seconds = replay(path, count, telemetry)
+            print("{} callbacks{}: {} notifications in {:.3f}s, {:.2f} us each".format(
+                count, ", telemetry" if telemetry else "", notifications, seconds, seconds / notifications * 1e6))
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None, int(sys.argv[2]) if len(sys.argv) > 2 else 1)
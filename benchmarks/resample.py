@@ -0,0 +1,85 @@
+# Resampling bursty position notifications to a uniform rate
+#
+# Notifications are simulated the way BLE delivers them: a few per connection
+# interval, bunched together, with the odd interval lost. Compares a per-sample
+# Python interpolation loop against the vectorized resample(), checks the
+# streaming Resampler matches it, and shows what RateEstimator makes of the rate.
+#
+#   python benchmarks/resample.py [samples] [rate_hz]
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from kano_wand import RateEstimator, Resampler, resample
+
+def bursty_timestamps(samples, rate, rng):
+    """Three notifications per connection interval, 1% of intervals lost"""
+    interval = int(3e9 / rate)
+    timestamps = []
+    t = 0
+    while len(timestamps) < samples:
+        t += interval
+        if rng.random() < 0.01:
+            continue
+        timestamps.extend(t + rng.integers(0, 200000, 3).cumsum())
+    return numpy.array(timestamps[:samples], dtype=numpy.int64)
+
+def loop_resample(timestamps, values, rate):
+    """The obvious per-output-sample implementation"""
+    period = 1e9 / rate
+    out_t = []
+    out_v = []
+    i = 0
+    t = timestamps[0]
+    while t <= timestamps[-1]:
+        while i + 1 < len(timestamps) and timestamps[i + 1] <= t:
+            i += 1
+        j = min(i + 1, len(timestamps) - 1)
+        span = timestamps[j] - timestamps[i]
+        fraction = (t - timestamps[i]) / span if span else 0
+        out_t.append(t)
+        out_v.append([a + (b - a) * fraction for a, b in zip(values[i], values[j])])
+        t = timestamps[0] + round(len(out_t) * period)
+    return out_t, out_v
+
+def main(samples=20000, rate=100):
+    rng = numpy.random.default_rng(0)
+    timestamps = bursty_timestamps(samples, rate, rng)
+    angles = timestamps / 1e9
+    values = numpy.stack([numpy.sin(angles), numpy.cos(angles), numpy.sin(angles / 2), numpy.cos(angles / 2)], 1) * 1000
+
+    estimator = RateEstimator()
+    for timestamp in timestamps.tolist():
+        estimator.update(timestamp)
+    gaps = numpy.diff(timestamps)
+    print("{} samples, {:.1f} Hz actual, {:.1f} Hz estimated, intervals {:.2f} to {:.2f} ms".format(
+        samples, (samples - 1) / (timestamps[-1] - timestamps[0]) * 1e9, estimator.rate, gaps.min() / 1e6, gaps.max() / 1e6))
+
+    grid, resampled = resample(timestamps, values, rate)
+    loop_grid, loop_values = loop_resample(timestamps.tolist(), values.tolist(), rate)
+    assert numpy.array_equal(grid, loop_grid) and numpy.allclose(resampled, loop_values)
+
+    resampler = Resampler(rate, max_gap_ms=None, quaternion=False)
+    batches = [resampler.process(timestamps[i:i + 32], values[i:i + 32]) for i in range(0, samples, 32)]
+    assert numpy.array_equal(numpy.concatenate([batch[0] for batch in batches]), grid)
+    assert numpy.allclose(numpy.concatenate([batch[1] for batch in batches]), resampled)
+
+    repeat = 5
+    loop = min(timeit.repeat(lambda: loop_resample(timestamps.tolist(), values.tolist(), rate), number=1, repeat=repeat))
+    vectorized = min(timeit.repeat(lambda: resample(timestamps, values, rate), number=1, repeat=repeat))
+    def stream():
+        resampler = Resampler(rate, quaternion=False)
+        for i in range(0, samples, 32):
+            resampler.process(timestamps[i:i + 32], values[i:i + 32])
+    streaming = min(timeit.repeat(stream, number=1, repeat=repeat))
+
+    print("{} output samples at {} Hz".format(len(grid), rate))
+    for name, seconds in (("loop", loop), ("resample", vectorized), ("stream/32", streaming)):
+        print("{}{:10.3f} us/sample{:8.1f}x".format(name.ljust(10), seconds / len(grid) * 1e6, loop / seconds))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000, int(sys.argv[2]) if len(sys.argv) > 2 else 100)
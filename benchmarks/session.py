@@ -0,0 +1,104 @@
+# Recording a long session: tuples in a list then pickle, versus SessionWriter
+#
+# Fake wands replay synthetic 100 Hz positions as fast as possible. Reports
+# the peak Python memory while recording, the time per sample and the file
+# size, then how long SessionReader takes to open the file and read one
+# column over a tenth of it.
+#
+#   python benchmarks/session.py [minutes] [wands]
+
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+from kano_wand import FakeDevice, FakeWand, SessionReader, SessionWriter
+
+RATE = 100
+
+def fake_wands(count):
+    wands = [FakeWand(FakeDevice("Kano-Wand-{:02d}".format(i), "00:00:00:00:00:{:02x}".format(i))) for i in range(count)]
+    for wand in wands:
+        wand.connect()
+    return wands
+
+def feed(wands, samples):
+    payloads = [struct.pack("<4h", i % 2000 - 1000, i % 700, 0, 1000) for i in range(1000)]
+    for i in range(samples):
+        payload = payloads[i % 1000]
+        for wand in wands:
+            wand.handleNotification(41, payload)
+        if i % RATE == 0:
+            for wand in wands:
+                wand.handleNotification(33, bytes([i // RATE % 2]))
+
+def record_tuples(wands, samples, path):
+    rows = []
+    for wand in wands:
+        wand.on("position", lambda timestamp, sequence, x, y, z, w, mac=wand._dev.addr: rows.append((timestamp, mac, x, y, z, w)), timestamped=True)
+        wand.on("button", lambda timestamp, sequence, pressed, mac=wand._dev.addr: rows.append((timestamp, mac, pressed)), timestamped=True)
+    feed(wands, samples)
+    with open(path, "wb") as file:
+        pickle.dump(rows, file)
+    return len(rows)
+
+def record_session(wands, samples, path):
+    with SessionWriter(path) as session:
+        for wand in wands:
+            session.attach(wand)
+        feed(wands, samples)
+    return session.rows
+
+def measure(record, count, samples, path):
+    wands = fake_wands(count)
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = record(wands, samples, path)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    for wand in wands:
+        wand.disconnect()
+    return rows, seconds, peak, os.path.getsize(path)
+
+def main(minutes=5.0, count=4):
+    samples = int(minutes * 60 * RATE)
+    directory = tempfile.mkdtemp()
+    print("{} wands, {} minutes at {} Hz".format(count, minutes, RATE))
+    print("method       rows   us/row   peak MB   file MB")
+    paths = {}
+    for name, record in (("pickle", record_tuples), ("session", record_session)):
+        paths[name] = os.path.join(directory, name)
+        rows, seconds, peak, size = measure(record, count, samples, paths[name])
+        print("{}{:9d}{:9.2f}{:10.1f}{:10.1f}".format(name.ljust(8), rows, seconds / rows * 1e6, peak / 1e6, size / 1e6))
+
+    start = time.perf_counter()
+    with open(paths["pickle"], "rb") as file:
+        pickle.load(file)
+    unpickle = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reader = SessionReader(paths["session"])
+    opened = time.perf_counter() - start
+    start = time.perf_counter()
+    everything = reader.read()
+    full = time.perf_counter() - start
+    middle = (reader.start + reader.stop) // 2
+    start = time.perf_counter()
+    window = reader.read(["position"], start=middle, stop=middle + (reader.stop - reader.start) // 10)
+    windowed = time.perf_counter() - start
+    print("unpickle everything {:8.1f} ms".format(unpickle * 1000))
+    print("open session        {:8.1f} ms".format(opened * 1000))
+    print("read everything     {:8.1f} ms  {} rows".format(full * 1000, len(everything["timestamp"])))
+    print("read a slice        {:8.1f} ms  {} rows of one column".format(windowed * 1000, len(window["position"])))
+    del window, everything
+    reader.close()
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5.0, int(sys.argv[2]) if len(sys.argv) > 2 else 4)
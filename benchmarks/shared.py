@@ -0,0 +1,80 @@
+# Fan-out of position samples to other processes: pipes versus shared memory
+#
+# The pipe path sends every sample to every consumer through its own
+# multiprocessing.Pipe, like forwarding from a callback. The shared path
+# publishes into one SharedPositionPublisher ring that every consumer reads.
+#
+#   python benchmarks/shared.py [samples] [consumers]
+
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from kano_wand import SharedPositionPublisher, SharedPositionReader
+
+def pipe_consumer(connection, samples):
+    received = 0
+    while received < samples:
+        connection.recv()
+        received += 1
+    connection.send(received)
+
+def shared_consumer(name, samples, connection):
+    reader = SharedPositionReader(name, start=0)
+    received = 0
+    while received < samples and reader.next < samples:
+        timestamps, positions = reader.read()
+        if len(timestamps) == 0:
+            time.sleep(0.0001)
+            continue
+        positions.sum()
+        if reader.valid():
+            received += len(timestamps)
+    del timestamps, positions
+    connection.send((received, reader.lost))
+    reader.close()
+
+def run_pipes(samples, consumers):
+    pipes = [multiprocessing.Pipe() for _ in range(consumers)]
+    processes = [multiprocessing.Process(target=pipe_consumer, args=(child, samples)) for _, child in pipes]
+    for process in processes:
+        process.start()
+    start = time.perf_counter()
+    for i in range(samples):
+        for parent, _ in pipes:
+            parent.send((i, i % 32768, 0, 0, 0))
+    results = [parent.recv() for parent, _ in pipes]
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    return elapsed, sum(results), 0
+
+def run_shared(samples, consumers):
+    publisher = SharedPositionPublisher(size=4096)
+    pipes = [multiprocessing.Pipe() for _ in range(consumers)]
+    processes = [multiprocessing.Process(target=shared_consumer, args=(publisher.name, samples, child)) for _, child in pipes]
+    for process in processes:
+        process.start()
+    time.sleep(0.5)
+    start = time.perf_counter()
+    for i in range(samples):
+        publisher.publish(i, i % 32768, 0, 0, 0)
+    results = [parent.recv() for parent, _ in pipes]
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    publisher.close()
+    return elapsed, sum(result[0] for result in results), sum(result[1] for result in results)
+
+def main(samples=100000, consumers=3):
+    print("{} samples to {} consumers".format(samples, consumers))
+    for name, run in (("pipes", run_pipes), ("shared", run_shared)):
+        elapsed, received, lost = run(samples, consumers)
+        print("{}{:8.3f} s{:10.2f} us/sample  received {}  lost {}".format(
+            name.ljust(8), elapsed, elapsed / samples * 1e6, received, lost))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000, int(sys.argv[2]) if len(sys.argv) > 2 else 3)
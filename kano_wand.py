@@ -4,14 +4,55 @@
 # url='https://github.com/GammaGames/kano_wand'
 
 from enum import Enum
-from bluepy.btle import *
-import inspect
-import numpy
+import array
+import bisect
+import collections
+import functools
+import importlib
+import json
+import math
+import mmap
+import os
+import random
+import select
+import selectors
+import struct
+import sys
 import threading
+import time
+import types
 import uuid
+import zlib
 
 from time import sleep
 
+class _LazyModule(types.ModuleType):
+    """A module that is imported the first time one of its attributes is used
+
+    It replaces itself in this module's globals once loaded, so only the first
+    use pays for the import. numpy and bluepy are only needed by some
+    features, and importing them took most of kano_wand's import time.
+    """
+
+    def __init__(self, name, alias, load=None):
+        super().__init__(name)
+        self._alias = alias
+        self._load = load or name
+
+    def __getattr__(self, attribute):
+        importlib.import_module(self._load)
+        module = sys.modules[self.__name__]
+        globals()[self._alias] = module
+        return getattr(module, attribute)
+
+asyncio = _LazyModule("asyncio", "asyncio")
+base64 = _LazyModule("base64", "base64")
+concurrent = _LazyModule("concurrent", "concurrent", "concurrent.futures")
+hashlib = _LazyModule("hashlib", "hashlib")
+numpy = _LazyModule("numpy", "numpy")
+shared_memory = _LazyModule("multiprocessing.shared_memory", "shared_memory")
+socket = _LazyModule("socket", "socket")
+
 class _INFO(Enum):
     """Enum containing info UUIDs"""
     SERVICE = '64A70010-F691-4B93-A6F4-0968F5B648F8'
@@ -48,668 +89,6668 @@ class PATTERN(Enum):
     SHORT_SHORT = 6
     BIG_PAUSE = 7
 
-class Wand(Peripheral, DefaultDelegate):
-    """A wand class to interact with the Kano wand
-    """
-
-    def __init__(self, device, debug=False):
-        """Create a new wand
-
-        Arguments:
-            device {bluepy.ScanEntry} -- Device information
+# Raw position payloads are four little endian int16s, ordered (y, -x, -w, z)
+_POSITION_STRUCT = struct.Struct("<4h")
+_POSITION_ORDER = [1, 0, 3, 2]
+_POSITION_SIGNS = [-1, 1, 1, -1]
+_POSITION_NEGATED = [0, 3]
+_TEMPERATURE_STRUCT = struct.Struct("<h")
 
-        Keyword Arguments:
-            debug {bool} -- Print debug messages (default: {False})
-        """
-        super().__init__(None)
-        # Meta stuff
-        self.debug = debug
-        self._dev = device
-        self.name = device.getValueText(9)
+def decode_position(data):
+    """Decode a single position notification
 
-        if debug:
-            print("Wand: {}\n\rWand Mac: {}".format(self.name, device.addr))
+    Arguments:
+        data {bytes} -- 8 byte quaternion payload from the device
 
-        # Notification stuff
-        self.connected = False
-        self._position_callbacks = {}
-        self._position_subscribed = False
-        self._button_callbacks = {}
-        self._button_subscribed = False
-        self._temperature_callbacks = {}
-        self._temperature_subscribed = False
-        self._battery_callbacks = {}
-        self._battery_subscribed = False
-        self._notification_thread = None
-        self._position_notification_handle = 41
-        self._button_notification_handle = 33
-        self._temp_notification_handle = 56
-        self._battery_notification_handle = 23
+    Returns {tuple} -- (x, y, z, w) quaternion components
+    """
+    # I got part of this from Kano's node module and modified it
+    y, x, w, z = _POSITION_STRUCT.unpack_from(data)
+    # -32768 has no positive int16, saturate it so every component still fits one
+    return 32767 if x == -32768 else -x, y, z, 32767 if w == -32768 else -w
 
-    def connect(self):
-        if self.debug:
-            print("Connecting to {}...".format(self.name))
+def decode_positions(buffer):
+    """Decode a batch of position notifications at once
 
-        super(Wand, self).connect(self._dev)
-        self._lock = threading.Lock()
-        self.connected = True
-        self.setDelegate(self)
-        self._info_service = self.getServiceByUUID(_INFO.SERVICE.value)
-        self._io_service = self.getServiceByUUID(_IO.SERVICE.value)
-        self._sensor_service = self.getServiceByUUID(_SENSOR.SERVICE.value)
+    Arguments:
+        buffer {bytes} -- N concatenated 8 byte quaternion payloads
 
-        self.post_connect()
+    Returns {numpy.ndarray} -- (N, 4) int16 array of (x, y, z, w) rows
+    """
+    raw = numpy.frombuffer(buffer, dtype="<i2").reshape(-1, 4)
+    samples = raw[:, _POSITION_ORDER]
+    # Negate x and w like decode_position does, saturating -32768 instead of letting it wrap
+    negated = samples[:, _POSITION_NEGATED]
+    samples[:, _POSITION_NEGATED] = numpy.where(negated == -32768, 32767, -negated)
+    return samples
 
-        if self.debug:
-            print("Connected to {}".format(self.name))
+@functools.lru_cache(maxsize=1024)
+def led_payload(color="0x2185d0", on=True):
+    """Build the LED write for a color
 
-    def post_connect(self):
-        """Do anything necessary after connecting
-        """
-        pass
+    Results are cached, so setting a color that was used before costs a lookup.
 
-    def disconnect(self):
-        super().disconnect()
-        self.connected = False
-        self._position_subscribed = False
-        self._button_subscribed = False
-        self._temperature_subscribed = False
-        self._battery_subscribed = False
+    Keyword Arguments:
+        color {str|int} -- Color hex code or 0xRRGGBB integer (default: {"0x2185d0"})
+        on {bool} -- Whether light is on or off (default: {True})
 
-        self.post_disconnect()
+    Returns {bytes} -- Payload for the LED characteristic
+    """
+    # I got this from Kano's node module
+    if isinstance(color, str):
+        color = int(color.replace("#", ""), 16)
+    r = (color >> 16) & 255
+    g = (color >> 8) & 255
+    b = color & 255
+    rgb = (((r & 248) << 8) + ((g & 252) << 3) + ((b & 248) >> 3))
+    return bytes([1 if on else 0, rgb >> 8, rgb & 0xff])
+
+def _led_payloads(colors):
+    """Build the LED writes for an (N, 3) array of RGB colors in one pass"""
+    colors = numpy.clip(numpy.rint(colors), 0, 255).astype(numpy.uint16)
+    rgb = ((colors[:, 0] & 248) << 8) | ((colors[:, 1] & 252) << 3) | ((colors[:, 2] & 248) >> 3)
+    table = numpy.empty((len(colors), 3), dtype=numpy.uint8)
+    table[:, 0] = 1
+    table[:, 1] = rgb >> 8
+    table[:, 2] = rgb & 0xff
+    data = table.tobytes()
+    return tuple(data[i:i + 3] for i in range(0, len(data), 3))
+
+# Every characteristic the wand uses, resolved to handles on connect
+_CHARACTERISTICS = [member for group in (_INFO, _IO, _SENSOR) for member in group if member.name.endswith("_CHAR")]
+# Characteristics nothing reads or writes yet, a wand without them still connects
+_OPTIONAL_CHARACTERISTICS = {_SENSOR.MAGN_CALIBRATE_CHAR}
+
+class OVERFLOW(Enum):
+    """Enum for what to do when an event queue is full"""
+    BLOCK = 1
+    DROP_OLDEST = 2
+    DROP_NEWEST = 3
+
+class HandleCache(object):
+    """Characteristic handles saved to disk, so reconnecting skips GATT discovery
+    """
 
-        if self.debug:
-            print("Disconnected from {}".format(self.name))
+    def __init__(self, path=None):
+        """Create a new handle cache
 
-    def post_disconnect(self):
-        """Do anything necessary after disconnecting
+        Keyword Arguments:
+            path {str} -- JSON file to keep the handles in (default: {~/.cache/kano_wand/handles.json})
         """
-        pass
+        if path is None:
+            path = os.path.join(os.path.expanduser("~"), ".cache", "kano_wand", "handles.json")
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
 
-    def get_organization(self):
-        """Get organization of device
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, "r") as file:
+                    self._entries = json.load(file)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Written to a temporary file first so a crash never leaves half a cache behind
+        temporary = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(temporary, "w") as file:
+            json.dump(self._entries, file, indent=2, sort_keys=True)
+        os.replace(temporary, self.path)
+
+    def get(self, mac):
+        """Get the cached handles of a wand
 
-        Returns {str} -- Organization name
+        Arguments:
+            mac {str} -- MAC address of the wand
+
+        Returns {dict} -- {"software": str, "hardware": str, "handles": {uuid: int}}, or None if not cached
         """
         with self._lock:
-            if not hasattr(self, "_organization_handle"):
-                handle = self._info_service.getCharacteristics(_INFO.ORGANIZATION_CHAR.value)[0]
-                self._organization_handle = handle.getHandle()
-            return self.readCharacteristic(self._organization_handle).decode("utf-8")
+            return self._load().get(mac.lower())
 
-    def get_signal_strenth(self):
-        """Code created by GingerIndustries
-        Gets signal strength of device
-           
-        Returns {str} -- Signal strength in dB, where 0 is maximum and lower numbers indicate lower strength.
-        """
-        return self._dev.rssi
-    def get_software_version(self):
-        """Get software version
+    def put(self, mac, software, hardware, handles):
+        """Save the handles of a wand
 
-        Returns {str} -- Version number
+        Arguments:
+            mac {str} -- MAC address of the wand
+            software {str} -- Software version the handles were discovered on
+            hardware {str} -- Hardware version the handles were discovered on
+            handles {dict} -- Characteristic UUIDs mapped to handles
         """
         with self._lock:
-            if not hasattr(self, "_software_handle"):
-                handle = self._info_service.getCharacteristics(_INFO.SOFTWARE_CHAR.value)[0]
-                self._software_handle = handle.getHandle()
-            return self.readCharacteristic(self._software_handle).decode("utf-8")
+            self._load()[mac.lower()] = {"software": software, "hardware": hardware, "handles": handles}
+            self._save()
 
-    def get_hardware_version(self):
-        """Get hardware version
+    def remove(self, mac):
+        """Forget the handles of a wand
 
-        Returns {str} -- Hardware version
+        Arguments:
+            mac {str} -- MAC address of the wand
+
+        Returns {bool} -- If removal was successful or not
         """
         with self._lock:
-            if not hasattr(self, "_hardware_handle"):
-                handle = self._info_service.getCharacteristics(_INFO.HARDWARE_CHAR.value)[0]
-                self._hardware_handle = handle.getHandle()
-            return self.readCharacteristic(self._hardware_handle).decode("utf-8")
+            removed = self._load().pop(mac.lower(), None) is not None
+            if removed:
+                self._save()
+            return removed
 
-    def get_battery(self):
-        """Get battery level (currently only returns 0)
+class _Command(object):
+    """A write waiting in a CommandQueue"""
 
-        Returns {str} -- Battery level
-        """
-        with self._lock:
-            if not hasattr(self, "_battery_handle"):
-                handle = self._io_service.getCharacteristics(_IO.BATTERY_CHAR.value)[0]
-                self._battery_handle = handle.getHandle()
-            return self.readCharacteristic(self._battery_handle).decode("utf-8")
+    def __init__(self, handle, data, key):
+        self.handle = handle
+        self.data = data
+        self.key = key
+        self.future = concurrent.futures.Future()
+        self.queued = time.monotonic()
 
-    def get_button(self):
-        """Get current button status
+class CommandQueue(object):
+    """Outbound writes for a wand, sent in order by the wand's hub
+    """
 
-        Returns {bool} -- Button pressed status
+    def __init__(self, wand, max_rate=25):
+        """Create a new command queue
+
+        Arguments:
+            wand {Wand} -- Wand to write to
+
+        Keyword Arguments:
+            max_rate {float} -- Most writes per second, None for no limit (default: {25})
         """
-        with self._lock:
-            if not hasattr(self, "_button_handle"):
-                handle = self._io_service.getCharacteristics(_IO.USER_BUTTON_CHAR.value)[0]
-                self._button_handle = handle.getHandle()
+        self.wand = wand
+        self.max_rate = max_rate
+        self.writes = 0
+        self.coalesced = 0
+        self.deduplicated = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._last_write = 0.0
 
-            data = self.readCharacteristic(self._button_handle)
-            return data[0] == 1
+    @property
+    def depth(self):
+        """Number of writes waiting to be sent"""
+        return len(self._queue)
 
-    def get_temperature(self):
-        """Get temperature
+    def put(self, handle, data, key=None, coalesce=False):
+        """Queue a write with response
 
-        Returns {str} -- Battery level
+        A queued write with the same key is reused instead of adding another, with
+        coalesce its data is replaced so the latest write wins.
+
+        Arguments:
+            handle {int} -- Handle to write to
+            data {bytes} -- Data to write
+
+        Keyword Arguments:
+            key {str} -- Key of the write for coalescing or deduplicating (default: {None})
+            coalesce {bool} -- Replace the data of a queued write with the same key (default: {False})
+
+        Returns {concurrent.futures.Future} -- Future for the write's status
         """
         with self._lock:
-            if not hasattr(self, "_temperature_handle"):
-                handle = self._sensor_service.getCharacteristics(_SENSOR.TEMP_CHAR.value)[0]
-                self._temperature_handle = handle.getHandle()
-            return self.readCharacteristic(self._temperature_handle).decode("utf-8")
+            if key is not None:
+                for command in self._queue:
+                    if command.key == key and command.handle == handle:
+                        if coalesce:
+                            command.data = data
+                            self.coalesced += 1
+                            return command.future
+                        if command.data == data:
+                            self.deduplicated += 1
+                            return command.future
+
+            command = _Command(handle, data, key)
+            self._queue.append(command)
+
+        self.wand._schedule_commands()
+        return command.future
+
+    def due(self):
+        """Get when the next write may be sent
+
+        Returns {float} -- time.monotonic() of the next write, None if the queue is empty
+        """
+        if not self._queue:
+            return None
+        if not self.max_rate:
+            return self._last_write
+        return self._last_write + 1 / self.max_rate
 
-    def keep_alive(self):
-        """Keep the wand's connection active
+    def send(self):
+        """Send the oldest queued write, only call this from the wand's hub
 
-        Returns {bytes} -- Status
+        Returns {bool} -- If there was a write to send
         """
-        # Is not documented because it doesn't seem to work?
-        if self.debug:
-            print("Keeping wand alive.")
-
         with self._lock:
-            if not hasattr(self, "_alive_handle"):
-                handle = self._io_service.getCharacteristics(_IO.KEEP_ALIVE_CHAR.value)[0]
-                self._alive_handle = handle.getHandle()
-            return self.writeCharacteristic(self._alive_handle, bytes([1]), withResponse=True)
-
-    def vibrate(self, pattern=PATTERN.REGULAR):
-        """Vibrate wand with pattern
+            if not self._queue:
+                return False
+            command = self._queue.popleft()
+        if not command.future.set_running_or_notify_cancel():
+            return True
 
-        Keyword Arguments:
-            pattern {kano_wand.PATTERN} -- Vibration pattern (default: {PATTERN.REGULAR})
+        self._last_write = time.monotonic()
+        try:
+            command.future.set_result(self.wand.writeCharacteristic(command.handle, command.data, withResponse=True))
+        except BaseException as e:
+            command.future.set_exception(e)
+            if self.wand.backend.is_disconnect(e):
+                self.wand._on_disconnected()
+
+        latency = time.monotonic() - command.queued
+        self.writes += 1
+        self.latency = latency if self.writes == 1 else self.latency * 0.9 + latency * 0.1
+        self.max_latency = max(self.max_latency, latency)
+        return True
+
+    def flush(self):
+        """Send every queued write right away, ignoring the rate limit
+        """
+        while self.send():
+            pass
 
-        Returns {bytes} -- Status
+    def close(self):
+        """Cancel every queued write
         """
         with self._lock:
-            if isinstance(pattern, PATTERN):
-                message = [pattern.value]
-            else:
-                message = [pattern]
+            while self._queue:
+                self._queue.popleft().future.cancel()
 
-            if self.debug:
-                print("Setting LED to {}".format(message))
+    def stats(self):
+        """Get queue metrics
 
-            if not hasattr(self, "_vibrator_handle"):
-                handle = self._io_service.getCharacteristics(_IO.VIBRATOR_CHAR.value)[0]
-                self._vibrator_handle = handle.getHandle()
-            return self.writeCharacteristic(self._vibrator_handle, bytes(message), withResponse=True)
+        Returns {dict} -- Depth, write counts and write latencies in milliseconds
+        """
+        return {
+            "depth": self.depth,
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "deduplicated": self.deduplicated,
+            "latency_ms": self.latency * 1000,
+            "max_latency_ms": self.max_latency * 1000,
+        }
+
+class PositionBuffer(object):
+    """A preallocated ring buffer of timestamped position samples
+    """
 
-    def set_led(self, color="0x2185d0", on=True):
-        """Set the LED's color
+    def __init__(self, size=256, storage=None):
+        """Create a new position buffer
 
         Keyword Arguments:
-            color {str} -- Color hex code (default: {"0x2185d0"})
-            on {bool} -- Whether light is on or off (default: {True})
-
-        Returns {bytes} -- Status
+            size {int} -- Number of samples kept (default: {256})
+            storage {tuple} -- Writable (timestamps, samples) buffers of size * 2 int64s and size * 8 int16s to keep the samples in, new arrays if None (default: {None})
         """
-        message = []
-        if on:
-            message.append(1)
+        self.size = size
+        # Every sample is stored twice, size apart, so the newest samples are always one contiguous slice.
+        # Plain arrays keep numpy out of the notification path, views wrap them without copying.
+        if storage is None:
+            self._timestamps = array.array("q", bytes(size * 16))
+            self._samples = array.array("h", bytes(size * 16))
         else:
-            message.append(0)
+            self._timestamps = memoryview(storage[0]).cast("B").cast("q")
+            self._samples = memoryview(storage[1]).cast("B").cast("h")
+        self._views = None
+        self.count = 0
 
-        # I got this from Kano's node module
-        color = int(color.replace("#", ""), 16)
-        r = (color >> 16) & 255
-        g = (color >> 8) & 255
-        b = color & 255
-        rgb = (((r & 248) << 8) + ((g & 252) << 3) + ((b & 248) >> 3))
-        message.append(rgb >> 8)
-        message.append(rgb & 0xff)
+    def append(self, timestamp, x, y, z, w):
+        """Add a sample, overwriting the oldest one if the buffer is full
 
-        if self.debug:
-            print("Setting LED to {}".format(message))
+        Arguments:
+            timestamp {int} -- Receive time from time.monotonic_ns()
+            x {int} -- X component of the quaternion
+            y {int} -- Y component of the quaternion
+            z {int} -- Z component of the quaternion
+            w {int} -- W component of the quaternion
+        """
+        i = self.count % self.size
+        j = i + self.size
+        self._timestamps[i] = self._timestamps[j] = timestamp
+        samples = self._samples
+        i *= 4
+        j *= 4
+        samples[i] = samples[j] = x
+        samples[i + 1] = samples[j + 1] = y
+        samples[i + 2] = samples[j + 2] = z
+        samples[i + 3] = samples[j + 3] = w
+        self.count += 1
+
+    @property
+    def last_timestamp(self):
+        """Receive time of the newest sample, without needing numpy
+
+        Returns {int} -- time.monotonic_ns() of the sample, None if the buffer is empty
+        """
+        if self.count == 0:
+            return None
+        return self._timestamps[(self.count - 1) % self.size]
 
-        with self._lock:
-            if not hasattr(self, "_led_handle"):
-                handle = self._io_service.getCharacteristics(_IO.LED_CHAR.value)[0]
-                self._led_handle = handle.getHandle()
-            return self.writeCharacteristic(self._led_handle, bytes(message), withResponse=True)
+    def view(self, start, stop):
+        """Get zero-copy views of a range of samples
 
-    # SENSORS
-    def on(self, event, callback):
-        """Add an event listener
+        Samples that have already been overwritten are left out. The views are
+        only valid until the buffer wraps, copy them to keep them around.
 
         Arguments:
-            event {str} -- Event type, "position", "button", "temp", or "battery"
-            callback {function} -- Callback function
+            start {int} -- Number of the first sample
+            stop {int} -- Number one past the last sample
 
-        Returns {str} -- ID of the callback for removal later
+        Returns {tuple} -- (timestamps, samples) int64 (N,) and int16 (N, 4) arrays
         """
-        if self.debug:
-            print("Adding callback for {} notification...".format(event))
+        if self._views is None:
+            self._views = (numpy.frombuffer(self._timestamps, dtype=numpy.int64),
+                numpy.frombuffer(self._samples, dtype=numpy.int16).reshape(-1, 4))
+        timestamps, samples = self._views
+        start = max(start, stop - self.size, 0)
+        i = start % self.size
+        j = i + max(stop - start, 0)
+        return timestamps[i:j], samples[i:j]
+
+    def latest(self, count):
+        """Get zero-copy views of the newest samples
 
-        id = None
-        if event == "position":
-            id = uuid.uuid4()
-            self._position_callbacks[id] = callback
-            self.subscribe_position()
-        elif event == "button":
-            id = uuid.uuid4()
-            self._button_callbacks[id] = callback
-            self.subscribe_button()
-        elif event == "temp":
-            id = uuid.uuid4()
-            self._temperature_callbacks[id] = callback
-            self.subscribe_temperature()
-        elif event == "battery":
-            id = uuid.uuid4()
-            self._battery_callbacks[id] = callback
-            self.subscribe_battery()
+        Arguments:
+            count {int} -- Number of samples
 
-        return id
+        Returns {tuple} -- (timestamps, samples) int64 (N,) and int16 (N, 4) arrays
+        """
+        return self.view(self.count - count, self.count)
 
-    def off(self, uuid, continue_notifications=False):
-        """Remove a callback
+class _PositionBatch(object):
+    """A position_batch subscription
+    """
 
-        Arguments:
-            uuid {str} -- Remove a callback with its id
+    def __init__(self, callback, max_batch, max_latency_ms):
+        self.callback = callback
+        self.max_batch = max_batch
+        self.max_latency = int(max_latency_ms * 1000000)
+        self.next = None
 
-        Keyword Arguments:
-            continue_notifications {bool} -- Keep notification thread running (default: {False})
+    def update(self, buffer):
+        """Deliver pending samples if the batch is full or the oldest one is too old
 
-        Returns {bool} -- If removal was successful or not
+        Arguments:
+            buffer {kano_wand.PositionBuffer} -- Buffer the samples were written to
         """
-        removed = False
-        if self._position_callbacks.get(uuid) != None:
-            removed = True
-            self._position_callbacks.pop(uuid)
-            if len(self._position_callbacks.values()) == 0:
-                self.unsubscribe_position(continue_notifications=continue_notifications)
-        elif self._button_callbacks.get(uuid) != None:
-            removed = True
-            self._button_callbacks.pop(uuid)
-            if len(self._button_callbacks.values()) == 0:
-                self.unsubscribe_button(continue_notifications=continue_notifications)
-        elif self._temperature_callbacks.get(uuid) != None:
-            removed = True
-            self._temperature_callbacks.pop(uuid)
-            if len(self._temperature_callbacks.values()) == 0:
-                self.unsubscribe_temperature(continue_notifications=continue_notifications)
-        elif self._battery_callbacks.get(uuid) != None:
-            removed = True
-            self._battery_callbacks.pop(uuid)
-            if len(self._battery_callbacks.values()) == 0:
-                self.unsubscribe_battery(continue_notifications=continue_notifications)
+        if self.next is None:
+            self.next = buffer.count - 1
 
-        if self.debug:
-            if removed:
-                print("Removed callback {}".format(uuid))
-            else:
-                print("Could not remove callback {}".format(uuid))
+        timestamps, samples = buffer.view(self.next, buffer.count)
+        if len(timestamps) < self.max_batch and timestamps[-1] - timestamps[0] < self.max_latency:
+            return
 
-        return removed
+        self.next = buffer.count
+        self.callback(timestamps, samples)
 
-    def subscribe_position(self):
-        """Subscribe to position notifications and start thread if necessary
-        """
-        if self.debug:
-            print("Subscribing to position notification")
+class _Filter(object):
+    """Callbacks of one event that share max_rate_hz, deadband and changes_only
 
-        self._position_subscribed = True
-        with self._lock:
-            if not hasattr(self, "_position_handle"):
-                handle = self._sensor_service.getCharacteristics(_SENSOR.QUATERNIONS_CHAR.value)[0]
-                self._position_handle = handle.getHandle()
+    A notification is checked once per group, and only callbacks of groups that
+    accept it are called.
+    """
 
-            self.writeCharacteristic(self._position_handle + 1, bytes([1, 0]))
-        self._start_notification_thread()
+    def __init__(self, max_rate_hz, deadband, changes_only):
+        self.interval = int(1000000000 / max_rate_hz) if max_rate_hz else 0
+        self.deadband = deadband
+        self.changes_only = changes_only
+        self.callbacks = {}
+        self.last_time = None
+        self.last_value = None
 
-    def unsubscribe_position(self, continue_notifications=False):
-        """Unsubscribe to position notifications
+    def accept(self, value, timestamp=None):
+        """Check if a value should be delivered, remembering it if so
+
+        Arguments:
+            value {tuple|int|bool} -- Decoded value, a tuple for positions
 
         Keyword Arguments:
-            continue_notifications {bool} -- Keep notification thread running (default: {False})
-        """
-        if self.debug:
-            print("Unsubscribing from position notification")
+            timestamp {int} -- time.monotonic_ns() of the value, now if None (default: {None})
 
-        self._position_subscribed = continue_notifications
-        with self._lock:
-            if not hasattr(self, "_position_handle"):
-                handle = self._sensor_service.getCharacteristics(_SENSOR.QUATERNIONS_CHAR.value)[0]
-                self._position_handle = handle.getHandle()
+        Returns {bool} -- If the group's callbacks should get the value
+        """
+        last = self.last_value
+        if self.interval:
+            if timestamp is None:
+                timestamp = time.monotonic_ns()
+            if self.last_time is not None and timestamp - self.last_time < self.interval:
+                return False
+        if last is not None:
+            if self.changes_only and value == last:
+                return False
+            if self.deadband:
+                if isinstance(value, tuple):
+                    moved = max(abs(value[0] - last[0]), abs(value[1] - last[1]), abs(value[2] - last[2]), abs(value[3] - last[3]))
+                else:
+                    moved = abs(value - last)
+                if moved < self.deadband:
+                    return False
+        self.last_time = timestamp
+        self.last_value = value
+        return True
+
+_EXECUTORS = {}
+_EXECUTORS_LOCK = threading.Lock()
+
+def _shared_executor(mode):
+    """Get the executor shared by every "thread" or "process" subscription"""
+    with _EXECUTORS_LOCK:
+        executor = _EXECUTORS.get(mode)
+        if executor is None:
+            if mode == "thread":
+                executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="kano_wand")
+            elif mode == "process":
+                executor = concurrent.futures.ProcessPoolExecutor()
+            else:
+                raise ValueError("Unknown dispatch mode {}".format(mode))
+            _EXECUTORS[mode] = executor
+        return executor
 
-            self.writeCharacteristic(self._position_handle + 1, bytes([0, 0]))
+class _Subscriber(object):
+    """A callback run off the notification thread through a bounded queue
 
-    def subscribe_button(self):
-        """Subscribe to button notifications and start thread if necessary
-        """
-        if self.debug:
-            print("Subscribing to button notification")
+    Events for one subscriber are delivered in order, one at a time. A drain
+    task runs on the thread pool whenever the queue has events, and in process
+    mode it hands each event to the process pool and waits for it.
+    """
 
-        self._button_subscribed = True
-        with self._lock:
-            if not hasattr(self, "_button_handle"):
-                handle = self._io_service.getCharacteristics(_IO.USER_BUTTON_CHAR.value)[0]
-                self._button_handle = handle.getHandle()
+    def __init__(self, callback, event, dispatch, maxsize, overflow, debug=False, telemetry=None):
+        self.callback = callback
+        self.event = event
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.debug = debug
+        if isinstance(dispatch, concurrent.futures.Executor):
+            self.mode = "process" if isinstance(dispatch, concurrent.futures.ProcessPoolExecutor) else "thread"
+            self.executor = dispatch
+        else:
+            self.mode = dispatch
+            self.executor = _shared_executor(dispatch)
+        self.runner = self.executor if self.mode == "thread" else _shared_executor("thread")
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.closed = False
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+        self._draining = False
+        # Timed on the worker, where the callback really runs, the notification thread only queues
+        self._run = self._run_in_process if self.mode == "process" else callback
+        if telemetry is not None:
+            self._run = telemetry.timed(self._run, event)
+
+    def _run_in_process(self, *args):
+        return self.executor.submit(self.callback, *args).result()
+
+    def __call__(self, *args):
+        # Batches are views into the position buffer, which moves on before a worker gets to them.
+        # There can't be any before numpy is loaded.
+        if sys.modules.get("numpy") is not None:
+            args = tuple(arg.copy() if isinstance(arg, numpy.ndarray) else arg for arg in args)
+        with self._condition:
+            if self.closed:
+                return
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == OVERFLOW.DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                if self.overflow == OVERFLOW.DROP_OLDEST:
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self._queue) >= self.maxsize and not self.closed:
+                        self._condition.wait()
+                    if self.closed:
+                        return
+            self._queue.append(args)
+            if not self._draining:
+                self._draining = True
+                self.runner.submit(self._drain)
+
+    def _drain(self):
+        while True:
+            with self._condition:
+                if not self._queue or self.closed:
+                    self._draining = False
+                    return
+                args = self._queue.popleft()
+                self._condition.notify()
 
-            self.writeCharacteristic(self._button_handle + 1, bytes([1, 0]))
-        self._start_notification_thread()
+            try:
+                self._run(*args)
+                self.delivered += 1
+            except Exception as e:
+                self.errors += 1
+                if self.debug:
+                    print("{} callback failed: {}".format(self.event, e))
+
+    def close(self):
+        """Drop queued events and release anything blocked on the queue"""
+        with self._condition:
+            self.closed = True
+            self.dropped += len(self._queue)
+            self._queue.clear()
+            self._condition.notify_all()
+
+    def stats(self):
+        return {
+            "event": self.event,
+            "mode": self.mode,
+            "queued": len(self._queue),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+_HISTOGRAM_BUCKETS = (
+    0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+    0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+class Histogram(object):
+    """Count durations into fixed buckets, like a Prometheus histogram
+    """
 
-    def unsubscribe_button(self, continue_notifications=False):
-        """Unsubscribe to button notifications
+    def __init__(self, buckets=_HISTOGRAM_BUCKETS):
+        """Create a new histogram
 
         Keyword Arguments:
-            continue_notifications {bool} -- Keep notification thread running (default: {False})
+            buckets {tuple} -- Upper bounds of the buckets in seconds, ascending (default: {_HISTOGRAM_BUCKETS})
         """
-        if self.debug:
-            print("Unsubscribing from button notification")
-
-        self._button_subscribed = continue_notifications
-        with self._lock:
-            if not hasattr(self, "_button_handle"):
-                handle = self._io_service.getCharacteristics(_IO.USER_BUTTON_CHAR.value)[0]
-                self._button_handle = handle.getHandle()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
 
-            self.writeCharacteristic(self._button_handle + 1, bytes([0, 0]))
+    def observe(self, seconds):
+        """Add a duration
 
-    def subscribe_temperature(self):
-        """Subscribe to temperature notifications and start thread if necessary
+        Arguments:
+            seconds {float} -- Duration to add
         """
-        if self.debug:
-            print("Subscribing to temperature notification")
-
-        self._temperature_subscribed = True
-        with self._lock:
-            if not hasattr(self, "_temp_handle"):
-                handle = self._sensor_service.getCharacteristics(_SENSOR.TEMP_CHAR.value)[0]
-                self._temp_handle = handle.getHandle()
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
 
-            self.writeCharacteristic(self._temp_handle + 1, bytes([1, 0]))
-        self._start_notification_thread()
+    def percentile(self, percent):
+        """Estimate a percentile as the upper bound of the bucket it falls in
 
-    def unsubscribe_temperature(self, continue_notifications=False):
-        """Unsubscribe to temperature notifications
+        Arguments:
+            percent {float} -- Percentile between 0 and 100
 
-        Keyword Arguments:
-            continue_notifications {bool} -- Keep notification thread running (default: {False})
+        Returns {float} -- Duration in seconds, None if nothing was observed
         """
-        if self.debug:
-            print("Unsubscribing from temperature notification")
+        if self.count == 0:
+            return None
+        rank = self.count * percent / 100
+        total = 0
+        for i, count in enumerate(self.counts):
+            total += count
+            if total >= rank and count:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def stats(self):
+        """Get a summary in milliseconds
+
+        Returns {dict} -- count, mean_ms, p50_ms, p99_ms and max_ms
+        """
+        if self.count == 0:
+            return {"count": 0, "mean_ms": None, "p50_ms": None, "p99_ms": None, "max_ms": None}
+        return {
+            "count": self.count,
+            "mean_ms": self.sum / self.count * 1000,
+            "p50_ms": self.percentile(50) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+class _HandleStats(object):
+    """Arrival and decode statistics for the notifications of one handle"""
+
+    def __init__(self, name, periodic):
+        self.name = name
+        self.periodic = periodic
+        self.count = 0
+        self.last = None
+        self.interval = 0.0
+        self.jitter = 0.0
+        self.late = 0
+        self.dropped = 0
+        self.decode = Histogram()
+
+    def arrival(self, now):
+        self.count += 1
+        last, self.last = self.last, now
+        if last is None:
+            return
+        dt = (now - last) / 1e9
+        if self.interval == 0:
+            self.interval = dt
+            return
+
+        # A gap of several intervals on a periodic stream means samples went missing
+        if self.periodic and dt > self.interval * 1.5:
+            self.late += 1
+            self.dropped += max(0, int(round(dt / self.interval)) - 1)
+        self.jitter += 0.1 * (abs(dt - self.interval) - self.jitter)
+        # Clipped so a gap doesn't drag the interval, it can still grow slowly
+        self.interval += 0.05 * (min(dt, self.interval * 2) - self.interval)
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "rate_hz": 1 / self.interval if self.interval else None,
+            "jitter_ms": self.jitter * 1000,
+            "late": self.late,
+            "dropped": self.dropped,
+            "decode": self.decode.stats(),
+        }
+
+class Telemetry(object):
+    """Performance counters for a wand or shop
+
+    Wands and shops keep telemetry as None unless it is enabled, so without it
+    the only cost is one check per notification. Callbacks are timed when they
+    are added, so enable telemetry before adding them.
+    """
 
-        self._temperature_subscribed = continue_notifications
-        with self._lock:
-            if not hasattr(self, "_temp_handle"):
-                handle = self._sensor_service.getCharacteristics(_SENSOR.TEMP_CHAR.value)[0]
-                self._temp_handle = handle.getHandle()
+    def __init__(self):
+        self.handles = {}
+        self.callbacks = {}
+        self.durations = {}
+        self.counters = {}
+        # Per thread, the depth of timed callbacks running, ones called from inside another
+        # are already in its time, and their time in the notification being dispatched
+        self._local = threading.local()
 
-            self.writeCharacteristic(self._temp_handle + 1, bytes([0, 0]))
+    def observe(self, name, seconds):
+        """Add a duration to a named histogram, such as "connect" or "scan"
 
-    def subscribe_battery(self):
+        Arguments:
+            name {str} -- Name of the histogram
+            seconds {float} -- Duration to add
+        """
+        histogram = self.durations.get(name)
+        if histogram is None:
+            histogram = self.durations[name] = Histogram()
+        histogram.observe(seconds)
+
+    def count(self, name, value=1):
+        """Add to a named counter
+
+        Arguments:
+            name {str} -- Name of the counter
+
+        Keyword Arguments:
+            value {int} -- Amount to add (default: {1})
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def timed(self, callback, event):
+        """Wrap a callback so its execution time is recorded
+
+        Arguments:
+            callback {function} -- Callback function
+            event {str} -- Event the callback is for
+
+        Returns {function} -- Timed callback
+        """
+        histogram = self.callbacks.get(event)
+        if histogram is None:
+            histogram = self.callbacks[event] = Histogram()
+
+        def timed_callback(*args):
+            local = self._local
+            depth = getattr(local, "depth", 0)
+            local.depth = depth + 1
+            start = time.perf_counter_ns()
+            try:
+                return callback(*args)
+            finally:
+                elapsed = time.perf_counter_ns() - start
+                local.depth = depth
+                if depth == 0:
+                    local.callback_time = getattr(local, "callback_time", 0) + elapsed
+                histogram.observe(elapsed / 1e9)
+        return timed_callback
+
+    def notification(self, wand, handle, data):
+        """Dispatch a notification on a wand and record how it went
+
+        Decode time is the time spent handling the notification outside of
+        callbacks, which includes any on_* methods a subclass overrides.
+
+        Arguments:
+            wand {Wand} -- Wand the notification is for
+            handle {int} -- Handle of notification
+            data {bytes} -- Data from device
+        """
+        start = time.perf_counter_ns()
+        stats = self.handles.get(handle)
+        if stats is None:
+            names = {
+                wand._position_notification_handle: "position",
+                wand._button_notification_handle: "button",
+                wand._temp_notification_handle: "temperature",
+                wand._battery_notification_handle: "battery",
+            }
+            stats = self.handles[handle] = _HandleStats(names.get(handle, str(handle)), handle == wand._position_notification_handle)
+        stats.arrival(time.monotonic_ns())
+
+        local = self._local
+        local.callback_time = 0
+        wand._dispatch(handle, data)
+        stats.decode.observe((time.perf_counter_ns() - start - local.callback_time) / 1e9)
+
+    def stats(self):
+        """Get every metric as plain values
+
+        Returns {dict} -- Metrics of notifications by handle name, callbacks by event, durations and counters
+        """
+        return {
+            "notifications": dict((stats.name, stats.stats()) for stats in self.handles.values()),
+            "callbacks": dict((event, histogram.stats()) for event, histogram in self.callbacks.items()),
+            "durations": dict((name, histogram.stats()) for name, histogram in self.durations.items()),
+            "counters": dict(self.counters),
+        }
+
+    def metrics(self, prefix, labels):
+        """Get every metric for prometheus_metrics
+
+        Arguments:
+            prefix {str} -- Prefix of the metric names
+            labels {dict} -- Labels of every metric
+
+        Returns {list} -- (name, type, help, labels, value) tuples, value is a Histogram for histograms
+        """
+        metrics = []
+        for stats in self.handles.values():
+            handle = dict(labels, handle=stats.name)
+            metrics.append((prefix + "_notifications_total", "counter", "Notifications received", handle, stats.count))
+            if stats.interval:
+                metrics.append((prefix + "_notification_rate_hz", "gauge", "Notifications per second", handle, 1 / stats.interval))
+            metrics.append((prefix + "_notification_jitter_seconds", "gauge", "Mean deviation of the time between notifications", handle, stats.jitter))
+            if stats.periodic:
+                metrics.append((prefix + "_notifications_late_total", "counter", "Gaps longer than 1.5 notification intervals", handle, stats.late))
+                metrics.append((prefix + "_notifications_dropped_total", "counter", "Estimated notifications lost in gaps", handle, stats.dropped))
+            metrics.append((prefix + "_decode_seconds", "histogram", "Time handling a notification outside callbacks", handle, stats.decode))
+        for event, histogram in self.callbacks.items():
+            metrics.append((prefix + "_callback_seconds", "histogram", "Callback execution time", dict(labels, event=event), histogram))
+        for name, histogram in self.durations.items():
+            metrics.append(("{}_{}_seconds".format(prefix, name), "histogram", "Duration of {}".format(name), labels, histogram))
+        for name, value in self.counters.items():
+            metrics.append(("{}_{}_total".format(prefix, name), "counter", "Count of {}".format(name.replace("_", " ")), labels, value))
+        return metrics
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join('{}="{}"'.format(key, escape(value)) for key, value in labels.items()) + "}"
+
+def prometheus_metrics(sources):
+    """Format the metrics of wands and shops in the Prometheus text format
+
+    Arguments:
+        sources {list} -- Wands and shops to export
+
+    Returns {str} -- Metrics in the Prometheus text exposition format
+    """
+    families = collections.OrderedDict()
+    for source in sources:
+        for name, kind, help, labels, value in source._metrics():
+            families.setdefault(name, (kind, help, []))[2].append((labels, value))
+
+    lines = []
+    for name, (kind, help, samples) in families.items():
+        lines.append("# HELP {} {}".format(name, help))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for labels, value in samples:
+            if kind != "histogram":
+                lines.append("{}{} {}".format(name, _prometheus_labels(labels), value))
+                continue
+            total = 0
+            for bound, count in zip(value.buckets + ("+Inf",), value.counts):
+                total += count
+                lines.append("{}_bucket{} {}".format(name, _prometheus_labels(dict(labels, le=bound)), total))
+            lines.append("{}_sum{} {}".format(name, _prometheus_labels(labels), value.sum))
+            lines.append("{}_count{} {}".format(name, _prometheus_labels(labels), value.count))
+    return "\n".join(lines) + "\n"
+
+class Backend(object):
+    """A BLE stack for wands and shops to talk to the radio through
+
+    Connections look like a bluepy Peripheral: connect(device), disconnect(),
+    getCharacteristics(), readCharacteristic(handle), writeCharacteristic(handle,
+    val, withResponse) and waitForNotifications(timeout), calling
+    handleNotification(handle, data) on their delegate. Scanners look like a
+    bluepy Scanner: clear(), start(), process(timeout) and stop(), calling
+    handleDiscovery(device, isNewDev, isNewData) on theirs.
+    """
+
+    # Exceptions failed reads and writes raise
+    errors = ()
+
+    def connection(self, delegate):
+        """Create a connection that isn't connected yet
+
+        Arguments:
+            delegate {kano_wand.Wand} -- Wand to send notifications to
+
+        Returns {object} -- The connection
+        """
+        raise NotImplementedError
+
+    def scanner(self, delegate):
+        """Create a scanner
+
+        Arguments:
+            delegate {kano_wand.Shop} -- Shop to send discovered devices to
+
+        Returns {object} -- The scanner
+        """
+        raise NotImplementedError
+
+    def fileno(self, connection):
+        """Get a file descriptor that is readable when a connection has notifications waiting
+
+        Arguments:
+            connection {object} -- Connection from this backend
+
+        Returns {int} -- File descriptor for a WandHub to poll, None if there isn't one
+        """
+        return None
+
+    def pending(self, connection):
+        """Check if a connection already read notifications that its file descriptor won't signal again
+
+        Arguments:
+            connection {object} -- Connection from this backend
+
+        Returns {bool} -- Whether waitForNotifications(0) has more to handle without blocking
+        """
+        return False
+
+    def is_disconnect(self, error):
+        """Check if an error means the device went away
+
+        Arguments:
+            error {Exception} -- Error raised by a connection
+
+        Returns {bool} -- Whether the device disconnected
+        """
+        return False
+
+class _HelperOutput(object):
+    """The output of a bluepy helper, read from its pipe a line at a time
+
+    bluepy reads the helper through a buffered text stream, which can read
+    several lines at once and leave them where poll() can't see them. This
+    keeps what it read ahead where a WandHub can check for it instead.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._buffer = bytearray()
+
+    def fileno(self):
+        return self._stream.fileno()
+
+    @property
+    def pending(self):
+        # bluepy skips blank lines and comments, then blocks reading the next line
+        lines = self._buffer[:self._buffer.rfind(b"\n") + 1].split(b"\n")
+        return any(line and not line.startswith(b"#") for line in lines)
+
+    def readline(self):
+        while True:
+            end = self._buffer.find(b"\n") + 1
+            if end:
+                line = bytes(self._buffer[:end])
+                del self._buffer[:end]
+                return line.decode(self._stream.encoding)
+            # Blocks until the helper writes something, like bluepy's own readline
+            data = os.read(self.fileno(), 65536)
+            if not data:
+                line = bytes(self._buffer)
+                del self._buffer[:]
+                return line.decode(self._stream.encoding)
+            self._buffer += data
+
+    def close(self):
+        self._stream.close()
+
+class BluepyBackend(Backend):
+    """The bluepy backend, bluepy is only imported once it's used
+    """
+
+    def __init__(self):
+        self.btle = importlib.import_module("bluepy.btle")
+        self.errors = (self.btle.BTLEException,)
+
+        class Peripheral(self.btle.Peripheral):
+            def _startHelper(self, iface=None):
+                started = self._helper is None
+                super()._startHelper(iface)
+                if started:
+                    self._helper.stdout = _HelperOutput(self._helper.stdout)
+
+        self._peripheral = Peripheral
+
+    def connection(self, delegate):
+        return self._peripheral(None).withDelegate(delegate)
+
+    def scanner(self, delegate):
+        return self.btle.Scanner().withDelegate(delegate)
+
+    def fileno(self, connection):
+        helper = getattr(connection, "_helper", None)
+        return None if helper is None else helper.stdout.fileno()
+
+    def pending(self, connection):
+        helper = getattr(connection, "_helper", None)
+        return helper is not None and getattr(helper.stdout, "pending", False)
+
+    def is_disconnect(self, error):
+        return isinstance(error, self.btle.BTLEException) and error.code == self.btle.BTLEException.DISCONNECTED
+
+_BACKENDS = {}
+_BACKEND_INSTANCES = {}
+_BACKENDS_LOCK = threading.Lock()
+
+def register_backend(name, factory):
+    """Make a backend available by name
+
+    Arguments:
+        name {str} -- Name to pass as backend or set in KANO_WAND_BACKEND
+        factory {callable} -- Creates the backend the first time it's used
+    """
+    with _BACKENDS_LOCK:
+        _BACKENDS[name] = factory
+        _BACKEND_INSTANCES.pop(name, None)
+
+def get_backend(backend=None):
+    """Get a backend, creating it the first time it's used
+
+    Keyword Arguments:
+        backend {str|kano_wand.Backend} -- Backend or its name, KANO_WAND_BACKEND or "bluepy" if None (default: {None})
+
+    Returns {kano_wand.Backend} -- The backend
+    """
+    if isinstance(backend, Backend):
+        return backend
+    name = backend or os.environ.get("KANO_WAND_BACKEND", "bluepy")
+    with _BACKENDS_LOCK:
+        if name not in _BACKEND_INSTANCES:
+            if name not in _BACKENDS:
+                raise ValueError("Unknown backend {}, expected one of {}".format(name, ", ".join(sorted(_BACKENDS))))
+            _BACKEND_INSTANCES[name] = _BACKENDS[name]()
+        return _BACKEND_INSTANCES[name]
+
+register_backend("bluepy", BluepyBackend)
+
+class Wand(object):
+    """A wand class to interact with the Kano wand
+    """
+
+    def __init__(self, device, debug=False, buffer_size=256, handle_cache=None, write_rate=25, telemetry=False, backend=None, daemon=False):
+        """Create a new wand
+
+        Arguments:
+            device {bluepy.ScanEntry} -- Device information
+
+        Keyword Arguments:
+            debug {bool} -- Print debug messages (default: {False})
+            buffer_size {int} -- Number of position samples kept in position_buffer (default: {256})
+            handle_cache {kano_wand.HandleCache} -- Cache of characteristic handles, discover them every time if None (default: {None})
+            write_rate {float} -- Most LED and vibrate writes per second (default: {25})
+            telemetry {bool} -- Record performance metrics, see stats (default: {False})
+            backend {str|kano_wand.Backend} -- BLE backend or its name, see get_backend (default: {None})
+            daemon {bool} -- Let the program exit while the wand is connected, instead of waiting for it to disconnect (default: {False})
+        """
+        # Meta stuff
+        self.debug = debug
+        self.daemon = daemon
+        self._dev = device
+        self.backend = get_backend(backend)
+        self._connection = self.backend.connection(self)
+        self.name = device.getValueText(9)
+        self.rssi = device.rssi
+        self.last_seen = None
+        self.handle_cache = handle_cache
+        self.connect_time = None
+        self.handles_cached = False
+        self._handles = {}
+        self.commands = CommandQueue(self, max_rate=write_rate)
+        self.telemetry = Telemetry() if telemetry else None
+
+        if debug:
+            print("Wand: {}\n\rWand Mac: {}".format(self.name, device.addr))
+
+        # Notification stuff
+        self.connected = False
+        self.dropped_at = None
+        # Receive time and number of the latest notification
+        self.timestamp = None
+        self.sequence = 0
+        self.position_rate = RateEstimator()
+        self._position_callbacks = {}
+        self._position_batch_callbacks = {}
+        self._pointer_callbacks = {}
+        # Readers of position_buffer without a callback, such as a FleetAggregator
+        self._position_holds = {}
+        self._subscribers = {}
+        self._filters = {"position": {}, "button": {}, "temp": {}, "battery": {}}
+        self._filtered = {}
+        self._position_subscribed = False
+        self.position_buffer = PositionBuffer(buffer_size)
+        self._button_callbacks = {}
+        self._button_subscribed = False
+        self._temperature_callbacks = {}
+        self._temperature_subscribed = False
+        self._battery_callbacks = {}
+        self._spell_callbacks = {}
+        self._battery_subscribed = False
+        self._notifying = False
+        self._hub = None
+        self._private_hub = False
+        # Guards swapping _hub and _private_hub, connect, reconnect and disconnect can run on different threads
+        self._hub_lock = threading.RLock()
+        self._supervisor = None
+        self._recorder = None
+        self._position_notification_handle = 41
+        self._button_notification_handle = 33
+        self._temp_notification_handle = 56
+        self._battery_notification_handle = 23
+
+    def connect(self):
+        """Connect to the wand
+
+        Every radio call for the wand runs on the thread of its hub. A wand that
+        isn't in a WandHub gets a hub of its own while it's connected, which
+        keeps the program running until the wand disconnects unless the wand
+        was created with daemon.
+        """
+        if self.debug:
+            print("Connecting to {}...".format(self.name))
+
+        hub = self._start_private_hub()
+        try:
+            self._call(self._connect)
+        except:
+            if hub is not None:
+                self._stop_private_hub(hub)
+            raise
+
+        if self.telemetry is not None:
+            self.telemetry.observe("connect", self.connect_time)
+
+        self.post_connect()
+
+        if self.debug:
+            print("Connected to {} in {:.3f}s ({})".format(
+                self.name, self.connect_time, "cached handles" if self.handles_cached else "discovered handles"))
+
+    def _connect(self):
+        start = time.monotonic()
+        self._connection.connect(self._dev)
+        self._notifying = False
+        try:
+            self._resolve_handles()
+        except:
+            self._close_connection()
+            raise
+        self.connected = True
+        self.connect_time = time.monotonic() - start
+
+    def _resolve_handles(self):
+        """Find the handle of every characteristic, from the cache if it is still valid
+        """
+        self.handles_cached = False
+        if self.handle_cache is not None:
+            entry = self.handle_cache.get(self._dev.addr)
+            # An entry missing a handle is treated like no entry at all
+            if entry is not None and all(entry["handles"].get(member.value) is not None
+                    for member in _CHARACTERISTICS if member not in _OPTIONAL_CHARACTERISTICS):
+                self._set_handles({member: entry["handles"].get(member.value) for member in _CHARACTERISTICS})
+                try:
+                    # Two reads instead of a full discovery, a firmware update moves the handles
+                    valid = (self.get_software_version() == entry["software"] and
+                        self.get_hardware_version() == entry["hardware"])
+                except self.backend.errors + (UnicodeDecodeError,):
+                    valid = False
+                if valid:
+                    self.handles_cached = True
+                    return
+
+                if self.debug:
+                    print("Cached handles for {} are stale, discovering".format(self.name))
+
+        # One characteristic discovery covers every service
+        found = {str(characteristic.uuid).lower(): characteristic.getHandle() for characteristic in self.getCharacteristics()}
+        handles = {member: found.get(member.value.lower()) for member in _CHARACTERISTICS}
+        missing = [member.name for member, handle in handles.items() if handle is None and member not in _OPTIONAL_CHARACTERISTICS]
+        if missing:
+            raise ConnectionError("{} is missing characteristics {}, is it a Kano wand?".format(self.name, ", ".join(missing)))
+        self._set_handles(handles)
+
+        if self.handle_cache is not None:
+            self.handle_cache.put(self._dev.addr, self.get_software_version(), self.get_hardware_version(),
+                {member.value: handle for member, handle in self._handles.items()})
+
+    def reconnect(self, only_if_dropped=False):
+        """Connect again after the connection dropped
+
+        Callbacks stay registered through a drop, so post_connect isn't run
+        again. The handles found before are reused and every notification that
+        was subscribed to is turned back on.
+
+        Keyword Arguments:
+            only_if_dropped {bool} -- Do nothing if the wand was disconnected on purpose since it dropped (default: {False})
+
+        Returns {bool} -- If the wand was reconnected
+        """
+        if self.debug:
+            print("Reconnecting to {}...".format(self.name))
+
+        hub = self._start_private_hub()
+        try:
+            reconnected = self._call(self._reconnect, only_if_dropped)
+        except:
+            if hub is not None:
+                self._stop_private_hub(hub)
+            raise
+        if not reconnected:
+            if self.debug:
+                print("{} was disconnected, not reconnecting".format(self.name))
+            # Only a hub started for this attempt, one from connect() belongs to whoever connected
+            if hub is not None:
+                self._stop_private_hub(hub)
+            return False
+
+        if self.telemetry is not None:
+            self.telemetry.observe("connect", self.connect_time)
+
+        if self.debug:
+            print("Reconnected to {} in {:.3f}s".format(self.name, self.connect_time))
+        return True
+
+    def _reconnect(self, only_if_dropped=False):
+        # Runs on the hub's thread like _disconnect, so a disconnect can't slip in between the check and connecting
+        if only_if_dropped and self.dropped_at is None:
+            return False
+        start = time.monotonic()
+        try:
+            # Whatever is left of the old link, bluepy keeps its helper running after a drop
+            self._close_connection()
+        except Exception:
+            pass
+        self._connection.connect(self._dev)
+        self._notifying = False
+        if not self._handles:
+            self._resolve_handles()
+
+        subscriptions = [
+            (self._position_subscribed, _SENSOR.QUATERNIONS_CHAR),
+            (self._button_subscribed, _IO.USER_BUTTON_CHAR),
+            (self._temperature_subscribed, _SENSOR.TEMP_CHAR),
+            (self._battery_subscribed, _IO.BATTERY_CHAR),
+        ]
+        for subscribed, member in subscriptions:
+            if subscribed:
+                self._write(self._handles[member] + 1, bytes([1, 0]))
+        if any(subscribed for subscribed, _ in subscriptions):
+            self._start_notifications()
+
+        self.connected = True
+        self.dropped_at = None
+        self.connect_time = time.monotonic() - start
+        return True
+
+    def _on_disconnected(self):
+        """Mark the wand as dropped, its connection went away without disconnect() being called
+        """
+        if not self.connected:
+            return
+        self.connected = False
+        self.dropped_at = time.monotonic()
+        if self.debug:
+            print("Lost connection to {}".format(self.name))
+        if self._supervisor is not None:
+            self._supervisor.wake()
+
+    def _set_handles(self, handles):
+        self._handles = handles
+        self._position_notification_handle = handles[_SENSOR.QUATERNIONS_CHAR] or self._position_notification_handle
+        self._button_notification_handle = handles[_IO.USER_BUTTON_CHAR] or self._button_notification_handle
+        self._temp_notification_handle = handles[_SENSOR.TEMP_CHAR] or self._temp_notification_handle
+        self._battery_notification_handle = handles[_IO.BATTERY_CHAR] or self._battery_notification_handle
+
+    def post_connect(self):
+        """Do anything necessary after connecting
+        """
+        pass
+
+    def disconnect(self):
+        self.commands.close()
+        try:
+            self._call(self._disconnect)
+        finally:
+            self._stop_private_hub()
+
+        self.post_disconnect()
+
+        if self.debug:
+            print("Disconnected from {}".format(self.name))
+
+    def _disconnect(self):
+        self._close_connection()
+        self.connected = False
+        # Disconnected on purpose, a supervisor mustn't bring it back
+        self.dropped_at = None
+        self._notifying = False
+        self._position_subscribed = False
+        self._button_subscribed = False
+        self._temperature_subscribed = False
+        self._battery_subscribed = False
+
+    def _close_connection(self):
+        # The hub stops polling the connection first, so it never polls a closed fd, or one reused by another wand
+        hub = self._hub
+        if hub is not None:
+            hub._unregister(self)
+        self._connection.disconnect()
+
+    def _start_private_hub(self):
+        """Give the wand a hub of its own if it isn't in one
+
+        Returns {WandHub} -- Hub that was started, None if the wand already had one
+        """
+        with self._hub_lock:
+            if self._hub is not None:
+                return None
+            hub = WandHub([self], debug=self.debug)
+            self._private_hub = True
+            hub.start(daemon=self.daemon)
+        return hub
+
+    def _stop_private_hub(self, hub=None):
+        """Stop the wand's own hub, if it still has one
+
+        Keyword Arguments:
+            hub {WandHub} -- Only stop this hub, whichever private hub the wand has if None (default: {None})
+        """
+        with self._hub_lock:
+            if not self._private_hub or (hub is not None and self._hub is not hub):
+                return
+            hub = self._hub
+            self._private_hub = False
+            hub.remove(self)
+        hub.stop()
+
+    def post_disconnect(self):
+        """Do anything necessary after disconnecting
+        """
+        pass
+
+    @property
+    def connection(self):
+        """The backend's connection to the wand, a bluepy Peripheral with the bluepy backend
+        """
+        return self._connection
+
+    # Raw access to the connection, these run on the calling thread
+    def getCharacteristics(self):
+        return self._connection.getCharacteristics()
+
+    def readCharacteristic(self, handle):
+        return self._connection.readCharacteristic(handle)
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        return self._connection.writeCharacteristic(handle, val, withResponse)
+
+    def waitForNotifications(self, timeout):
+        return self._connection.waitForNotifications(timeout)
+
+    def fileno(self):
+        """Get a file descriptor that is readable when notifications are waiting
+
+        Returns {int} -- File descriptor, None if the backend doesn't have one
+        """
+        return self.backend.fileno(self._connection)
+
+    def pending(self):
+        """Check if notifications were already read from the file descriptor but not handled yet
+
+        Returns {bool} -- Whether waitForNotifications(0) has more to handle without blocking
+        """
+        return self.backend.pending(self._connection)
+
+    def _call(self, function, *args, **kwargs):
+        """Run a function on the thread of the wand's hub and wait for its result
+
+        Arguments:
+            function {function} -- Function to call
+
+        Returns {any} -- Return value of the function
+        """
+        hub = self._hub
+        if hub is None or not hub.running or hub.owns_current_thread():
+            return function(*args, **kwargs)
+        return hub.submit(function, *args, **kwargs).result()
+
+    def _read(self, handle):
+        return self._call(self.readCharacteristic, handle)
+
+    def _write(self, handle, data, withResponse=False):
+        return self._call(self.writeCharacteristic, handle, data, withResponse)
+
+    def _schedule_commands(self):
+        """Get queued writes sent, by the hub if it's running or right away otherwise
+        """
+        hub = self._hub
+        if hub is not None and hub.running:
+            hub.schedule(self.commands)
+        else:
+            self.commands.flush()
+
+    def _result(self, future):
+        """Wait for a queued write, sending it now if the hub is the one waiting
+        """
+        hub = self._hub
+        if hub is not None and hub.owns_current_thread():
+            self.commands.flush()
+        return future.result()
+
+    def get_organization(self):
+        """Get organization of device
+
+        Returns {str} -- Organization name
+        """
+        return self._read(self._handles[_INFO.ORGANIZATION_CHAR]).decode("utf-8")
+
+    def get_signal_strenth(self):
+        """Code created by GingerIndustries
+        Gets signal strength of device
+           
+        Returns {str} -- Signal strength in dB, where 0 is maximum and lower numbers indicate lower strength.
+        """
+        # Kept up to date, and smoothed, while a shop is scanning in the background
+        return self.rssi
+
+    def get_software_version(self):
+        """Get software version
+
+        Returns {str} -- Version number
+        """
+        return self._read(self._handles[_INFO.SOFTWARE_CHAR]).decode("utf-8")
+
+    def get_hardware_version(self):
+        """Get hardware version
+
+        Returns {str} -- Hardware version
+        """
+        return self._read(self._handles[_INFO.HARDWARE_CHAR]).decode("utf-8")
+
+    def get_battery(self):
+        """Get battery level (currently only returns 0)
+
+        Returns {str} -- Battery level
+        """
+        return self._read(self._handles[_IO.BATTERY_CHAR]).decode("utf-8")
+
+    def get_button(self):
+        """Get current button status
+
+        Returns {bool} -- Button pressed status
+        """
+        data = self._read(self._handles[_IO.USER_BUTTON_CHAR])
+        return data[0] == 1
+
+    def get_temperature(self):
+        """Get temperature
+
+        Returns {str} -- Battery level
+        """
+        return self._read(self._handles[_SENSOR.TEMP_CHAR]).decode("utf-8")
+
+    def keep_alive(self, wait=True):
+        """Keep the wand's connection active
+
+        Keyword Arguments:
+            wait {bool} -- Wait for the write, otherwise return a future right away (default: {True})
+
+        Returns {bytes|concurrent.futures.Future} -- Status, or a future for it if not waiting
+        """
+        # Is not documented because it doesn't seem to work?
+        if self.debug:
+            print("Keeping wand alive.")
+
+        future = self.commands.put(self._handles[_IO.KEEP_ALIVE_CHAR], bytes([1]), key="keep_alive")
+        return self._result(future) if wait else future
+
+    def vibrate(self, pattern=PATTERN.REGULAR, wait=True, dedupe=False):
+        """Vibrate wand with pattern
+
+        Keyword Arguments:
+            pattern {kano_wand.PATTERN} -- Vibration pattern (default: {PATTERN.REGULAR})
+            wait {bool} -- Wait for the write, otherwise return a future right away (default: {True})
+            dedupe {bool} -- Reuse a queued vibration with the same pattern instead of adding another (default: {False})
+
+        Returns {bytes|concurrent.futures.Future} -- Status, or a future for it if not waiting
+        """
+        if isinstance(pattern, PATTERN):
+            message = [pattern.value]
+        else:
+            message = [pattern]
+
+        if self.debug:
+            print("Vibrating with {}".format(message))
+
+        future = self.commands.put(self._handles[_IO.VIBRATOR_CHAR], bytes(message), key="vibrate" if dedupe else None)
+        return self._result(future) if wait else future
+
+    def set_led(self, color="0x2185d0", on=True, wait=True):
+        """Set the LED's color
+
+        LED writes still waiting in the command queue are replaced, so only the
+        latest color is sent.
+
+        Keyword Arguments:
+            color {str} -- Color hex code (default: {"0x2185d0"})
+            on {bool} -- Whether light is on or off (default: {True})
+            wait {bool} -- Wait for the write, otherwise return a future right away (default: {True})
+
+        Returns {bytes|concurrent.futures.Future} -- Status, or a future for it if not waiting
+        """
+        message = led_payload(color, on)
+        if self.debug:
+            print("Setting LED to {}".format(list(message)))
+
+        return self.write_led(message, wait=wait)
+
+    def write_led(self, payload, wait=True):
+        """Write a prebuilt LED payload, see led_payload
+
+        Like set_led, a queued LED write is replaced instead of adding another.
+
+        Arguments:
+            payload {bytes} -- Payload for the LED characteristic
+
+        Keyword Arguments:
+            wait {bool} -- Wait for the write, otherwise return a future right away (default: {True})
+
+        Returns {bytes|concurrent.futures.Future} -- Status, or a future for it if not waiting
+        """
+        future = self.commands.put(self._handles[_IO.LED_CHAR], payload, key="led", coalesce=True)
+        return self._result(future) if wait else future
+
+    def stats(self):
+        """Get performance metrics of the wand
+
+        Notification, callback and connect metrics are only there with telemetry.
+
+        Returns {dict} -- Metrics of the wand
+        """
+        stats = {
+            "name": self.name,
+            "connected": self.connected,
+            "connect_time": self.connect_time,
+            "commands": self.commands.stats(),
+            "subscriptions": self.subscriptions(),
+            "sequence": self.sequence,
+            "position_rate_hz": self.position_rate.rate,
+        }
+        if self.telemetry is not None:
+            stats.update(self.telemetry.stats())
+        return stats
+
+    def subscriptions(self):
+        """Get the queue of every callback that isn't inline
+
+        Returns {dict} -- Callback IDs mapped to their event, mode, and queued, delivered, dropped and errors counts
+        """
+        return dict((id, subscriber.stats()) for id, subscriber in list(self._subscribers.items()))
+
+    def prometheus(self):
+        """Get performance metrics of the wand in the Prometheus text format
+
+        Returns {str} -- Metrics, see prometheus_metrics to export many wands together
+        """
+        return prometheus_metrics([self])
+
+    def _metrics(self):
+        labels = {"wand": self.name}
+        commands = self.commands.stats()
+        metrics = [
+            ("kano_wand_connected", "gauge", "If the wand is connected", labels, int(self.connected)),
+            ("kano_wand_command_queue_depth", "gauge", "Writes waiting to be sent", labels, commands["depth"]),
+            ("kano_wand_writes_total", "counter", "Writes sent", labels, commands["writes"]),
+            ("kano_wand_writes_coalesced_total", "counter", "Writes replaced by a newer one", labels, commands["coalesced"]),
+        ]
+        for id, subscriber in list(self._subscribers.items()):
+            subscription = dict(labels, event=subscriber.event, mode=subscriber.mode, id=id)
+            metrics.append(("kano_wand_subscription_queue_depth", "gauge", "Events waiting for a callback", subscription, len(subscriber._queue)))
+            metrics.append(("kano_wand_subscription_dropped_total", "counter", "Events dropped because a callback's queue was full", subscription, subscriber.dropped))
+        if self.telemetry is not None:
+            metrics.extend(self.telemetry.metrics("kano_wand", labels))
+        return metrics
+
+    # SENSORS
+    def on(self, event, callback, max_batch=32, max_latency_ms=50, pointer=None, dispatch="inline", maxsize=64, overflow=OVERFLOW.DROP_OLDEST,
+           max_rate_hz=None, deadband=None, changes_only=False, timestamped=False):
+        """Add an event listener
+
+        "position_batch" callbacks get (timestamps, samples) zero-copy views into
+        position_buffer, which are only valid until the buffer wraps. A batch is
+        delivered once max_batch samples are pending, or when a sample arrives
+        and the oldest pending one is older than max_latency_ms.
+
+        "pointer" callbacks get (x, y, heading, pitch, roll) for every position,
+        smoothed by a PointerFilter, see PointerFilter.update.
+
+        Inline callbacks run on the notification thread, so a slow one delays
+        every event of the wand. "thread" callbacks run on a shared thread pool
+        and "process" callbacks on a shared process pool, which needs a picklable
+        callback. Either can be given its own concurrent.futures executor. Those
+        go through a queue of maxsize events per subscription, with overflow
+        deciding what happens when it is full, see subscriptions.
+
+        "position", "button", "temp" and "battery" callbacks can be filtered
+        before they are called. max_rate_hz skips values that come too soon after
+        the last one delivered, deadband skips values that moved less than it
+        since then (for positions, in any component) and changes_only skips
+        repeats. Callbacks with the same filter share it, so a value skipped by a
+        filter costs one check no matter how many callbacks use it.
+
+        Timestamped callbacks get the time.monotonic_ns() the notification was
+        received and the wand's sequence number for it before the usual
+        arguments, so x, y, z, w becomes timestamp, sequence, x, y, z, w. They
+        are taken when the notification arrives, not when a queued callback runs.
+
+        Arguments:
+            event {str} -- Event type, "position", "position_batch", "pointer", "button", "temp", "battery", or "spell"
+            callback {function} -- Callback function
+
+        Keyword Arguments:
+            max_batch {int} -- Most samples per position_batch call (default: {32})
+            max_latency_ms {float} -- Longest a position_batch sample waits to be delivered (default: {50})
+            pointer {kano_wand.PointerFilter} -- Filter for a pointer callback, a default one if None (default: {None})
+            dispatch {str|concurrent.futures.Executor} -- Where the callback runs, "inline", "thread", "process", or an executor (default: {"inline"})
+            maxsize {int} -- Most events queued for a callback that isn't inline (default: {64})
+            overflow {kano_wand.OVERFLOW} -- What to do when the queue is full (default: {OVERFLOW.DROP_OLDEST})
+            max_rate_hz {float} -- Most values delivered per second, all if None (default: {None})
+            deadband {float} -- Smallest change from the last value delivered, any if None (default: {None})
+            changes_only {bool} -- Only deliver values different from the last one delivered (default: {False})
+            timestamped {bool} -- Pass the receive time and sequence number of the notification first (default: {False})
+
+        Returns {str} -- ID of the callback for removal later
+        """
+        if self.debug:
+            print("Adding callback for {} notification...".format(event))
+
+        key = None
+        if max_rate_hz is not None or deadband is not None or changes_only:
+            if event not in self._filters:
+                raise ValueError("Only position, button, temp and battery callbacks can be filtered")
+            key = (max_rate_hz, deadband, bool(changes_only))
+
+        subscriber = None
+        if dispatch != "inline":
+            callback = subscriber = _Subscriber(callback, event, dispatch, maxsize, overflow, self.debug, self.telemetry)
+        elif self.telemetry is not None:
+            callback = self.telemetry.timed(callback, event)
+        if timestamped:
+            stamped = callback
+            callback = lambda *args: stamped(self.timestamp, self.sequence, *args)
+
+        id = None
+        if event == "position":
+            id = self._add_callback(event, self._position_callbacks, callback, key)
+            self.subscribe_position()
+        elif event == "position_batch":
+            if max_batch > self.position_buffer.size:
+                raise ValueError("max_batch can not be larger than the position buffer ({})".format(self.position_buffer.size))
+            id = uuid.uuid4()
+            self._position_batch_callbacks[id] = _PositionBatch(callback, max_batch, max_latency_ms)
+            self.subscribe_position()
+        elif event == "pointer":
+            id = uuid.uuid4()
+            self._pointer_callbacks[id] = (pointer if pointer is not None else PointerFilter(), callback)
+            self.subscribe_position()
+        elif event == "button":
+            id = self._add_callback(event, self._button_callbacks, callback, key)
+            self.subscribe_button()
+        elif event == "temp":
+            id = self._add_callback(event, self._temperature_callbacks, callback, key)
+            self.subscribe_temperature()
+        elif event == "battery":
+            id = self._add_callback(event, self._battery_callbacks, callback, key)
+            self.subscribe_battery()
+        elif event == "spell":
+            # Spells are emitted by a SpellRecognizer attached to the wand
+            id = uuid.uuid4()
+            self._spell_callbacks[id] = callback
+
+        if subscriber is not None:
+            if id is None:
+                subscriber.close()
+            else:
+                self._subscribers[id] = subscriber
+        return id
+
+    def _hold_position(self, holder):
+        """Keep position notifications on for something that only reads position_buffer
+
+        Arguments:
+            holder {object} -- What reads the buffer
+
+        Returns {str} -- ID to release the hold with off()
+        """
+        id = uuid.uuid4()
+        self._position_holds[id] = holder
+        if self.connected:
+            self.subscribe_position()
+        return id
+
+    def _add_callback(self, event, callbacks, callback, key):
+        """Add a callback, to its filter group if it has one
+
+        Arguments:
+            event {str} -- Event type
+            callbacks {dict} -- Unfiltered callbacks of the event
+            callback {function} -- Callback function
+            key {tuple} -- (max_rate_hz, deadband, changes_only), None if unfiltered
+
+        Returns {str} -- ID of the callback
+        """
+        id = uuid.uuid4()
+        if key is None:
+            callbacks[id] = callback
+            return id
+
+        group = self._filters[event].get(key)
+        if group is None:
+            group = self._filters[event][key] = _Filter(*key)
+        group.callbacks[id] = callback
+        self._filtered[id] = (event, key)
+        return id
+
+    def _callback_count(self, event):
+        """Count the callbacks that need an event's notifications"""
+        count = sum(len(group.callbacks) for group in self._filters[event].values())
+        if event == "position":
+            return (count + len(self._position_callbacks) + len(self._position_batch_callbacks) + len(self._pointer_callbacks) +
+                len(self._position_holds))
+        if event == "button":
+            return count + len(self._button_callbacks)
+        if event == "temp":
+            return count + len(self._temperature_callbacks)
+        return count + len(self._battery_callbacks)
+
+    def off(self, uuid, continue_notifications=False):
+        """Remove a callback
+
+        Arguments:
+            uuid {str} -- Remove a callback with its id
+
+        Keyword Arguments:
+            continue_notifications {bool} -- Keep notification thread running (default: {False})
+
+        Returns {bool} -- If removal was successful or not
+        """
+        removed = False
+        if uuid in self._filtered:
+            event, key = self._filtered.pop(uuid)
+            group = self._filters[event][key]
+            group.callbacks.pop(uuid)
+            if len(group.callbacks) == 0:
+                del self._filters[event][key]
+            removed = True
+            if self._callback_count(event) == 0:
+                {
+                    "position": self.unsubscribe_position,
+                    "button": self.unsubscribe_button,
+                    "temp": self.unsubscribe_temperature,
+                    "battery": self.unsubscribe_battery,
+                }[event](continue_notifications=continue_notifications)
+        elif (self._position_callbacks.get(uuid) != None or self._position_batch_callbacks.get(uuid) != None or
+                self._pointer_callbacks.get(uuid) != None or self._position_holds.get(uuid) != None):
+            removed = True
+            self._position_callbacks.pop(uuid, None)
+            self._position_batch_callbacks.pop(uuid, None)
+            self._pointer_callbacks.pop(uuid, None)
+            self._position_holds.pop(uuid, None)
+            if self._callback_count("position") == 0:
+                self.unsubscribe_position(continue_notifications=continue_notifications)
+        elif self._button_callbacks.get(uuid) != None:
+            removed = True
+            self._button_callbacks.pop(uuid)
+            if self._callback_count("button") == 0:
+                self.unsubscribe_button(continue_notifications=continue_notifications)
+        elif self._temperature_callbacks.get(uuid) != None:
+            removed = True
+            self._temperature_callbacks.pop(uuid)
+            if self._callback_count("temp") == 0:
+                self.unsubscribe_temperature(continue_notifications=continue_notifications)
+        elif self._battery_callbacks.get(uuid) != None:
+            removed = True
+            self._battery_callbacks.pop(uuid)
+            if self._callback_count("battery") == 0:
+                self.unsubscribe_battery(continue_notifications=continue_notifications)
+        elif self._spell_callbacks.get(uuid) != None:
+            removed = True
+            self._spell_callbacks.pop(uuid)
+
+        subscriber = self._subscribers.pop(uuid, None)
+        if subscriber is not None:
+            subscriber.close()
+
+        if self.debug:
+            if removed:
+                print("Removed callback {}".format(uuid))
+            else:
+                print("Could not remove callback {}".format(uuid))
+
+        return removed
+
+    def subscribe_position(self):
+        """Subscribe to position notifications and start thread if necessary
+        """
+        if self.debug:
+            print("Subscribing to position notification")
+
+        self._position_subscribed = True
+        self._write(self._handles[_SENSOR.QUATERNIONS_CHAR] + 1, bytes([1, 0]))
+        self._start_notifications()
+
+    def unsubscribe_position(self, continue_notifications=False):
+        """Unsubscribe to position notifications
+
+        Keyword Arguments:
+            continue_notifications {bool} -- Keep notification thread running (default: {False})
+        """
+        if self.debug:
+            print("Unsubscribing from position notification")
+
+        self._position_subscribed = continue_notifications
+        self._write(self._handles[_SENSOR.QUATERNIONS_CHAR] + 1, bytes([0, 0]))
+
+    def subscribe_button(self):
+        """Subscribe to button notifications and start thread if necessary
+        """
+        if self.debug:
+            print("Subscribing to button notification")
+
+        self._button_subscribed = True
+        self._write(self._handles[_IO.USER_BUTTON_CHAR] + 1, bytes([1, 0]))
+        self._start_notifications()
+
+    def unsubscribe_button(self, continue_notifications=False):
+        """Unsubscribe to button notifications
+
+        Keyword Arguments:
+            continue_notifications {bool} -- Keep notification thread running (default: {False})
+        """
+        if self.debug:
+            print("Unsubscribing from button notification")
+
+        self._button_subscribed = continue_notifications
+        self._write(self._handles[_IO.USER_BUTTON_CHAR] + 1, bytes([0, 0]))
+
+    def subscribe_temperature(self):
+        """Subscribe to temperature notifications and start thread if necessary
+        """
+        if self.debug:
+            print("Subscribing to temperature notification")
+
+        self._temperature_subscribed = True
+        self._write(self._handles[_SENSOR.TEMP_CHAR] + 1, bytes([1, 0]))
+        self._start_notifications()
+
+    def unsubscribe_temperature(self, continue_notifications=False):
+        """Unsubscribe to temperature notifications
+
+        Keyword Arguments:
+            continue_notifications {bool} -- Keep notification thread running (default: {False})
+        """
+        if self.debug:
+            print("Unsubscribing from temperature notification")
+
+        self._temperature_subscribed = continue_notifications
+        self._write(self._handles[_SENSOR.TEMP_CHAR] + 1, bytes([0, 0]))
+
+    def subscribe_battery(self):
         """Subscribe to battery notifications and start thread if necessary
         """
-        if self.debug:
-            print("Subscribing to battery notification")
+        if self.debug:
+            print("Subscribing to battery notification")
+
+        self._battery_subscribed = True
+        self._write(self._handles[_IO.BATTERY_CHAR] + 1, bytes([1, 0]))
+        self._start_notifications()
+
+    def unsubscribe_battery(self, continue_notifications=False):
+        """Unsubscribe to battery notifications
+
+        Keyword Arguments:
+            continue_notifications {bool} -- Keep notification thread running (default: {False})
+        """
+        if self.debug:
+            print("Unsubscribing from battery notification")
+
+        self._battery_subscribed = continue_notifications
+        self._write(self._handles[_IO.BATTERY_CHAR] + 1, bytes([0, 0]))
+
+    def _start_notifications(self):
+        """Make the hub poll for notifications, resetting the position the first time
+        """
+        if not self._notifying:
+            self._notifying = True
+            try:
+                self.reset_position()
+            except self.backend.errors:
+                pass
+        if self._hub is not None:
+            self._hub.wake()
+
+    def _on_position(self, data):
+        """Private function for position notification
+
+        Arguments:
+            data {bytes} -- Data from device
+        """
+        x, y, z, w = decode_position(data)
+        timestamp = self.timestamp
+        self.position_buffer.append(timestamp, x, y, z, w)
+        self.position_rate.update(timestamp)
+
+        if self.debug:
+            print("Quaternion (x, y, z, w): ({}, {}, {}, {})".format(x, y, z, w))
+
+        self.on_position(x, y, z, w)
+        for callback in self._position_callbacks.values():
+            callback(x, y, z, w)
+        if self._filters["position"]:
+            value = (x, y, z, w)
+            for group in self._filters["position"].values():
+                if group.accept(value, timestamp):
+                    for callback in group.callbacks.values():
+                        callback(x, y, z, w)
+        for batch in self._position_batch_callbacks.values():
+            batch.update(self.position_buffer)
+        for pointer, callback in self._pointer_callbacks.values():
+            callback(*pointer.update(timestamp, x, y, z, w))
+
+    def on_position(self, x, y, z, w):
+        """Function called on position notification
+
+        The values are the raw components of the wand's orientation quaternion,
+        see quaternion_euler and PointerFilter for angles and a screen pointer.
+
+        Arguments:
+            x {int} -- X component of the quaternion
+            y {int} -- Y component of the quaternion
+            z {int} -- Z component of the quaternion
+            w {int} -- W component of the quaternion
+        """
+        pass
+
+    def reset_position(self):
+        """Reset the quaternains of the wand
+        """
+        self._write(self._handles[_SENSOR.QUATERNIONS_RESET_CHAR], bytes([1]))
+
+    def _on_button(self, data):
+        """Private function for button notification
+
+        Arguments:
+            data {bytes} -- Data from device
+        """
+        val = data[0] == 1
+
+        if self.debug:
+            print("Button: {}".format(val))
+
+        self.on_button(val)
+        for callback in self._button_callbacks.values():
+            callback(val)
+        self._dispatch_filtered("button", val)
+
+    def on_button(self, value):
+        """Function called on button notification
+
+        Arguments:
+            pressed {bool} -- If button is pressed
+        """
+        pass
+
+    def _on_temperature(self, data):
+        """Private function for temperature notification
+
+        Arguments:
+            data {bytes} -- Data from device
+        """
+        val = _TEMPERATURE_STRUCT.unpack_from(data)[0]
+
+        if self.debug:
+            print("Temperature: {}".format(val))
+
+        self.on_temperature(val)
+        for callback in self._temperature_callbacks.values():
+            callback(val)
+        self._dispatch_filtered("temp", val)
+
+    def on_temperature(self, value):
+        """Function called on temperature notification
+
+        Arguments:
+            value {int} -- Temperature of the wand
+        """
+        pass
+
+    def _on_battery(self, data):
+        """Private function for battery notification
+
+        Arguments:
+            data {bytes} -- Data from device
+        """
+        val = data[0]
+
+        if self.debug:
+            print("Battery: {}".format(val))
+
+        self.on_battery(val)
+        for callback in self._battery_callbacks.values():
+            callback(val)
+        self._dispatch_filtered("battery", val)
+
+    def _dispatch_filtered(self, event, value):
+        """Call the filtered callbacks of an event whose filter accepts the value"""
+        for group in self._filters[event].values():
+            if group.accept(value):
+                for callback in group.callbacks.values():
+                    callback(value)
+
+    def on_battery(self, value):
+        """Function called on battery notification
+
+        Arguments:
+            value {int} -- Battery level of the wand
+        """
+
+    def _on_spell(self, name, confidence, latency):
+        """Private function for spells matched by a SpellRecognizer
+
+        Arguments:
+            name {str} -- Name of the spell
+            confidence {float} -- How close the match was, from 0 to 1
+            latency {float} -- Milliseconds from receiving the last sample to the match
+        """
+        if self.debug:
+            print("Spell: {} ({:.2f}, {:.2f}ms)".format(name, confidence, latency))
+
+        self.on_spell(name, confidence, latency)
+        for callback in self._spell_callbacks.values():
+            callback(name, confidence, latency)
+
+    def on_spell(self, name, confidence, latency):
+        """Function called when a SpellRecognizer matches a spell
+
+        Arguments:
+            name {str} -- Name of the spell
+            confidence {float} -- How close the match was, from 0 to 1
+            latency {float} -- Milliseconds from receiving the last sample to the match
+        """
+        pass
+
+    def record(self, trace):
+        """Append every notification to a trace file
+
+        Arguments:
+            trace {str|kano_wand.TraceWriter} -- Path or writer to record to
+
+        Returns {kano_wand.TraceWriter} -- Writer being recorded to
+        """
+        if not isinstance(trace, TraceWriter):
+            trace = TraceWriter(trace)
+        self._recorder = trace
+        return trace
+
+    def stop_recording(self):
+        """Stop recording notifications and close the trace file
+        """
+        recorder, self._recorder = self._recorder, None
+        if recorder is not None:
+            recorder.close()
+
+    def handleNotification(self, cHandle, data):
+        """Handle notifications subscribed to
+
+        Arguments:
+            cHandle {int} -- Handle of notification
+            data {bytes} -- Data from device
+        """
+        self.timestamp = time.monotonic_ns()
+        self.sequence += 1
+        if self._recorder is not None:
+            self._recorder.write(self.timestamp, cHandle, data)
+
+        if self.telemetry is not None:
+            self.telemetry.notification(self, cHandle, data)
+        else:
+            self._dispatch(cHandle, data)
+
+    def _dispatch(self, cHandle, data):
+        if cHandle == self._position_notification_handle:
+            self._on_position(data)
+        elif cHandle == self._button_notification_handle:
+            self._on_button(data)
+        elif cHandle == self._temp_notification_handle:
+            self._on_temperature(data)
+        elif cHandle == self._battery_notification_handle:
+            self._on_battery(data)
+
+class WandHub(object):
+    """Own the radio of many wands from a single thread
+
+    The hub's thread is the only one that talks to its wands' bluepy helpers. It
+    dispatches notifications, runs calls made through submit() and sends queued
+    LED and vibrate writes, so reads never race the notification loop.
+    """
+
+    def __init__(self, wands=(), timeout=1.0, debug=False):
+        """Create a new hub
+
+        Keyword Arguments:
+            wands {Wand[]} -- Wands to dispatch notifications for (default: {()})
+            timeout {float} -- Longest time between checks for stopping (default: {1.0})
+            debug {bool} -- Print debug messages (default: {False})
+        """
+        self.debug = debug
+        self.timeout = timeout
+        self.wands = []
+        self.running = False
+        self._thread = None
+        self._owner = None
+        self._fds = {}
+        self._dirty = True
+        self._calls = collections.deque()
+        self._scheduled = set()
+        self._scheduled_lock = threading.Lock()
+        self._wands_lock = threading.Lock()
+        if hasattr(select, "epoll"):
+            self._poller = select.epoll()
+            self._poll_scale = 1
+        else:
+            self._poller = select.poll()
+            self._poll_scale = 1000
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        self._poller.register(self._wake_read, select.POLLIN)
+
+        for wand in wands:
+            self.add(wand)
+
+    def add(self, wand):
+        """Take over a wand's radio, replacing the hub it had before
+
+        Arguments:
+            wand {Wand} -- Wand to add
+        """
+        stop = None
+        with wand._hub_lock:
+            previous = wand._hub
+            if previous is not None and previous is not self:
+                previous.remove(wand)
+                if wand._private_hub:
+                    wand._private_hub = False
+                    stop = previous
+
+            with self._wands_lock:
+                if wand not in self.wands:
+                    self.wands.append(wand)
+                    wand._hub = self
+        if stop is not None:
+            stop.stop()
+        self.wake()
+
+    def remove(self, wand):
+        """Stop owning a wand's radio, it gets no notifications until it joins another hub or reconnects
+
+        Arguments:
+            wand {Wand} -- Wand to remove
+        """
+        with wand._hub_lock, self._wands_lock:
+            if wand in self.wands:
+                self.wands.remove(wand)
+                wand._hub = None
+        self.wake()
+
+    def wake(self):
+        """Make the poll loop pick up added, removed or newly connected wands
+        """
+        self._dirty = True
+        try:
+            os.write(self._wake_write, b"\0")
+        except BlockingIOError:
+            pass
+
+    def owns_current_thread(self):
+        """Check if the caller is running on the poll loop's thread
+
+        Returns {bool} -- If the current thread is the hub's
+        """
+        return self._owner is threading.current_thread()
+
+    def schedule(self, commands):
+        """Have the poll loop send a wand's queued writes
+
+        Arguments:
+            commands {kano_wand.CommandQueue} -- Queue with writes waiting
+        """
+        with self._scheduled_lock:
+            self._scheduled.add(commands)
+        if not self.owns_current_thread():
+            self.wake()
+
+    def submit(self, function, *args, **kwargs):
+        """Run a function on the poll loop's thread
+
+        Arguments:
+            function {function} -- Function to call
+
+        Returns {concurrent.futures.Future} -- Future for the function's result, failed if the loop isn't running
+        """
+        future = concurrent.futures.Future()
+        if not self.running:
+            future.set_exception(RuntimeError("The hub isn't running"))
+            return future
+        self._calls.append((future, function, args, kwargs))
+        self.wake()
+        return future
+
+    def start(self, daemon=False):
+        """Run the poll loop in a background thread
+
+        Keyword Arguments:
+            daemon {bool} -- Let the program exit while the loop is still running (default: {False})
+        """
+        if self._thread is None:
+            self.running = True
+            self._thread = threading.Thread(target=self.run, daemon=daemon)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the poll loop and wait for its thread to finish
+        """
+        self.running = False
+        self.wake()
+        if self._thread is not None:
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+                # Calls submitted while the loop was finishing
+                while self._calls:
+                    self._calls.popleft()[0].cancel()
+            self._thread = None
+
+    def run(self):
+        """Run the poll loop in the current thread until stopped
+        """
+        if self.debug:
+            print("Hub started")
+
+        self.running = True
+        self._owner = threading.current_thread()
+        while self.running:
+            if self._calls:
+                self._run_calls()
+            timeout = self.timeout
+            if self._scheduled:
+                timeout = min(timeout, self._send_commands())
+            if self._dirty:
+                self._refresh()
+
+            for fd, event in self._poller.poll(timeout * self._poll_scale):
+                if fd == self._wake_read:
+                    self._drain_wake()
+                    continue
+
+                wand = self._fds.get(fd)
+                if wand is None:
+                    continue
+                if not event & select.POLLIN:
+                    # The helper went away without telling us
+                    wand._on_disconnected()
+                    self._dirty = True
+                    continue
+
+                try:
+                    # The connection has a notification waiting, so this reads without blocking on the radio
+                    wand.waitForNotifications(0)
+                    # Lines the backend read ahead won't make the descriptor readable again
+                    while wand.pending():
+                        wand.waitForNotifications(0)
+                except Exception as e:
+                    if wand.backend.is_disconnect(e):
+                        wand._on_disconnected()
+                        self._dirty = True
+
+        self._owner = None
+        while self._calls:
+            self._calls.popleft()[0].cancel()
+
+        if self.debug:
+            print("Hub stopped")
+
+    def _send_commands(self):
+        """Send every queued write that the rate limits allow
+
+        Returns {float} -- Seconds until the next write is due
+        """
+        with self._scheduled_lock:
+            scheduled = list(self._scheduled)
+
+        wait = self.timeout
+        now = time.monotonic()
+        for commands in scheduled:
+            due = commands.due()
+            if due is not None and due <= now:
+                commands.send()
+                now = time.monotonic()
+                due = commands.due()
+            if due is None:
+                with self._scheduled_lock:
+                    # A write may have been queued since due() was checked
+                    if commands.due() is None:
+                        self._scheduled.discard(commands)
+                        continue
+                due = commands.due()
+            wait = min(wait, max(due - now, 0))
+        return wait
+
+    def _run_calls(self):
+        while self._calls:
+            future, function, args, kwargs = self._calls.popleft()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(function(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+        # Calls may have connected or disconnected wands
+        self._dirty = True
+
+    def _drain_wake(self):
+        try:
+            while os.read(self._wake_read, 64):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _unregister(self, wand):
+        """Stop polling a wand's connection before it's closed, call on the poll loop's thread
+
+        Arguments:
+            wand {Wand} -- Wand whose connection is closing
+        """
+        for fd, owner in list(self._fds.items()):
+            if owner is wand:
+                try:
+                    self._poller.unregister(fd)
+                except (OSError, KeyError):
+                    pass
+                del self._fds[fd]
+        self._dirty = True
+
+    def _refresh(self):
+        """Register the connection of every connected wand with the poller
+        """
+        self._dirty = False
+        fds = {}
+        with self._wands_lock:
+            for wand in self.wands:
+                fd = wand.fileno() if wand.connected else None
+                if fd is not None:
+                    fds[fd] = wand
+
+        for fd, wand in self._fds.items():
+            if fds.get(fd) is not wand:
+                try:
+                    self._poller.unregister(fd)
+                except (OSError, KeyError):
+                    pass
+        for fd, wand in fds.items():
+            if self._fds.get(fd) is not wand:
+                self._poller.register(fd, select.POLLIN)
+        self._fds = fds
+
+        if self.debug:
+            print("Hub polling {} wands".format(len(fds)))
+
+class _Supervised(object):
+    """A wand watched by a WandSupervisor"""
+
+    def __init__(self, wand):
+        self.wand = wand
+        self.telemetry = Telemetry()
+        self.attempts = 0
+        self.dropped_at = None
+        self.retry_at = None
+        self.reconnecting = None
+        self.keep_alive_at = None
+        self.keep_alive = None
+
+class WandSupervisor(object):
+    """Reconnect wands that drop and keep idle connections alive
+
+    A wand has dropped when its connection goes away without disconnect() being
+    called, which the hub notices, as do failed writes. Reconnects back off
+    exponentially with jitter, so a fleet coming back into range doesn't retry
+    in lockstep. Callbacks stay registered through a drop and every subscribed
+    notification is turned back on, nothing has to call on() again.
+    """
+
+    def __init__(self, wands=(), keep_alive=15.0, min_backoff=0.25, max_backoff=30.0, jitter=0.5, workers=4, debug=False):
+        """Create a new supervisor
+
+        Keyword Arguments:
+            wands {Wand[]} -- Wands to supervise (default: {()})
+            keep_alive {float} -- Seconds between keep alive writes, None to not send them (default: {15.0})
+            min_backoff {float} -- Seconds before the second reconnect attempt, the first is right away (default: {0.25})
+            max_backoff {float} -- Most seconds between reconnect attempts (default: {30.0})
+            jitter {float} -- Fraction of each backoff that is randomly cut off (default: {0.5})
+            workers {int} -- Most wands reconnecting at the same time (default: {4})
+            debug {bool} -- Print debug messages (default: {False})
+        """
+        self.keep_alive = keep_alive
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.workers = workers
+        self.debug = debug
+        self.running = False
+        self._states = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._executor = None
+
+        for wand in wands:
+            self.add(wand)
+
+    def add(self, wand):
+        """Start supervising a wand
+
+        Arguments:
+            wand {Wand} -- Wand to supervise, connect it first
+        """
+        with self._lock:
+            if wand not in self._states:
+                self._states[wand] = _Supervised(wand)
+                wand._supervisor = self
+        self.wake()
+
+    def remove(self, wand):
+        """Stop supervising a wand
+
+        Arguments:
+            wand {Wand} -- Wand to stop supervising
+
+        Returns {bool} -- If removal was successful or not
+        """
+        with self._lock:
+            state = self._states.pop(wand, None)
+        if state is None:
+            return False
+        wand._supervisor = None
+        return True
+
+    def wake(self):
+        """Make the supervisor check its wands now
+        """
+        self._wake.set()
+
+    def start(self):
+        """Supervise in a background thread
+        """
+        if self._thread is None:
+            self.running = True
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop supervising and wait for the thread to finish
+        """
+        self.running = False
+        self.wake()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        """Supervise in the current thread until stopped
+        """
+        if self.debug:
+            print("Supervisor started")
+
+        self.running = True
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="kano_wand_supervisor")
+        while self.running:
+            self._wake.clear()
+            with self._lock:
+                states = list(self._states.values())
+            now = time.monotonic()
+            wait = 1.0
+            for state in states:
+                due = self._check(state, now)
+                if due is not None:
+                    wait = min(wait, max(due - now, 0))
+            self._wake.wait(wait)
+
+        self._executor.shutdown(wait=False)
+        self._executor = None
+        if self.debug:
+            print("Supervisor stopped")
+
+    def _check(self, state, now):
+        """Reconnect a wand or send its keep alive if it's time to
+
+        Returns {float} -- time.monotonic() the wand needs checking again, None if only when woken
+        """
+        wand = state.wand
+        if state.reconnecting is not None:
+            if not state.reconnecting.done():
+                return None
+            self._reconnected(state, state.reconnecting)
+            state.reconnecting = None
+
+        if not wand.connected:
+            if wand.dropped_at is None:
+                # Disconnected on purpose, or never connected, forget any drop it had
+                state.attempts = 0
+                state.retry_at = None
+                state.dropped_at = None
+                state.keep_alive = None
+                state.keep_alive_at = None
+                return None
+            if state.retry_at is None:
+                state.telemetry.count("drops")
+                state.dropped_at = wand.dropped_at
+                state.keep_alive = None
+                state.retry_at = now
+            if now < state.retry_at:
+                return state.retry_at
+            state.attempts += 1
+            state.telemetry.count("reconnect_attempts")
+            state.reconnecting = self._executor.submit(wand.reconnect, only_if_dropped=True)
+            state.reconnecting.add_done_callback(lambda future: self.wake())
+            return None
+
+        if self.keep_alive is None:
+            return None
+        if state.keep_alive is not None:
+            if not state.keep_alive.done():
+                return None
+            error = state.keep_alive.exception()
+            state.keep_alive = None
+            if error is not None:
+                state.telemetry.count("keep_alive_failures")
+                if isinstance(error, wand.backend.errors):
+                    wand._on_disconnected()
+                    return now
+        if state.keep_alive_at is None:
+            state.keep_alive_at = now + self.keep_alive
+        if now < state.keep_alive_at:
+            return state.keep_alive_at
+        state.keep_alive_at = now + self.keep_alive
+        state.telemetry.count("keep_alives")
+        state.keep_alive = wand.keep_alive(wait=False)
+        state.keep_alive.add_done_callback(lambda future: self.wake())
+        return state.keep_alive_at
+
+    def _reconnected(self, state, future):
+        """Record a finished reconnect attempt, scheduling the next one if it failed
+        """
+        wand = state.wand
+        error = future.exception()
+        if error is not None:
+            delay = min(self.max_backoff, self.min_backoff * 2 ** (state.attempts - 1))
+            delay *= 1 - self.jitter * random.random()
+            state.retry_at = time.monotonic() + delay
+            state.telemetry.count("reconnect_failures")
+            if self.debug:
+                print("Reconnecting to {} failed ({}), retrying in {:.2f}s".format(wand.name, error, delay))
+            return
+        if not future.result():
+            # Disconnected on purpose while the attempt was queued
+            state.attempts = 0
+            state.retry_at = None
+            state.dropped_at = None
+            return
+
+        recovered = time.monotonic() - state.dropped_at
+        state.telemetry.observe("recover", recovered)
+        state.telemetry.count("downtime_seconds", recovered)
+        state.attempts = 0
+        state.retry_at = None
+        state.dropped_at = None
+        state.keep_alive_at = None
+        if self.debug:
+            print("Recovered {} in {:.3f}s".format(wand.name, recovered))
+
+    def stats(self):
+        """Get drop and recovery metrics of every wand
+
+        Returns {dict} -- Metrics by wand name, time_to_recover is in milliseconds
+        """
+        now = time.monotonic()
+        with self._lock:
+            states = list(self._states.values())
+        stats = {}
+        for state in states:
+            wand = state.wand
+            telemetry = state.telemetry.stats()
+            stats[wand.name] = {
+                "connected": wand.connected,
+                "down_s": None if wand.connected or wand.dropped_at is None else now - wand.dropped_at,
+                "attempts": state.attempts,
+                "time_to_recover": telemetry["durations"].get("recover", Histogram().stats()),
+                "counters": telemetry["counters"],
+            }
+        return stats
+
+    def prometheus(self):
+        """Get drop and recovery metrics in the Prometheus text format
+
+        Returns {str} -- Metrics
+        """
+        return prometheus_metrics([self])
+
+    def _metrics(self):
+        with self._lock:
+            states = list(self._states.values())
+        metrics = []
+        for state in states:
+            labels = {"wand": state.wand.name}
+            metrics.append(("kano_wand_supervisor_down", "gauge", "If the wand dropped and isn't back yet", labels,
+                int(not state.wand.connected and state.wand.dropped_at is not None)))
+            metrics.extend(state.telemetry.metrics("kano_wand_supervisor", labels))
+        return metrics
+
+class LedEffect(object):
+    """A precompiled LED animation
+
+    Every frame's payload is built once when the effect is compiled, playing it
+    only indexes into the table. Compiled effects are cached, so asking for the
+    same effect twice returns the same table.
+    """
+
+    def __init__(self, frames, fps=30, loop=False):
+        """Create a new effect from its payloads
+
+        Arguments:
+            frames {bytes[]} -- LED payload for every frame
+
+        Keyword Arguments:
+            fps {int} -- Frames per second (default: {30})
+            loop {bool} -- Start over after the last frame (default: {False})
+        """
+        if len(frames) == 0:
+            raise ValueError("An effect needs at least one frame")
+        self.frames = tuple(frames)
+        self.fps = fps
+        self.loop = loop
+
+    @property
+    def duration(self):
+        """Length of one run of the effect in seconds"""
+        return len(self.frames) / self.fps
+
+    def frame(self, elapsed):
+        """Get the payload to show after some time
+
+        Arguments:
+            elapsed {float} -- Seconds since the effect started
+
+        Returns {bytes} -- LED payload, None once a non looping effect is over
+        """
+        index = int(elapsed * self.fps)
+        if self.loop:
+            return self.frames[index % len(self.frames)]
+        if index >= len(self.frames):
+            return None
+        return self.frames[index]
+
+    @staticmethod
+    def _color(color):
+        if isinstance(color, str):
+            color = int(color.replace("#", ""), 16)
+        return ((color >> 16) & 255, (color >> 8) & 255, color & 255)
+
+    @classmethod
+    def keyframes(cls, keyframes, fps=30, loop=False):
+        """Compile an effect that blends linearly between colors
+
+        Arguments:
+            keyframes {tuple} -- (seconds, color) pairs in order, colors as for led_payload
+
+        Keyword Arguments:
+            fps {int} -- Frames per second (default: {30})
+            loop {bool} -- Start over after the last frame (default: {False})
+
+        Returns {LedEffect} -- Compiled effect
+        """
+        # Tuples so lists of keyframes can be looked up in the cache too
+        return cls._keyframes(tuple((seconds, color) for seconds, color in keyframes), fps, loop)
+
+    @classmethod
+    @functools.lru_cache(maxsize=64)
+    def _keyframes(cls, keyframes, fps, loop):
+        times = numpy.array([seconds for seconds, _ in keyframes], dtype=numpy.float64)
+        colors = numpy.array([cls._color(color) for _, color in keyframes], dtype=numpy.float64)
+        count = max(1, int(round((times[-1] - times[0]) * fps)))
+        # A looping effect's last keyframe is its first frame again, otherwise it is held
+        steps = times[0] + numpy.arange(count if loop else count + 1) / fps
+        rgb = numpy.stack([numpy.interp(steps, times, colors[:, i]) for i in range(3)], axis=1)
+        return cls(_led_payloads(rgb), fps, loop)
+
+    @classmethod
+    def fade(cls, start, end, seconds=1.0, fps=30):
+        """Compile a fade from one color to another
+
+        Arguments:
+            start {str|int} -- Color to start from
+            end {str|int} -- Color to end on
+
+        Keyword Arguments:
+            seconds {float} -- Length of the fade (default: {1.0})
+            fps {int} -- Frames per second (default: {30})
+
+        Returns {LedEffect} -- Compiled effect
+        """
+        return cls.keyframes(((0, start), (seconds, end)), fps)
+
+    @classmethod
+    def pulse(cls, color, period=1.0, fps=30):
+        """Compile a looping pulse from off to a color and back
+
+        Arguments:
+            color {str|int} -- Color at the peak of the pulse
+
+        Keyword Arguments:
+            period {float} -- Seconds per pulse (default: {1.0})
+            fps {int} -- Frames per second (default: {30})
+
+        Returns {LedEffect} -- Compiled effect
+        """
+        return cls.keyframes(((0, 0), (period / 2, color), (period, 0)), fps, True)
+
+    @classmethod
+    @functools.lru_cache(maxsize=16)
+    def rainbow(cls, period=3.0, fps=30):
+        """Compile a looping trip around the color wheel
+
+        Keyword Arguments:
+            period {float} -- Seconds per trip (default: {3.0})
+            fps {int} -- Frames per second (default: {30})
+
+        Returns {LedEffect} -- Compiled effect
+        """
+        count = max(1, int(round(period * fps)))
+        hue = numpy.arange(count) / count * 6
+        rgb = numpy.clip(numpy.stack([
+            numpy.abs(hue - 3) - 1,
+            2 - numpy.abs(hue - 2),
+            2 - numpy.abs(hue - 4),
+        ], axis=1), 0, 1) * 255
+        return cls(_led_payloads(rgb), fps, True)
+
+class _Animation(object):
+    def __init__(self, wands, effect, start):
+        self.wands = wands
+        self.effect = effect
+        self.start = start
+        self.sent = {}
+
+class LedAnimator(object):
+    """Play LED effects on many wands from one scheduler thread
+
+    Wands playing the same effect share one clock, so they stay in step. A frame
+    is written without waiting, and if the wand's previous LED write hasn't gone
+    out yet the new frame replaces it in the command queue, so a slow link drops
+    frames instead of falling further behind.
+    """
+
+    def __init__(self, fps=30, debug=False):
+        """Create a new animator
+
+        Keyword Arguments:
+            fps {int} -- Ticks per second of the scheduler (default: {30})
+            debug {bool} -- Print debug messages (default: {False})
+        """
+        self.fps = fps
+        self.debug = debug
+        self.frames = 0
+        self.dropped = 0
+        self._animations = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def play(self, wands, effect):
+        """Start an effect on some wands, replacing anything they were playing
+
+        Arguments:
+            wands {Wand|Wand[]} -- Wands to play the effect on
+            effect {LedEffect} -- Effect to play
+
+        Returns {str} -- ID of the animation for stopping later
+        """
+        if isinstance(wands, Wand):
+            wands = [wands]
+        id = uuid.uuid4()
+        with self._lock:
+            for other in self._animations.values():
+                other.wands = [wand for wand in other.wands if wand not in wands]
+            self._animations[id] = _Animation(list(wands), effect, time.monotonic())
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return id
+
+    def stop(self, id):
+        """Stop an animation, its wands keep the last frame shown
+
+        Arguments:
+            id {str} -- ID returned by play
+
+        Returns {bool} -- If the animation was playing
+        """
+        with self._lock:
+            return self._animations.pop(id, None) is not None
+
+    def close(self):
+        """Stop every animation and the scheduler thread
+        """
+        with self._lock:
+            self._animations.clear()
+            thread, self._thread = self._thread, None
+        self._stop.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _tick(self, now):
+        with self._lock:
+            animations = list(self._animations.items())
+
+        for id, animation in animations:
+            payload = animation.effect.frame(now - animation.start)
+            if payload is None:
+                self.stop(id)
+                continue
+            for wand in animation.wands:
+                if not wand.connected:
+                    continue
+                last = animation.sent.get(wand)
+                if last is not None and last[0] == payload:
+                    continue
+                if last is not None and not last[1].done():
+                    self.dropped += 1
+                try:
+                    animation.sent[wand] = (payload, wand.write_led(payload, wait=False))
+                    self.frames += 1
+                except Exception as e:
+                    if self.debug:
+                        print("LED frame for {} failed: {}".format(wand.name, e))
+
+    def _run(self):
+        interval = 1 / self.fps
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            now = time.monotonic()
+            self._tick(now)
+            # Skip ticks that were missed rather than running them back to back
+            next_tick = max(next_tick + interval, now)
+            self._stop.wait(max(0, next_tick - time.monotonic()))
+
+# Most MACs a background scan remembers turning down, a busy venue has plenty of phones
+_MAX_REJECTED = 4096
+
+class WandFilter(object):
+    """Allow-lists of MACs, names and name prefixes, checked in constant time
+
+    A device is allowed if its MAC, its name or any prefix of its name is on a
+    list. Prefixes are kept in a set per length, so a check costs one lookup per
+    distinct prefix length rather than one per prefix. version goes up on every
+    change, so anything caching results knows when to drop them.
+    """
+
+    def __init__(self, names=(), prefixes=(), macs=()):
+        """Create a new filter
+
+        Keyword Arguments:
+            names {str[]} -- Names to allow (default: {()})
+            prefixes {str[]} -- Name prefixes to allow (default: {()})
+            macs {str[]} -- MAC addresses to allow, in any case (default: {()})
+        """
+        self.names = set()
+        self.macs = set()
+        self.version = 0
+        self._prefixes = {}
+        self.add(names, prefixes, macs)
+
+    def add(self, names=(), prefixes=(), macs=()):
+        """Allow more devices
+
+        Keyword Arguments:
+            names {str[]} -- Names to allow (default: {()})
+            prefixes {str[]} -- Name prefixes to allow (default: {()})
+            macs {str[]} -- MAC addresses to allow, in any case (default: {()})
+        """
+        self.names.update(names)
+        self.macs.update(mac.lower() for mac in macs)
+        for prefix in prefixes:
+            self._prefixes.setdefault(len(prefix), set()).add(prefix)
+        self.version += 1
+
+    def remove(self, names=(), prefixes=(), macs=()):
+        """Stop allowing devices
+
+        Keyword Arguments:
+            names {str[]} -- Names to remove (default: {()})
+            prefixes {str[]} -- Name prefixes to remove (default: {()})
+            macs {str[]} -- MAC addresses to remove, in any case (default: {()})
+        """
+        self.names.difference_update(names)
+        self.macs.difference_update(mac.lower() for mac in macs)
+        for prefix in prefixes:
+            group = self._prefixes.get(len(prefix))
+            if group is not None:
+                group.discard(prefix)
+                if not group:
+                    del self._prefixes[len(prefix)]
+        self.version += 1
+
+    @property
+    def prefixes(self):
+        """Every allowed prefix
+        """
+        return set().union(*self._prefixes.values())
+
+    def match(self, mac, name):
+        """Check if a device is allowed
+
+        Arguments:
+            mac {str} -- MAC address of the device
+            name {str} -- Name of the device, None if it hasn't advertised one
+
+        Returns {bool} -- If the device is allowed
+        """
+        if mac.lower() in self.macs:
+            return True
+        if name is None:
+            return False
+        if name in self.names:
+            return True
+        for length, prefixes in self._prefixes.items():
+            if name[:length] in prefixes:
+                return True
+        return False
+
+class Shop(object):
+    """A scanner class to connect to wands
+    """
+    def __init__(self, wand_class=Wand, debug=False, handle_cache=None, telemetry=False, backend=None):
+        """Create a new scanner
+
+        Keyword Arguments:
+            wand_class {class} -- Class to use when connecting to wand (default: {Wand})
+            debug {bool} -- Print debug messages (default: {False})
+            handle_cache {kano_wand.HandleCache} -- Cache of characteristic handles shared by the wands (default: {None})
+            telemetry {bool} -- Record scan metrics and enable telemetry on the wands found (default: {False})
+            backend {str|kano_wand.Backend} -- BLE backend or its name, see get_backend (default: {None})
+        """
+        self.wand_class = wand_class
+        self.debug = debug
+        self.handle_cache = handle_cache
+        self.telemetry = Telemetry() if telemetry else None
+        self.wands = []
+        self._allow = None
+        self._found = {}
+        self.backend = get_backend(backend)
+        self._backend_given = backend is not None
+        self._scanner = self.backend.scanner(self)
+
+        # Background scanning
+        self.scanning = False
+        self.registry = collections.OrderedDict()
+        self.forget_after = 10.0
+        self.smoothing = 0.2
+        self._registry_lock = threading.Lock()
+        # MACs the filter turned down, cleared when the filter changes
+        self._rejected = collections.OrderedDict()
+        self._rejected_version = None
+        self._scan_thread = None
+        self._appear_callbacks = {}
+        self._disappear_callbacks = {}
+
+    def scan(self, name=None, prefix="Kano-Wand", mac=None, timeout=1.0, connect=False, count=None, workers=8, allow=None):
+        """Scan for devices
+
+        Keyword Arguments:
+            name {str} -- Name of the device to scan for (default: {None})
+            prefix {str} -- Prefix of name of device to scan for (default: {"Kano-Wand"})
+            mac {str} -- MAC Address of the device to scan for (default: {None})
+            timeout {float} -- Timeout before returning from scan (default: {1.0})
+            connect {bool} -- Connect to the wands automatically (default: {False})
+            count {int} -- Stop scanning early once this many wands are found (default: {None})
+            workers {int} -- Most wands connecting at the same time (default: {8})
+            allow {kano_wand.WandFilter} -- Devices to scan for, instead of name, prefix and mac (default: {None})
+
+        Returns {Wand[]} -- Array of wand objects
+        """
+        for _ in self.iter_scan(name=name, prefix=prefix, mac=mac, timeout=timeout, connect=connect, count=count, workers=workers, allow=allow):
+            pass
+        return self.wands
+
+    def iter_scan(self, name=None, prefix="Kano-Wand", mac=None, timeout=1.0, connect=False, count=None, workers=8, allow=None):
+        """Scan for devices, yielding wands as soon as they are found
+
+        With connect, wands start connecting on a pool of workers as soon as they
+        are found and are yielded once connected, so bringing up many wands takes
+        about as long as the slowest one. Wands that fail to connect are counted
+        and skipped rather than ending the scan.
+
+        Keyword Arguments:
+            name {str} -- Name of the device to scan for (default: {None})
+            prefix {str} -- Prefix of name of device to scan for (default: {"Kano-Wand"})
+            mac {str} -- MAC Address of the device to scan for (default: {None})
+            timeout {float} -- Longest time to scan for, None to scan until count wands are found (default: {1.0})
+            connect {bool} -- Connect to the wands automatically (default: {False})
+            count {int} -- Stop scanning early once this many wands are found (default: {None})
+            workers {int} -- Most wands connecting at the same time (default: {8})
+            allow {kano_wand.WandFilter} -- Devices to scan for, instead of name, prefix and mac (default: {None})
+
+        Yields {Wand} -- Wand objects
+        """
+        if self.debug:
+            print("Scanning for {} wands...".format(count) if timeout is None else "Scanning for {} seconds...".format(timeout))
+        if self.scanning:
+            raise RuntimeError("The shop is scanning in the background, use its registry or stop_scanning() first")
+        if timeout is None and count is None:
+            raise ValueError("Either a timeout or a count must be provided to stop scanning")
+        self._set_filter(name, prefix, mac, allow)
+
+        self.wands = []
+        self._found = {}
+        found = 0
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers) if connect else None
+        connecting = {}
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        try:
+            self._scanner.clear()
+            self._scanner.start()
+            try:
+                while count is None or found < count:
+                    remain = 0.1 if deadline is None else min(deadline - time.monotonic(), 0.1)
+                    if remain <= 0:
+                        break
+                    self._scanner.process(remain)
+                    if count is not None:
+                        del self.wands[count:]
+
+                    for wand in self.wands[found:]:
+                        found += 1
+                        if self.telemetry is not None:
+                            if found == 1:
+                                self.telemetry.observe("first_wand", time.monotonic() - started)
+                            self.telemetry.count("wands_found")
+                        if executor is None:
+                            yield wand
+                        else:
+                            connecting[executor.submit(self._connect_wand, wand)] = wand
+
+                    for future in [future for future in connecting if future.done()]:
+                        if self._connected(connecting.pop(future), future):
+                            yield future.result()
+            finally:
+                self._scanner.stop()
+                if self.telemetry is not None:
+                    self.telemetry.observe("scan", time.monotonic() - started)
+
+            for future in concurrent.futures.as_completed(connecting):
+                if self._connected(connecting.pop(future), future):
+                    yield future.result()
+        finally:
+            if executor is not None:
+                # Closed early, the wands still connecting will never be yielded so they mustn't stay connected
+                for future, wand in connecting.items():
+                    if not future.cancel():
+                        future.add_done_callback(functools.partial(self._abandon_wand, wand))
+                executor.shutdown(wait=False)
+
+    def _connect_wand(self, wand):
+        wand.connect()
+        return wand
+
+    def _abandon_wand(self, wand, future):
+        """Disconnect a wand that connected after its scan was closed"""
+        if future.exception() is None:
+            wand.disconnect()
+
+    def _connected(self, wand, future):
+        """Check a finished connect, recording it if it failed
+
+        Returns {bool} -- If the wand connected
+        """
+        error = future.exception()
+        if error is None:
+            return True
+        if self.telemetry is not None:
+            self.telemetry.count("connect_failures")
+        if self.debug:
+            print("Connecting to {} failed: {}".format(wand.name, error))
+        return False
+
+    def stats(self):
+        """Get scan metrics, empty without telemetry
+
+        Returns {dict} -- Metrics of the shop
+        """
+        if self.telemetry is None:
+            return {}
+        return self.telemetry.stats()
+
+    def prometheus(self):
+        """Get scan metrics and those of the wands found in the Prometheus text format
+
+        Returns {str} -- Metrics
+        """
+        return prometheus_metrics([self] + self.wands)
+
+    def _metrics(self):
+        if self.telemetry is None:
+            return []
+        return self.telemetry.metrics("kano_wand_shop", {})
+
+    def _set_filter(self, name, prefix, mac, allow=None):
+        """Set what handleDiscovery matches, replacing what the last scan matched
+
+        Arguments:
+            name {str} -- Name of the device to scan for
+            prefix {str} -- Prefix of name of device to scan for
+            mac {str} -- MAC Address of the device to scan for
+
+        Keyword Arguments:
+            allow {kano_wand.WandFilter} -- Devices to scan for, instead of name, prefix and mac (default: {None})
+        """
+        if allow is not None:
+            self._allow = allow
+            return
+
+        try:
+            name_check = not (name is None)
+            prefix_check = not (prefix is None)
+            mac_check = not (mac is None)
+            assert name_check or prefix_check or mac_check
+        except AssertionError as e:
+            print("Either a name, prefix, or mac address must be provided to find a wand")
+            raise e
+
+        # A name wins over a mac, and the prefix has a default so it only applies if neither is asked for
+        if name_check:
+            self._allow = WandFilter(names=[name])
+        elif mac_check:
+            self._allow = WandFilter(macs=[mac])
+        else:
+            self._allow = WandFilter(prefixes=[prefix])
+
+    def start_scanning(self, name=None, prefix="Kano-Wand", mac=None, allow=None, forget_after=10.0, smoothing=0.2, passive=False):
+        """Keep scanning in a background thread, keeping a registry of the wands in range
+
+        Every allowed device gets a wand in registry, keyed by MAC, as soon as it
+        advertises. Its last_seen time and rssi, smoothed over advertisements,
+        are kept up to date. Wands that stop advertising for forget_after seconds
+        are dropped, except connected ones, which don't advertise. Use on() for
+        callbacks when wands appear or disappear.
+
+        Keyword Arguments:
+            name {str} -- Name of the device to scan for (default: {None})
+            prefix {str} -- Prefix of name of device to scan for (default: {"Kano-Wand"})
+            mac {str} -- MAC Address of the device to scan for (default: {None})
+            allow {kano_wand.WandFilter} -- Devices to scan for, instead of name, prefix and mac (default: {None})
+            forget_after {float} -- Seconds without an advertisement before a wand disappears (default: {10.0})
+            smoothing {float} -- Weight of each new RSSI reading, 1 to not smooth (default: {0.2})
+            passive {bool} -- Don't ask for scan responses, names that are only in them aren't seen (default: {False})
+        """
+        if self.scanning:
+            return
+        self._set_filter(name, prefix, mac, allow)
+        self.forget_after = forget_after
+        self.smoothing = smoothing
+        self._rejected.clear()
+        self._rejected_version = self._allow.version
+        self.scanning = True
+        self._scan_thread = threading.Thread(target=self._scan_forever, args=(passive,), daemon=True)
+        self._scan_thread.start()
+
+    def stop_scanning(self):
+        """Stop the background scan, the registry keeps the wands it found
+        """
+        self.scanning = False
+        if self._scan_thread is not None:
+            if self._scan_thread is not threading.current_thread():
+                self._scan_thread.join()
+            self._scan_thread = None
+
+    def _scan_forever(self, passive):
+        if self.debug:
+            print("Scanning in the background...")
+
+        while self.scanning:
+            try:
+                self._scanner.clear()
+                self._scanner.start(passive=passive)
+                try:
+                    while self.scanning:
+                        self._scanner.process(0.1)
+                        self._forget()
+                finally:
+                    self._scanner.stop()
+            except self.backend.errors as e:
+                # The scanner died, a stuck adapter usually comes back after a moment
+                if self.debug:
+                    print("Background scan failed ({}), restarting".format(e))
+                sleep(1)
+
+        if self.debug:
+            print("Stopped scanning in the background")
+
+    def _forget(self):
+        """Drop wands that haven't advertised for forget_after seconds"""
+        now = time.monotonic()
+        gone = []
+        with self._registry_lock:
+            # The registry is ordered by last advertisement, so only the stale front needs checking
+            for mac, wand in list(self.registry.items()):
+                if now - wand.last_seen < self.forget_after:
+                    break
+                # Connected wands don't advertise, they stay where they are until they disconnect
+                if wand.connected:
+                    continue
+                del self.registry[mac]
+                gone.append(wand)
+
+        for wand in gone:
+            if self.debug:
+                print("{} disappeared".format(wand.name))
+            for callback in list(self._disappear_callbacks.values()):
+                callback(wand)
+
+    def seen(self):
+        """Get every wand in the registry
+
+        Returns {Wand[]} -- Wands, the one that advertised longest ago first
+        """
+        with self._registry_lock:
+            return list(self.registry.values())
+
+    def on(self, event, callback):
+        """Add a background scan listener
+
+        Arguments:
+            event {str} -- Event type, "appear" or "disappear"
+            callback {function} -- Callback function, called with the wand
+
+        Returns {str} -- ID of the callback for removal later
+        """
+        id = uuid.uuid4()
+        if event == "appear":
+            self._appear_callbacks[id] = callback
+        elif event == "disappear":
+            self._disappear_callbacks[id] = callback
+        else:
+            raise ValueError("Unknown event {}, expected appear or disappear".format(event))
+        return id
+
+    def off(self, uuid):
+        """Remove a background scan listener
+
+        Arguments:
+            uuid {str} -- Remove a callback with its id
+
+        Returns {bool} -- If removal was successful or not
+        """
+        return self._appear_callbacks.pop(uuid, None) is not None or self._disappear_callbacks.pop(uuid, None) is not None
+
+    def _create_wand(self, device):
+        # Only pass what's set, so wand classes with older signatures keep working
+        kwargs = {}
+        if self.handle_cache is not None:
+            kwargs["handle_cache"] = self.handle_cache
+        if self.telemetry is not None:
+            kwargs["telemetry"] = True
+        if self._backend_given:
+            kwargs["backend"] = self.backend
+        return self.wand_class(device, debug=self.debug, **kwargs)
+
+    def _advertised(self, device):
+        """Update the registry with an advertisement seen by the background scan"""
+        mac = device.addr
+        now = time.monotonic()
+        with self._registry_lock:
+            wand = self.registry.get(mac)
+            if wand is not None:
+                wand.last_seen = now
+                wand.rssi += self.smoothing * (device.rssi - wand.rssi)
+                self.registry.move_to_end(mac)
+                return
+            if self._rejected_version != self._allow.version:
+                # Devices turned down before may be allowed now
+                self._rejected.clear()
+                self._rejected_version = self._allow.version
+            if mac in self._rejected:
+                self._rejected.move_to_end(mac)
+                return
+            name = device.getValueText(9)
+            if not self._allow.match(mac, name):
+                # The name can come in a later scan response, so only give up once there is one
+                if name is not None:
+                    self._rejected[mac] = None
+                    if len(self._rejected) > _MAX_REJECTED:
+                        self._rejected.popitem(last=False)
+                return
+            wand = self._create_wand(device)
+            wand.last_seen = now
+            self.registry[mac] = wand
+
+        if self.debug:
+            print("{} appeared".format(wand.name))
+        if self.telemetry is not None:
+            self.telemetry.count("wands_appeared")
+        for callback in list(self._appear_callbacks.values()):
+            callback(wand)
+
+    def handleDiscovery(self, device, isNewDev, isNewData):
+        """Check if the device matches
+
+        Arguments:
+            device {bluepy.ScanEntry} -- Device data
+            isNewDev {bool} -- Whether the device is new
+            isNewData {bool} -- Whether the device has already been seen
+        """
+
+        if self.scanning:
+            self._advertised(device)
+            return
+
+        wand = self._found.get(device.addr)
+        if wand is not None:
+            wand.rssi = device.rssi
+        elif isNewDev:
+            # Perform initial detection attempt
+            name = device.getValueText(9)
+            if self._allow.match(device.addr, name):
+                wand = self._found[device.addr] = self._create_wand(device)
+                self.wands.append(wand)
+            elif self.debug:
+                if name != "None":
+                    print("Mac: {}\tCommon Name: {}".format(device.addr, name))
+                else:
+                    print("Mac: {}".format(device.addr))
+
+class AsyncWand(object):
+    """An asyncio wrapper around a wand
+
+    Every bluepy call for the wand, including waiting for notifications and
+    queued writes, runs on a hub thread of the wand's own while it's
+    connected, so the event loop never blocks on the radio.
+    """
+
+    def __init__(self, wand):
+        """Create a new async wand
+
+        Arguments:
+            wand {Wand} -- Wand to wrap
+        """
+        self.wand = wand
+        self.name = wand.name
+        self._hub = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.disconnect()
+
+    async def _call(self, function, *args, **kwargs):
+        if self._hub is None:
+            # Not connected, so nothing touches the radio
+            return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args, **kwargs))
+        return await asyncio.wrap_future(self._hub.submit(function, *args, **kwargs))
+
+    async def connect(self):
+        """Connect to the wand, starting its worker thread
+        """
+        if self._hub is None:
+            self._hub = WandHub([self.wand], debug=self.wand.debug)
+            self._hub.start(daemon=self.wand.daemon)
+        try:
+            await self._call(self.wand.connect)
+        except:
+            await self._stop_hub()
+            raise
+
+    async def disconnect(self):
+        """Disconnect from the wand and stop its worker thread
+        """
+        try:
+            await self._call(self.wand.disconnect)
+        finally:
+            await self._stop_hub()
+
+    async def _stop_hub(self):
+        hub, self._hub = self._hub, None
+        if hub is not None:
+            hub.remove(self.wand)
+            await asyncio.get_running_loop().run_in_executor(None, hub.stop)
+
+    async def get_organization(self):
+        """Get organization of device
+
+        Returns {str} -- Organization name
+        """
+        return await self._call(self.wand.get_organization)
+
+    async def get_software_version(self):
+        """Get software version
+
+        Returns {str} -- Version number
+        """
+        return await self._call(self.wand.get_software_version)
+
+    async def get_hardware_version(self):
+        """Get hardware version
+
+        Returns {str} -- Hardware version
+        """
+        return await self._call(self.wand.get_hardware_version)
+
+    async def get_battery(self):
+        """Get battery level
+
+        Returns {str} -- Battery level
+        """
+        return await self._call(self.wand.get_battery)
+
+    async def get_button(self):
+        """Get current button status
+
+        Returns {bool} -- Button pressed status
+        """
+        return await self._call(self.wand.get_button)
+
+    async def get_temperature(self):
+        """Get temperature
+
+        Returns {str} -- Temperature
+        """
+        return await self._call(self.wand.get_temperature)
+
+    async def keep_alive(self):
+        """Keep the wand's connection active
+
+        Returns {bytes} -- Status
+        """
+        return await self._call(self.wand.keep_alive)
+
+    async def reset_position(self):
+        """Reset the quaternions of the wand
+        """
+        return await self._call(self.wand.reset_position)
+
+    async def vibrate(self, pattern=PATTERN.REGULAR):
+        """Vibrate wand with pattern
+
+        Keyword Arguments:
+            pattern {kano_wand.PATTERN} -- Vibration pattern (default: {PATTERN.REGULAR})
+
+        Returns {bytes} -- Status
+        """
+        return await asyncio.wrap_future(self.wand.vibrate(pattern, wait=False))
+
+    async def set_led(self, color="0x2185d0", on=True):
+        """Set the LED's color
+
+        Keyword Arguments:
+            color {str} -- Color hex code (default: {"0x2185d0"})
+            on {bool} -- Whether light is on or off (default: {True})
+
+        Returns {bytes} -- Status
+        """
+        return await asyncio.wrap_future(self.wand.set_led(color, on, wait=False))
+
+    async def on(self, event, callback, **kwargs):
+        """Add an event listener, the callback runs on the wand's worker thread
+
+        Arguments:
+            event {str} -- Event type, see Wand.on
+            callback {function} -- Callback function
+
+        Returns {str} -- ID of the callback for removal later
+        """
+        return await self._call(self.wand.on, event, callback, **kwargs)
+
+    async def off(self, uuid, continue_notifications=False):
+        """Remove a callback
+
+        Arguments:
+            uuid {str} -- Remove a callback with its id
+
+        Keyword Arguments:
+            continue_notifications {bool} -- Keep notifications running (default: {False})
+
+        Returns {bool} -- If removal was successful or not
+        """
+        return await self._call(self.wand.off, uuid, continue_notifications=continue_notifications)
+
+    async def events(self, event, maxsize=64, overflow=OVERFLOW.DROP_OLDEST):
+        """Iterate over events with async for
+
+        OVERFLOW.BLOCK stalls the wand's worker until there is room, so other
+        calls on this wand wait too and must not be awaited while the queue is full.
+
+        Arguments:
+            event {str} -- Event type, "position", "button", "temp", or "battery"
+
+        Keyword Arguments:
+            maxsize {int} -- Most events waiting to be consumed (default: {64})
+            overflow {kano_wand.OVERFLOW} -- What to do when the queue is full (default: {OVERFLOW.DROP_OLDEST})
+
+        Yields {tuple|int|bool} -- (x, y, z, w) for positions, the value for other events
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize)
+
+        def offer(item):
+            if queue.full():
+                if overflow == OVERFLOW.DROP_NEWEST:
+                    return
+                queue.get_nowait()
+            queue.put_nowait(item)
+
+        def callback(*values):
+            item = values if len(values) > 1 else values[0]
+            if overflow == OVERFLOW.BLOCK:
+                asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+            else:
+                loop.call_soon_threadsafe(offer, item)
+
+        id = await self.on(event, callback)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            await self.off(id)
+
+    def positions(self, maxsize=64, overflow=OVERFLOW.DROP_OLDEST):
+        """Iterate over (x, y, z, w) positions with async for
+
+        Keyword Arguments:
+            maxsize {int} -- Most positions waiting to be consumed (default: {64})
+            overflow {kano_wand.OVERFLOW} -- What to do when the queue is full (default: {OVERFLOW.DROP_OLDEST})
+        """
+        return self.events("position", maxsize=maxsize, overflow=overflow)
+
+class AsyncShop(object):
+    """An asyncio wrapper around a shop
+    """
+
+    def __init__(self, wand_class=Wand, debug=False, backend=None):
+        """Create a new async scanner
+
+        Keyword Arguments:
+            wand_class {class} -- Class to use when connecting to wand (default: {Wand})
+            debug {bool} -- Print debug messages (default: {False})
+            backend {str|kano_wand.Backend} -- BLE backend or its name, see get_backend (default: {None})
+        """
+        self.shop = Shop(wand_class=wand_class, debug=debug, backend=backend)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    async def scan(self, name=None, prefix="Kano-Wand", mac=None, timeout=1.0, connect=False, count=None, allow=None):
+        """Scan for devices
+
+        Keyword Arguments:
+            name {str} -- Name of the device to scan for (default: {None})
+            prefix {str} -- Prefix of name of device to scan for (default: {"Kano-Wand"})
+            mac {str} -- MAC Address of the device to scan for (default: {None})
+            timeout {float} -- Timeout before returning from scan (default: {1.0})
+            connect {bool} -- Connect to the wands concurrently (default: {False})
+            count {int} -- Stop scanning early once this many wands are found (default: {None})
+            allow {kano_wand.WandFilter} -- Devices to scan for, instead of name, prefix and mac (default: {None})
+
+        Returns {AsyncWand[]} -- Array of async wand objects
+        """
+        scan = functools.partial(self.shop.scan, name=name, prefix=prefix, mac=mac, timeout=timeout, count=count, allow=allow)
+        wands = await asyncio.get_running_loop().run_in_executor(self._executor, scan)
+        wands = [AsyncWand(wand) for wand in wands]
+        if connect:
+            await asyncio.gather(*[wand.connect() for wand in wands])
+        return wands
+
+def quaternion_euler(samples):
+    """Get heading, pitch and roll for each quaternion
+
+    Arguments:
+        samples {numpy.ndarray} -- (N, 4) array of (x, y, z, w) quaternions, any scale
+
+    Returns {numpy.ndarray} -- (N, 3) array of heading, pitch and roll in degrees
+    """
+    q = numpy.asarray(samples, dtype=numpy.float64).reshape(-1, 4)
+    norm = numpy.sum(q * q, axis=1)
+    norm[norm == 0] = 1
+    x, y, z, w = (q / numpy.sqrt(norm)[:, None]).T
+    angles = numpy.empty((len(q), 3))
+    angles[:, 0] = numpy.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+    angles[:, 1] = numpy.arcsin(numpy.clip(2 * (w * y - x * z), -1, 1))
+    angles[:, 2] = numpy.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+    return numpy.degrees(angles)
+
+def quaternion_pointer(samples, fov=(60, 40)):
+    """Project where each quaternion points onto a screen in front of the wand
+
+    The screen is a plane straight ahead of the wand's reset position, (0, 0) is
+    its center and (1, 1) the top right corner. Pointing past an edge, or away
+    from the screen, pins the pointer to the edge.
+
+    Arguments:
+        samples {numpy.ndarray} -- (N, 4) array of (x, y, z, w) quaternions, any scale
+
+    Keyword Arguments:
+        fov {tuple} -- Horizontal and vertical angle the screen covers in degrees (default: {(60, 40)})
+
+    Returns {numpy.ndarray} -- (N, 2) array of pointer positions between -1 and 1
+    """
+    directions = quaternion_directions(samples).astype(numpy.float64)
+    forward = directions[:, 0]
+    ahead = forward > 1e-6
+    scale = numpy.tan(numpy.radians(fov) / 2)
+    pointer = numpy.empty((len(directions), 2))
+    safe = numpy.where(ahead, forward, 1)
+    # Anything not ahead is pushed past the edge, the clip below pins it there
+    pointer[:, 0] = numpy.where(ahead, directions[:, 1] / safe / scale[0], numpy.sign(directions[:, 1]) * 2)
+    pointer[:, 1] = numpy.where(ahead, -directions[:, 2] / safe / scale[1], -numpy.sign(directions[:, 2]) * 2)
+    return numpy.clip(pointer, -1, 1)
+
+class OneEuroFilter(object):
+    """The One Euro filter, an adaptive low pass filter for noisy input
+
+    Slow movements are smoothed heavily to remove jitter, fast ones lightly to
+    keep lag down. Every channel is filtered independently but in one numpy
+    operation per sample. See https://gery.casiez.net/1euro/
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.007, d_cutoff=1.0):
+        """Create a new filter
+
+        Keyword Arguments:
+            min_cutoff {float} -- Cutoff frequency in Hz when still, lower is smoother (default: {1.0})
+            beta {float} -- How much the cutoff rises with speed, higher is less laggy (default: {0.007})
+            d_cutoff {float} -- Cutoff frequency in Hz for the speed estimate (default: {1.0})
+        """
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        """Forget the filter's state, the next value passes through unchanged
+        """
+        self._time = None
+        self._value = None
+        self._speed = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        return 1 / (1 + 1 / (2 * numpy.pi * cutoff * dt))
+
+    def update(self, timestamp, value):
+        """Filter one sample
+
+        Arguments:
+            timestamp {float} -- Time of the sample in seconds
+            value {numpy.ndarray} -- Value of every channel
+
+        Returns {numpy.ndarray} -- Filtered value of every channel
+        """
+        value = numpy.asarray(value, dtype=numpy.float64)
+        if self._time is None:
+            self._time = timestamp
+            self._value = value.copy()
+            self._speed = numpy.zeros_like(value)
+            return self._value.copy()
+        if isinstance(self._value, list):
+            # Left as floats by _update_floats
+            self._value = numpy.array(self._value)
+            self._speed = numpy.array(self._speed)
+
+        dt = timestamp - self._time
+        if dt <= 0:
+            # Samples delivered in the same instant can't say anything about speed
+            dt = 1e-3
+        self._time = timestamp
+
+        alpha = self._alpha(self.d_cutoff, dt)
+        self._speed += alpha * ((value - self._value) / dt - self._speed)
+        alpha = self._alpha(self.min_cutoff + self.beta * numpy.abs(self._speed), dt)
+        self._value += alpha * (value - self._value)
+        return self._value.copy()
+
+    def _update_floats(self, timestamp, values):
+        """Filter one sample like update, with floats instead of numpy for a handful of channels
+
+        Arguments:
+            timestamp {float} -- Time of the sample in seconds
+            values {float[]} -- Value of every channel
+
+        Returns {float[]} -- Filtered value of every channel
+        """
+        if self._time is None:
+            self._time = timestamp
+            self._value = list(values)
+            self._speed = [0.0] * len(self._value)
+            return list(self._value)
+
+        dt = timestamp - self._time
+        if dt <= 0:
+            dt = 1e-3
+        self._time = timestamp
+
+        previous, speeds = self._value, self._speed
+        if not isinstance(previous, list):
+            previous, speeds = previous.tolist(), speeds.tolist()
+        scale = 2 * math.pi * dt
+        alpha = 1 / (1 + 1 / (scale * self.d_cutoff))
+        filtered = []
+        for i, value in enumerate(values):
+            speed = speeds[i] + alpha * ((value - previous[i]) / dt - speeds[i])
+            speeds[i] = speed
+            filtered.append(previous[i] + (value - previous[i]) / (1 + 1 / (scale * (self.min_cutoff + self.beta * abs(speed)))))
+        self._value = filtered
+        self._speed = speeds
+        return list(filtered)
+
+    def filter(self, timestamps, values):
+        """Filter a batch of samples, continuing from the previous ones
+
+        Arguments:
+            timestamps {numpy.ndarray} -- (N,) times of the samples in seconds
+            values {numpy.ndarray} -- (N, C) values of every channel
+
+        Returns {numpy.ndarray} -- (N, C) filtered values
+        """
+        values = numpy.asarray(values, dtype=numpy.float64)
+        filtered = numpy.empty_like(values)
+        for i in range(len(values)):
+            filtered[i] = self.update(timestamps[i], values[i])
+        return filtered
+
+class PointerFilter(object):
+    """Turn raw wand quaternions into a smoothed screen pointer and angles
+
+    The quaternion is normalized and run through a OneEuroFilter, then heading,
+    pitch, roll and the pointer are all computed from the smoothed orientation
+    so they always agree with each other.
+    """
+
+    def __init__(self, fov=(60, 40), min_cutoff=1.0, beta=0.007, d_cutoff=1.0):
+        """Create a new pointer filter
+
+        Keyword Arguments:
+            fov {tuple} -- Horizontal and vertical angle the screen covers in degrees (default: {(60, 40)})
+            min_cutoff {float} -- Cutoff frequency in Hz when still, lower is smoother (default: {1.0})
+            beta {float} -- How much the cutoff rises with speed, higher is less laggy (default: {0.007})
+            d_cutoff {float} -- Cutoff frequency in Hz for the speed estimate (default: {1.0})
+        """
+        self.fov = fov
+        self.smoothing = OneEuroFilter(min_cutoff, beta, d_cutoff)
+
+    def _normalize(self, q):
+        norm = numpy.sqrt(numpy.sum(q * q, axis=-1, keepdims=True))
+        norm[norm == 0] = 1
+        return q / norm
+
+    def update(self, timestamp, x, y, z, w):
+        """Filter one position sample
+
+        Arguments:
+            timestamp {int} -- time.monotonic_ns() of the sample
+            x {int} -- X component of the quaternion
+            y {int} -- Y component of the quaternion
+            z {int} -- Z component of the quaternion
+            w {int} -- W component of the quaternion
+
+        Returns {tuple} -- (x, y, heading, pitch, roll), the pointer between -1 and 1 and angles in degrees
+        """
+        # The same math as process, but with floats since numpy costs more than it saves on one sample
+        norm = math.sqrt(x * x + y * y + z * z + w * w) or 1
+        x, y, z, w = x / norm, y / norm, z / norm, w / norm
+        previous = self.smoothing._value
+        if previous is not None:
+            px, py, pz, pw = previous
+            if x * px + y * py + z * pz + w * pw < 0:
+                x, y, z, w = -x, -y, -z, -w
+        x, y, z, w = self.smoothing._update_floats(timestamp / 1e9, (x, y, z, w))
+        norm = math.sqrt(x * x + y * y + z * z + w * w) or 1
+        x, y, z, w = x / norm, y / norm, z / norm, w / norm
+
+        forward = 1 - 2 * (y * y + z * z)
+        side = 2 * (x * y + w * z)
+        up = -2 * (x * z - w * y)
+        if forward > 1e-6:
+            pointer_x = side / forward / math.tan(math.radians(self.fov[0]) / 2)
+            pointer_y = up / forward / math.tan(math.radians(self.fov[1]) / 2)
+        else:
+            pointer_x = math.copysign(2, side) if side else 0.0
+            pointer_y = math.copysign(2, up) if up else 0.0
+
+        return (
+            min(1.0, max(-1.0, pointer_x)),
+            min(1.0, max(-1.0, pointer_y)),
+            math.degrees(math.atan2(side, forward)),
+            math.degrees(math.asin(min(1.0, max(-1.0, 2 * (w * y - x * z))))),
+            math.degrees(math.atan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))),
+        )
+
+    def process(self, timestamps, samples):
+        """Filter a batch of position samples, such as a position_batch
+
+        Arguments:
+            timestamps {numpy.ndarray} -- (N,) time.monotonic_ns() of the samples
+            samples {numpy.ndarray} -- (N, 4) array of (x, y, z, w) quaternions
+
+        Returns {numpy.ndarray} -- (N, 5) array of pointer x, y, heading, pitch and roll
+        """
+        q = self._normalize(numpy.asarray(samples, dtype=numpy.float64).reshape(-1, 4))
+        # q and -q are the same orientation, keep every sample on the side of the
+        # previous one so the filter doesn't average across the flip
+        previous = self.smoothing._value
+        signs = numpy.sign(numpy.sum(q[1:] * q[:-1], axis=1))
+        signs[signs == 0] = 1
+        signs = numpy.cumprod(numpy.concatenate([[1.0], signs]))
+        if previous is not None and numpy.dot(q[0], previous) < 0:
+            signs = -signs
+        q *= signs[:, None]
+
+        smoothed = self._normalize(self.smoothing.filter(numpy.asarray(timestamps) / 1e9, q))
+        result = numpy.empty((len(q), 5))
+        result[:, :2] = quaternion_pointer(smoothed, self.fov)
+        result[:, 2:] = quaternion_euler(smoothed)
+        return result
+
+def _quaternion_multiply(a, b):
+    """Hamilton product of two (x, y, z, w) quaternions"""
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return (
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+        aw * bw - ax * bx - ay * by - az * bz,
+    )
+
+class MotionPredictor(object):
+    """Extrapolate the wand's orientation to hide notification latency
+
+    Angular velocity is estimated from consecutive quaternions and smoothed, then
+    the newest orientation is rotated forward to the time asked for plus the
+    look-ahead. Without a fixed look-ahead it follows the measured time between
+    notifications, which is roughly how stale a sample is when it arrives.
+    """
+
+    def __init__(self, lookahead_ms=None, max_lookahead_ms=100, smoothing=0.3):
+        """Create a new predictor
+
+        Keyword Arguments:
+            lookahead_ms {float} -- Time to predict past the request, None to tune it from arrival times (default: {None})
+            max_lookahead_ms {float} -- Longest tuned look-ahead (default: {100})
+            smoothing {float} -- Weight of the newest velocity and interval estimates, between 0 and 1 (default: {0.3})
+        """
+        self.fixed_lookahead = None if lookahead_ms is None else lookahead_ms / 1000
+        self.max_lookahead = max_lookahead_ms / 1000
+        self.smoothing = smoothing
+        self._wand = None
+        self._id = None
+        self.reset()
+
+    def reset(self):
+        """Forget every sample seen so far, staying attached to the wand
+        """
+        self.timestamp = None
+        self.orientation = None
+        self.velocity = (0.0, 0.0, 0.0)
+        self.interval = 0.0
+        self.jitter = 0.0
+
+    @property
+    def lookahead(self):
+        """Seconds predicted past the requested time"""
+        if self.fixed_lookahead is not None:
+            return self.fixed_lookahead
+        return min(self.max_lookahead, self.interval + self.jitter)
+
+    def update(self, timestamp, x, y, z, w):
+        """Add a position sample
+
+        Arguments:
+            timestamp {int} -- time.monotonic_ns() of the sample
+            x {int} -- X component of the quaternion
+            y {int} -- Y component of the quaternion
+            z {int} -- Z component of the quaternion
+            w {int} -- W component of the quaternion
+        """
+        norm = math.sqrt(x * x + y * y + z * z + w * w) or 1
+        q = (x / norm, y / norm, z / norm, w / norm)
+        previous = self.orientation
+        if previous is None:
+            self.timestamp, self.orientation = timestamp, q
+            return
+
+        if sum(a * b for a, b in zip(q, previous)) < 0:
+            q = tuple(-a for a in q)
+        dt = (timestamp - self.timestamp) / 1e9
+        self.timestamp, self.orientation = timestamp, q
+        if dt <= 0:
+            return
+
+        k = self.smoothing
+        if self.interval == 0:
+            self.interval = dt
+        else:
+            self.jitter += k * (abs(dt - self.interval) - self.jitter)
+            self.interval += k * (dt - self.interval)
+
+        # Rotation from the previous sample to this one, as an axis and angle
+        dx, dy, dz, dw = _quaternion_multiply(q, (-previous[0], -previous[1], -previous[2], previous[3]))
+        sine = math.sqrt(dx * dx + dy * dy + dz * dz)
+        if sine < 1e-9:
+            velocity = (0.0, 0.0, 0.0)
+        else:
+            rate = 2 * math.atan2(sine, dw) / dt / sine
+            velocity = (dx * rate, dy * rate, dz * rate)
+        self.velocity = tuple(v + k * (n - v) for v, n in zip(self.velocity, velocity))
+
+    def predict(self, timestamp=None):
+        """Predict the orientation at a time plus the look-ahead
+
+        Keyword Arguments:
+            timestamp {int} -- time.monotonic_ns() to predict for, now if None (default: {None})
+
+        Returns {tuple} -- Unit (x, y, z, w) quaternion, None before the first sample
+        """
+        if self.orientation is None:
+            return None
+        if timestamp is None:
+            timestamp = time.monotonic_ns()
+
+        horizon = max(0.0, (timestamp - self.timestamp) / 1e9) + self.lookahead
+        vx, vy, vz = self.velocity
+        speed = math.sqrt(vx * vx + vy * vy + vz * vz)
+        if speed < 1e-9:
+            return self.orientation
+        half = speed * horizon / 2
+        scale = math.sin(half) / speed
+        return _quaternion_multiply((vx * scale, vy * scale, vz * scale, math.cos(half)), self.orientation)
+
+    def attach(self, wand):
+        """Feed a wand's positions to the predictor
+
+        Arguments:
+            wand {Wand} -- Wand to follow
+
+        Returns {str} -- ID of the position callback
+        """
+        self.detach()
+        self._wand = wand
+        self._id = wand.on("position", lambda x, y, z, w: self.update(wand.position_buffer.last_timestamp, x, y, z, w))
+        return self._id
+
+    def detach(self):
+        """Stop following the attached wand
+
+        Returns {bool} -- If removal was successful or not
+        """
+        if self._wand is None:
+            return False
+        wand, self._wand = self._wand, None
+        return wand.off(self._id)
+
+def evaluate_predictor(trace, predictor=None, handle=41):
+    """Replay the positions in a trace through a predictor and measure its error
+
+    After each sample the predictor guesses the orientation one look-ahead later,
+    which is compared against the trace, interpolated to that time. Holding the
+    sample, as happens without prediction, is measured the same way.
+
+    Arguments:
+        trace {str|kano_wand.TraceReader} -- Path or reader of the trace
+
+    Keyword Arguments:
+        predictor {kano_wand.MotionPredictor} -- Predictor to evaluate, a self-tuning one if None (default: {None})
+        handle {int} -- Handle of the position notifications (default: {41})
+
+    Returns {dict} -- Sample count, mean look-ahead and the mean and 95th percentile error in degrees, predicted and held
+    """
+    if predictor is None:
+        predictor = MotionPredictor()
+    reader = trace if isinstance(trace, TraceReader) else TraceReader(trace)
+    try:
+        records = [(timestamp, bytes(data)) for timestamp, record_handle, data in reader if record_handle == handle]
+    finally:
+        if reader is not trace:
+            reader.close()
+    if len(records) < 2:
+        raise ValueError("The trace needs at least two position samples")
+
+    timestamps = numpy.array([timestamp for timestamp, _ in records], dtype=numpy.int64)
+    samples = decode_positions(b"".join(data for _, data in records)).astype(numpy.float64)
+    samples /= numpy.linalg.norm(samples, axis=1, keepdims=True).clip(1e-9)
+
+    truths, predicted, held, lookaheads = [], [], [], []
+    for i in range(len(timestamps)):
+        predictor.update(int(timestamps[i]), *samples[i].tolist())
+        target = timestamps[i] + int(predictor.lookahead * 1e9)
+        # The first sample after the target, so there's always one at or before it
+        j = numpy.searchsorted(timestamps, target, side="right")
+        if j >= len(timestamps):
+            break
+        # Normalized linear interpolation between the samples around the target
+        before, after = samples[j - 1], samples[j]
+        if numpy.dot(before, after) < 0:
+            after = -after
+        span = timestamps[j] - timestamps[j - 1]
+        t = (target - timestamps[j - 1]) / span if span else 1.0
+        truth = before + (after - before) * t
+        truth /= numpy.linalg.norm(truth)
+
+        truths.append(truth)
+        predicted.append(predictor.predict(int(timestamps[i])))
+        held.append(samples[i])
+        lookaheads.append(predictor.lookahead)
+
+    if len(truths) == 0:
+        raise ValueError("The trace is shorter than the look-ahead")
+    truths = numpy.array(truths)
+    angle = lambda q: numpy.degrees(2 * numpy.arccos(numpy.clip(numpy.abs(numpy.sum(numpy.array(q) * truths, axis=1)), 0, 1)))
+    predicted_error, held_error = angle(predicted), angle(held)
+    return {
+        "samples": len(truths),
+        "lookahead_ms": float(numpy.mean(lookaheads)) * 1000,
+        "error_deg": float(numpy.mean(predicted_error)),
+        "error_p95_deg": float(numpy.percentile(predicted_error, 95)),
+        "held_error_deg": float(numpy.mean(held_error)),
+        "held_error_p95_deg": float(numpy.percentile(held_error, 95)),
+    }
+
+class RateEstimator(object):
+    """Online estimate of the effective rate of an irregular stream
+
+    BLE delivers notifications in bursts, several per connection interval and
+    then nothing. Intervals are averaged with weights that decay with time rather
+    than with the number of samples, so a burst counts no more than the gap after
+    it and the estimate is samples per second over the last time_constant or so.
+    """
+
+    def __init__(self, time_constant=1.0):
+        """Create a new rate estimator
+
+        Keyword Arguments:
+            time_constant {float} -- Seconds for older intervals to fade to about a third of their weight (default: {1.0})
+        """
+        self.time_constant = time_constant
+        self._time_constant_ns = time_constant * 1e9
+        self.reset()
+
+    def reset(self):
+        """Forget every sample
+        """
+        self.count = 0
+        self._last = None
+        self._weight = 0.0
+        self._span = 0.0
+
+    def update(self, timestamp):
+        """Add a sample
+
+        Arguments:
+            timestamp {int} -- time.monotonic_ns() of the sample
+        """
+        self.count += 1
+        last = self._last
+        self._last = timestamp
+        if last is None:
+            return
+        elapsed = timestamp - last
+        decay = math.exp(-elapsed / self._time_constant_ns)
+        self._weight = self._weight * decay + 1
+        self._span = self._span * decay + elapsed
+
+    @property
+    def rate(self):
+        """Samples per second, None until there are two samples
+        """
+        if self._span <= 0:
+            return None
+        return self._weight / self._span * 1e9
+
+    @property
+    def interval(self):
+        """Mean seconds between samples, None until there are two samples
+        """
+        if self._weight == 0:
+            return None
+        return self._span / self._weight / 1e9
+
+def _align_hemispheres(samples):
+    """Flip the sign of quaternions so each is in the same hemisphere as the one before
+
+    q and -q are the same orientation, interpolating between them isn't.
+    """
+    flips = numpy.einsum("ij,ij->i", samples[1:], samples[:-1]) < 0
+    signs = numpy.ones(len(samples))
+    signs[1:] = 1 - 2 * (numpy.cumsum(flips) % 2)
+    return samples * signs[:, None]
+
+def resample(timestamps, values, rate, start=None, max_gap_ms=None, quaternion=False):
+    """Linearly interpolate irregular samples onto a uniform grid
+
+    Arguments:
+        timestamps {numpy.ndarray} -- (N,) increasing time.monotonic_ns() of the samples
+        values {numpy.ndarray} -- (N,) or (N, C) values of the samples
+        rate {float} -- Output rate in Hz
+
+    Keyword Arguments:
+        start {int} -- Time of the first output sample, the first input's if None (default: {None})
+        max_gap_ms {float} -- Leave out output in gaps between inputs longer than this, fill every gap if None (default: {None})
+        quaternion {bool} -- Values are (x, y, z, w) quaternions, keep neighbours in the same hemisphere (default: {False})
+
+    Returns {tuple} -- (timestamps, values) int64 (M,) and float64 (M,) or (M, C) arrays
+    """
+    timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if len(timestamps) == 0:
+        return timestamps, values
+    if quaternion:
+        values = _align_hemispheres(values)
+
+    period = 1e9 / rate
+    first = int(timestamps[0]) if start is None else int(start)
+    count = int((int(timestamps[-1]) - first) // period) + 1 if timestamps[-1] >= first else 0
+    grid = first + numpy.round(numpy.arange(count) * period).astype(numpy.int64)
+
+    left = numpy.searchsorted(timestamps, grid, side="right") - 1
+    keep = left >= 0
+    left = numpy.maximum(left, 0)
+    right = numpy.minimum(left + 1, len(timestamps) - 1)
+    span = timestamps[right] - timestamps[left]
+    if max_gap_ms is not None:
+        keep &= span <= max_gap_ms * 1e6
+    fraction = numpy.divide(grid - timestamps[left], span, out=numpy.zeros(len(grid)), where=span > 0)
+    if values.ndim > 1:
+        fraction = fraction[:, None]
+    resampled = values[left] + (values[right] - values[left]) * fraction
+    return grid[keep], resampled[keep]
+
+class Resampler(object):
+    """Turn a wand's bursty positions into a stream at a uniform rate, for filters and recognizers
+    """
+
+    def __init__(self, rate=100, max_gap_ms=250, quaternion=True):
+        """Create a new resampler
+
+        Keyword Arguments:
+            rate {float} -- Output rate in Hz (default: {100})
+            max_gap_ms {float} -- Leave out output in gaps between inputs longer than this, fill every gap if None (default: {250})
+            quaternion {bool} -- Values are (x, y, z, w) quaternions, keep neighbours in the same hemisphere (default: {True})
+        """
+        self.rate = rate
+        self.max_gap_ms = max_gap_ms
+        self.quaternion = quaternion
+        self._wand = None
+        self._id = None
+        self.reset()
+
+    def reset(self):
+        """Forget the stream so far, the next batch starts a new grid
+        """
+        self._next = None
+        self._last = None
+
+    def process(self, timestamps, values):
+        """Resample the next batch of a stream
+
+        Output continues the grid of the previous batch, interpolating between its
+        newest sample and this batch's first.
+
+        Arguments:
+            timestamps {numpy.ndarray} -- (N,) increasing time.monotonic_ns() of the samples
+            values {numpy.ndarray} -- (N, C) values of the samples
+
+        Returns {tuple} -- (timestamps, values) int64 (M,) and float64 (M, C) uniform samples up to the newest input
+        """
+        timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if len(timestamps) == 0:
+            return timestamps, values
+        if self._last is not None:
+            timestamps = numpy.concatenate(([self._last[0]], timestamps))
+            values = numpy.concatenate((self._last[1][None], values))
+        if self.quaternion:
+            values = _align_hemispheres(values)
+
+        start = int(timestamps[0]) if self._next is None else self._next
+        grid, resampled = resample(timestamps, values, self.rate, start=start, max_gap_ms=self.max_gap_ms)
+        period = 1e9 / self.rate
+        if timestamps[-1] >= start:
+            self._next = start + int(round((int((int(timestamps[-1]) - start) // period) + 1) * period))
+        self._last = (int(timestamps[-1]), values[-1].copy())
+        return grid, resampled
+
+    def attach(self, wand, callback, max_batch=32, max_latency_ms=50):
+        """Resample a wand's positions as they arrive
+
+        Arguments:
+            wand {Wand} -- Wand to follow
+            callback {function} -- Called with (timestamps, samples) of every uniform batch
+
+        Keyword Arguments:
+            max_batch {int} -- Most input samples per batch (default: {32})
+            max_latency_ms {float} -- Longest an input sample waits to be resampled (default: {50})
+
+        Returns {str} -- ID of the position_batch callback
+        """
+        self.detach()
+        self.reset()
+
+        def resampled(timestamps, samples):
+            timestamps, samples = self.process(timestamps, samples)
+            if len(timestamps):
+                callback(timestamps, samples)
+
+        self._wand = wand
+        self._id = wand.on("position_batch", resampled, max_batch=max_batch, max_latency_ms=max_latency_ms)
+        return self._id
+
+    def detach(self):
+        """Stop following the attached wand
+
+        Returns {bool} -- If removal was successful or not
+        """
+        if self._wand is None:
+            return False
+        wand, self._wand = self._wand, None
+        return wand.off(self._id)
+
+def quaternion_directions(samples):
+    """Get the direction the wand points for each quaternion
+
+    Arguments:
+        samples {numpy.ndarray} -- (N, 4) array of (x, y, z, w) quaternions, any scale
+
+    Returns {numpy.ndarray} -- (N, 3) float32 array of unit vectors
+    """
+    q = numpy.asarray(samples, dtype=numpy.float32).reshape(-1, 4)
+    norm = numpy.sum(q * q, axis=1)
+    norm[norm == 0] = 1
+    x, y, z, w = q.T
+    # First column of the rotation matrix, the wand's x axis rotated by the quaternion
+    directions = numpy.empty((len(q), 3), dtype=numpy.float32)
+    directions[:, 0] = norm - 2 * (y * y + z * z)
+    directions[:, 1] = 2 * (x * y + w * z)
+    directions[:, 2] = 2 * (x * z - w * y)
+    return directions / norm[:, None]
+
+def _resample_indices(count, length):
+    """Get indices and weights to linearly resample count samples to length samples"""
+    position = numpy.linspace(0, count - 1, length)
+    low = numpy.floor(position).astype(numpy.intp)
+    high = numpy.minimum(low + 1, count - 1)
+    return low, high, (position - low).astype(numpy.float32)[:, None]
+
+class SpellRecognizer(object):
+    """Match wand motion against spell templates
+
+    Positions arrive in batches. Once per batch, the newest samples are cut
+    into windows of several lengths, from min_window to window samples. Every
+    window is resampled to the templates' length and compared against every
+    template. Neighbouring lengths are close enough for the DTW band to cover
+    the gap between them, so a spell is recognized whether it's cast over
+    min_window samples or over window samples. With the defaults at the wand's
+    rate of about 100 samples a second, that's from 0.16 to 0.64 seconds.
+    LB_Keogh lower bounds rule out most pairs of windows and templates cheaply.
+    Banded DTW then runs on the rest, vectorized over pairs along the
+    anti-diagonals.
+    """
+
+    def __init__(self, spells=None, length=32, window=64, band=4, threshold=0.25, min_motion=0.1, settle=8, cooldown_ms=500, min_window=16,
+                 debug=False):
+        """Create a new recognizer
+
+        Keyword Arguments:
+            spells {dict} -- Spell names mapped to (N, 4) arrays of recorded positions (default: {None})
+            length {int} -- Points every window and template is resampled to (default: {32})
+            window {int} -- Most samples a spell can be cast over (default: {64})
+            band {int} -- Sakoe-Chiba band width, in points (default: {4})
+            threshold {float} -- Largest RMS distance that counts as a match (default: {0.25})
+            min_motion {float} -- Smallest RMS spread of a window or template, so holding still never matches (default: {0.1})
+            settle {int} -- Samples without a better match before the best one is emitted (default: {8})
+            cooldown_ms {float} -- Time after a match before a wand can match again (default: {500})
+            min_window {int} -- Fewest samples a spell can be cast over (default: {16})
+            debug {bool} -- Print debug messages (default: {False})
+        """
+        self.length = length
+        self.window = window
+        self.min_window = min(min_window, window)
+        self.band = band
+        self.threshold = threshold
+        self.min_motion = min_motion
+        self.settle = settle
+        self.cooldown = int(cooldown_ms * 1000000)
+        self.debug = debug
+        self.latency = 0.0
+        self._spells = {}
+        self._states = {}
+        # Window lengths a factor apart that the band can warp across, longest last
+        factor = 1 + max(band, 1) * 2 / length
+        count = int(math.ceil(math.log(window / self.min_window) / math.log(factor))) + 1 if window > self.min_window else 1
+        sizes = sorted({int(round(size)) for size in numpy.geomspace(self.min_window, window, count)})
+        self._scales = [(size,) + _resample_indices(size, length) for size in sizes]
+        self._diagonals = []
+        for diagonal in range(length * 2 - 1):
+            i = numpy.arange(max(0, diagonal - length + 1), min(diagonal, length - 1) + 1)
+            i = i[numpy.abs(2 * i - diagonal) <= band]
+            self._diagonals.append((i, diagonal - i))
+        self._compile()
+
+        for name, samples in (spells or {}).items():
+            self.add_spell(name, samples)
+
+    def add_spell(self, name, samples):
+        """Add or replace a spell template
+
+        Arguments:
+            name {str} -- Name of the spell
+            samples {numpy.ndarray} -- (N, 4) array of (x, y, z, w) positions recorded while casting it
+        """
+        directions = quaternion_directions(samples)
+        if len(directions) < 2:
+            raise ValueError("A spell needs at least 2 samples")
+        low, high, weight = _resample_indices(len(directions), self.length)
+        template = directions[low] * (1 - weight) + directions[high] * weight
+        template -= template.mean(axis=0)
+        if numpy.sqrt(numpy.mean(numpy.sum(template * template, axis=1))) < self.min_motion:
+            raise ValueError("Spell {} has too little motion to be recognized".format(name))
+        self._spells[name] = template
+        self._compile()
+
+    def remove_spell(self, name):
+        """Remove a spell template
+
+        Arguments:
+            name {str} -- Name of the spell
+
+        Returns {bool} -- If removal was successful or not
+        """
+        removed = self._spells.pop(name, None) is not None
+        self._compile()
+        return removed
+
+    def _compile(self):
+        """Stack the templates and their LB_Keogh envelopes"""
+        names = list(self._spells.keys())
+        templates = numpy.array([self._spells[name] for name in names], dtype=numpy.float32).reshape(-1, self.length, 3)
+        padded = numpy.pad(templates, ((0, 0), (self.band, self.band), (0, 0)), mode="edge")
+        windows = numpy.lib.stride_tricks.sliding_window_view(padded, self.band * 2 + 1, axis=1)
+        # Swapped in one assignment so matching threads never see a half built set
+        self._compiled = (names, templates, windows.max(axis=-1), windows.min(axis=-1))
+
+    def attach(self, wand, max_batch=4, max_latency_ms=50):
+        """Start matching a wand's positions, matches are emitted as "spell" events on the wand
+
+        Arguments:
+            wand {Wand} -- Wand to watch
+
+        Keyword Arguments:
+            max_batch {int} -- Most samples per match (default: {4})
+            max_latency_ms {float} -- Longest a sample waits to be matched (default: {50})
+
+        Returns {str} -- ID of the position_batch callback
+        """
+        self.detach(wand)
+        state = {
+            "directions": numpy.zeros((self.window * 2, 3), dtype=numpy.float32),
+            "count": 0,
+            "pending": None,
+            "stale": 0,
+            "last_match": None,
+        }
+        self._states[wand] = state
+        state["id"] = wand.on("position_batch", lambda timestamps, samples: self._update(wand, state, timestamps, samples),
+            max_batch=max_batch, max_latency_ms=max_latency_ms)
+        return state["id"]
+
+    def detach(self, wand):
+        """Stop matching a wand's positions
+
+        Arguments:
+            wand {Wand} -- Wand to stop watching
+
+        Returns {bool} -- If removal was successful or not
+        """
+        state = self._states.pop(wand, None)
+        if state is None:
+            return False
+        return wand.off(state["id"])
+
+    def _update(self, wand, state, timestamps, samples):
+        received = int(timestamps[-1])
+
+        # Mirrored like PositionBuffer so the window is always one slice
+        added = len(samples)
+        directions = quaternion_directions(samples[-self.window:])
+        i = (state["count"] + numpy.arange(added - len(directions), added)) % self.window
+        state["directions"][i] = state["directions"][i + self.window] = directions
+        state["count"] += added
+        if state["count"] < self.min_window:
+            return
+        if state["last_match"] is not None and received - state["last_match"] < self.cooldown:
+            return
+
+        # The newest samples in order, oldest first, every window length is a suffix of them
+        start = state["count"] % self.window
+        newest = state["directions"][start:start + self.window]
+        queries = [self._query(newest[self.window - size:], low, high, weight)
+            for size, low, high, weight in self._scales if size <= state["count"]]
+        name, distance = self._best([query for query in queries if query is not None])
+
+        # Wait for the distance to stop improving so a spell isn't cast halfway through the motion
+        pending = state["pending"]
+        if name is not None and (pending is None or distance < pending[1]):
+            state["pending"] = (name, distance)
+            state["stale"] = 0
+            return
+        if pending is None:
+            return
+        state["stale"] += added
+        if state["stale"] < self.settle:
+            return
+
+        state["pending"] = None
+        state["last_match"] = received
+        self.latency = (time.monotonic_ns() - received) / 1000000
+        wand._on_spell(pending[0], 1 - pending[1] / self.threshold, self.latency)
+
+    def match(self, samples, directions=False):
+        """Find the spell closest to a window of samples
+
+        Arguments:
+            samples {numpy.ndarray} -- (N, 4) array of positions, or (N, 3) directions
+
+        Keyword Arguments:
+            directions {bool} -- Samples are already directions from quaternion_directions (default: {False})
+
+        Returns {tuple} -- (name, distance) of the best match, or (None, None) if nothing is under the threshold
+        """
+        if not directions:
+            samples = quaternion_directions(samples)
+        query = self._query(samples, *_resample_indices(len(samples), self.length))
+        return self._best([] if query is None else [query])
+
+    def _query(self, directions, low, high, weight):
+        """Resample and center a window of directions, None if it has too little motion"""
+        query = directions[low] * (1 - weight) + directions[high] * weight
+        query -= query.mean(axis=0)
+        if numpy.sqrt(numpy.mean(numpy.sum(query * query, axis=1))) < self.min_motion:
+            return None
+        return query
+
+    def _best(self, queries):
+        """Find the closest pair of a query and a template
+
+        Arguments:
+            queries {numpy.ndarray[]} -- (L, 3) resampled, centered queries
+
+        Returns {tuple} -- (name, distance) of the best match, or (None, None) if nothing is under the threshold
+        """
+        names, templates, upper, lower = self._compiled
+        if len(names) == 0 or len(queries) == 0:
+            return None, None
+
+        # LB_Keogh, squared distance from every query to each template's envelope
+        queries = numpy.array(queries)[:, None]
+        above = numpy.maximum(queries - upper, 0)
+        below = numpy.maximum(lower - queries, 0)
+        bounds = numpy.sqrt(numpy.sum(above * above + below * below, axis=(2, 3)) / self.length)
+        query_index, template_index = numpy.nonzero(bounds < self.threshold)
+        if len(query_index) == 0:
+            return None, None
+
+        distances = self._dtw(queries[query_index, 0], templates[template_index])
+        best = numpy.argmin(distances)
+        if distances[best] >= self.threshold:
+            return None, None
+
+        name = names[template_index[best]]
+        if self.debug:
+            print("Matched {} of {} window and template pairs after LB_Keogh, best {} ({:.3f})".format(
+                len(query_index), bounds.size, name, distances[best]))
+        return name, float(distances[best])
+
+    def _dtw(self, queries, templates):
+        """Banded DTW of queries against templates, pair by pair
+
+        Arguments:
+            queries {numpy.ndarray} -- (P, L, 3) resampled, centered queries
+            templates {numpy.ndarray} -- (P, L, 3) resampled, centered templates
+
+        Returns {numpy.ndarray} -- (P,) RMS distance along the best warping path
+        """
+        length = self.length
+        # |q - t|^2 expanded so the pairwise part is one batched matrix multiply, pairs last so each cell is contiguous
+        cost = numpy.sum(queries * queries, axis=2).T[:, None, :] + numpy.sum(templates * templates, axis=2).T[None, :, :]
+        cost -= 2 * numpy.matmul(queries, templates.transpose(0, 2, 1)).transpose(1, 2, 0)
+        numpy.maximum(cost, 0, out=cost)
+        total = numpy.full((length + 1, length + 1, len(templates)), numpy.inf, dtype=numpy.float32)
+        total[0, 0] = 0
+
+        # Cells on an anti-diagonal only depend on the two before it, so each one is a single vector step
+        for i, j in self._diagonals:
+            best = numpy.minimum(numpy.minimum(total[i, j + 1], total[i + 1, j]), total[i, j])
+            total[i + 1, j + 1] = cost[i, j] + best
+
+        return numpy.sqrt(total[length, length] / length)
+
+def flicked(direction="up", degrees=30.0, within_ms=300):
+    """Make a FleetAggregator motion that matches wands flicked in a direction
+
+    Arguments and the result are those of a motion, see FleetAggregator.add_motion.
+
+    Keyword Arguments:
+        direction {str} -- "up", "down", "left" or "right", as seen from behind the wand (default: {"up"})
+        degrees {float} -- Smallest turn in that direction (default: {30.0})
+        within_ms {float} -- Longest the turn can take (default: {300})
+
+    Returns {function} -- The motion
+    """
+    if direction not in ("up", "down", "left", "right"):
+        raise ValueError("Unknown direction {}, expected up, down, left or right".format(direction))
+    sign = 1 if direction in ("up", "right") else -1
+
+    def motion(directions, valid, rate):
+        span = min(max(int(math.ceil(within_ms * rate / 1000)) + 1, 2), directions.shape[1])
+        directions = directions[:, -span:]
+        if direction in ("up", "down"):
+            # Pointing up is -z, see quaternion_pointer
+            angle = numpy.degrees(numpy.arcsin(numpy.clip(-directions[..., 2], -1, 1)))
+        else:
+            angle = numpy.degrees(numpy.unwrap(numpy.arctan2(directions[..., 1], directions[..., 0]), axis=1))
+        angle *= sign
+        # Largest rise from any earlier sample in the span
+        rise = (angle - numpy.minimum.accumulate(angle, axis=1)).max(axis=1)
+        return (rise >= degrees) & valid[:, -span:].all(axis=1)
+
+    return motion
+
+class FleetAggregator(object):
+    """Time-aligned positions of many wands in one array, and group metrics computed from it at once
+
+    Added wands keep their position_buffer in rows of one block of memory, so
+    the notification path is unchanged and nothing runs per sample. Every tick
+    the newest samples of all wands are gathered into window, a (wands, samples,
+    4) float32 array of unit quaternions on a shared time grid ending now, with
+    the latest sample at or before each grid time. valid marks the cells whose
+    sample is at most max_gap_ms old. Metrics then cost a handful of numpy calls
+    however many wands there are.
+
+    Motions are functions of (directions, valid, rate), where directions is the
+    (wands, samples, 3) array of where each wand points, returning which wands
+    made the motion as a (wands,) bool array, see flicked().
+    """
+
+    def __init__(self, wands=(), window_ms=300, rate=100, tick_ms=50, max_gap_ms=100, buffer_size=256, debug=False):
+        """Create a new aggregator
+
+        Keyword Arguments:
+            wands {Wand[]} -- Wands to aggregate (default: {()})
+            window_ms {float} -- Length of the window (default: {300})
+            rate {float} -- Samples per second of the window's time grid (default: {100})
+            tick_ms {float} -- Time between tick events when running (default: {50})
+            max_gap_ms {float} -- Oldest a sample can be and still fill a grid time (default: {100})
+            buffer_size {int} -- Number of samples kept in each wand's position_buffer (default: {256})
+            debug {bool} -- Print debug messages (default: {False})
+        """
+        self.samples = int(round(window_ms * rate / 1000)) + 1
+        self.rate = rate
+        self.tick_ms = tick_ms
+        self.max_gap_ms = max_gap_ms
+        self.buffer_size = max(buffer_size, self.samples)
+        self.debug = debug
+        self.running = False
+        self.wands = []
+        self.motions = {}
+        self._buffers = []
+        self._holds = {}
+        self.window = numpy.zeros((0, self.samples, 4), dtype=numpy.float32)
+        self.valid = numpy.zeros((0, self.samples), dtype=bool)
+        self.timestamps = numpy.zeros(self.samples, dtype=numpy.int64)
+        self.tick_time = Histogram()
+        self._timestamps = numpy.zeros((0, self.buffer_size * 2), dtype=numpy.int64)
+        self._samples = numpy.zeros((0, self.buffer_size * 8), dtype=numpy.int16)
+        self._tick_callbacks = {}
+        self._motion_callbacks = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+        for wand in wands:
+            self.add(wand)
+
+    def add(self, wand):
+        """Start aggregating a wand, keeping its position notifications on until it's removed
+
+        Arguments:
+            wand {Wand} -- Wand to aggregate, connect it first
+        """
+        with self._lock:
+            if wand in self.wands:
+                return
+            row = len(self.wands)
+            if row == len(self._timestamps):
+                # Grow the block, every wand's buffer moves to the new one
+                capacity = max(16, row * 2)
+                timestamps = numpy.zeros((capacity, self.buffer_size * 2), dtype=numpy.int64)
+                samples = numpy.zeros((capacity, self.buffer_size * 8), dtype=numpy.int16)
+                self._timestamps, self._samples = timestamps, samples
+                for i, other in enumerate(self.wands):
+                    self._place(other, i)
+            self.wands.append(wand)
+            self._place(wand, row)
+            self._holds[wand] = wand._hold_position(self)
+
+    def remove(self, wand):
+        """Stop aggregating a wand, it gets a position_buffer of its own back
+
+        Arguments:
+            wand {Wand} -- Wand to stop aggregating
+
+        Returns {bool} -- If removal was successful or not
+        """
+        with self._lock:
+            if wand not in self.wands:
+                return False
+            row = self.wands.index(wand)
+            wand.off(self._holds.pop(wand))
+            self._move(wand, PositionBuffer(self.buffer_size))
+            # The last wand fills the gap, so the rows in use stay contiguous
+            last = self.wands.pop()
+            self._buffers.pop()
+            if last is not wand:
+                self.wands[row] = last
+                self._place(last, row)
+        return True
+
+    def _place(self, wand, row):
+        """Move a wand's position_buffer into a row of the block"""
+        self._timestamps[row] = 0
+        self._samples[row] = 0
+        buffer = PositionBuffer(self.buffer_size, storage=(self._timestamps[row], self._samples[row]))
+        self._move(wand, buffer)
+        self._buffers[row:row + 1] = [buffer]
+
+    def _move(self, wand, buffer):
+        """Copy the newest samples of a wand's position_buffer to another buffer and swap it in
+
+        Runs on the wand's hub thread, which appends the samples, so none is lost.
+        """
+        wand._call(self._swap, wand, buffer)
+
+    def _swap(self, wand, buffer):
+        old = wand.position_buffer
+        count = min(old.count, old.size, buffer.size)
+        if count:
+            timestamps, samples = old.latest(count)
+            slots = numpy.arange(old.count - count, old.count) % buffer.size
+            new_timestamps = numpy.frombuffer(buffer._timestamps, dtype=numpy.int64)
+            new_samples = numpy.frombuffer(buffer._samples, dtype=numpy.int16).reshape(-1, 4)
+            for offset in (0, buffer.size):
+                new_timestamps[slots + offset] = timestamps
+                new_samples[slots + offset] = samples
+        buffer.count = old.count
+        wand.position_buffer = buffer
+
+    def add_motion(self, name, motion):
+        """Add a motion to measure every tick, see flicked
+
+        Arguments:
+            name {str} -- Name of the motion, in fractions and for on()
+            motion {function} -- Motion function
+        """
+        self.motions[name] = motion
+
+    def update(self, now=None):
+        """Gather the newest samples of every wand into window and valid
+
+        Keyword Arguments:
+            now {int} -- time.monotonic_ns() the window ends at, now if None (default: {None})
+
+        Returns {tuple} -- (timestamps, window, valid) (samples,) int64, (wands, samples, 4) float32 and (wands, samples) bool arrays
+        """
+        if now is None:
+            now = time.monotonic_ns()
+        period = 1000000000 / self.rate
+        grid = now - numpy.round(numpy.arange(self.samples - 1, -1, -1) * period).astype(numpy.int64)
+        gap = int(self.max_gap_ms * 1000000)
+
+        size = self.buffer_size
+        # Enough of the newest samples to cover the window at twice the grid rate, they are contiguous in every row
+        depth = min(size, self.samples * 2 + 16)
+        # add() and remove() move rows and swap the blocks, so everything read from them is read under the lock
+        with self._lock:
+            count = len(self.wands)
+            buffers = self._buffers
+            counts = numpy.fromiter([buffer.count for buffer in buffers], dtype=numpy.int64, count=count)
+            rows = numpy.arange(count)
+            first = rows * (size * 2) + (counts - depth) % size
+            timestamps = numpy.take(self._timestamps, first[:, None] + numpy.arange(depth))
+
+            # Rows are sorted, so laid end to end with an offset each, one searchsorted finds every hold sample
+            start = grid[0] - gap
+            span = grid[-1] - start + 2
+            offsets = rows * (span + 1)
+            keys = (numpy.clip(timestamps - start, -1, span) + offsets[:, None]).ravel()
+            found = numpy.searchsorted(keys, ((grid - start)[None, :] + offsets[:, None]).ravel(), side="right").reshape(count, -1) - 1
+            found -= (rows * depth)[:, None]
+            inside = found >= 0
+            found = numpy.maximum(found, 0)
+            window = numpy.take(self._samples.reshape(-1, 4), first[:, None] + found, axis=0).astype(numpy.float32)
+            # Hub threads keep appending meanwhile, a sample whose slot was reused since counts were read is torn
+            written = numpy.fromiter([buffer.count for buffer in buffers], dtype=numpy.int64, count=count)
+
+        held = timestamps[rows[:, None], found]
+        kept = counts[:, None] - depth + found
+        valid = inside & (kept >= 0) & (kept > written[:, None] - size) & (held >= grid - gap)
+
+        norm = numpy.sqrt(numpy.sum(window * window, axis=2))
+        valid &= norm > 0
+        window /= numpy.where(norm > 0, norm, 1)[:, :, None]
+        window[~valid] = 0
+
+        self.timestamps, self.window, self.valid = grid, window, valid
+        return grid, window, valid
+
+    def metrics(self, now=None):
+        """Update the window and compute the group metrics
+
+        Keyword Arguments:
+            now {int} -- time.monotonic_ns() the window ends at, now if None (default: {None})
+
+        Returns {dict} -- timestamp of the window's end, wands, active wands with a valid latest sample,
+            their mean_direction unit vector and coherence, the length of their mean direction from 0 to 1,
+            and the fraction of active wands that made each motion by name
+        """
+        timestamps, window, valid = self.update(now)
+        count = len(window)
+        directions = quaternion_directions(window).reshape(count, self.samples, 3)
+        active = valid[:, -1]
+        metrics = {
+            "timestamp": int(timestamps[-1]),
+            "wands": count,
+            "active": int(active.sum()),
+            "mean_direction": None,
+            "coherence": None,
+            "fractions": {},
+        }
+        if metrics["active"]:
+            mean = directions[active, -1].mean(axis=0)
+            coherence = float(numpy.linalg.norm(mean))
+            metrics["coherence"] = coherence
+            metrics["mean_direction"] = mean / coherence if coherence > 0 else mean
+        for name, motion in list(self.motions.items()):
+            matched = motion(directions, valid, self.rate) & active
+            metrics["fractions"][name] = float(matched.sum()) / metrics["active"] if metrics["active"] else 0.0
+        return metrics
+
+    def on(self, event, callback, threshold=0.8):
+        """Add a tick listener
+
+        "tick" callbacks get the metrics of every tick. Motion callbacks, with the
+        name of a motion as the event, get the metrics of the tick the fraction of
+        wands making the motion reaches threshold, and again only once it has
+        dropped below it.
+
+        Arguments:
+            event {str} -- "tick" or the name of a motion
+            callback {function} -- Callback function, called with the metrics
+
+        Keyword Arguments:
+            threshold {float} -- Fraction of active wands for a motion callback (default: {0.8})
+
+        Returns {str} -- ID of the callback for removal later
+        """
+        id = uuid.uuid4()
+        if event == "tick":
+            self._tick_callbacks[id] = callback
+        elif event in self.motions:
+            self._motion_callbacks[id] = [event, callback, threshold, False]
+        else:
+            raise ValueError("Unknown event {}, expected tick or a motion added with add_motion".format(event))
+        return id
+
+    def off(self, uuid):
+        """Remove a tick listener
+
+        Arguments:
+            uuid {str} -- Remove a callback with its id
+
+        Returns {bool} -- If removal was successful or not
+        """
+        return self._tick_callbacks.pop(uuid, None) is not None or self._motion_callbacks.pop(uuid, None) is not None
+
+    def tick(self, now=None):
+        """Compute the metrics and call the listeners
+
+        Keyword Arguments:
+            now {int} -- time.monotonic_ns() the window ends at, now if None (default: {None})
+
+        Returns {dict} -- The metrics, see metrics
+        """
+        start = time.perf_counter()
+        metrics = self.metrics(now)
+        self.tick_time.observe(time.perf_counter() - start)
+
+        for callback in list(self._tick_callbacks.values()):
+            callback(metrics)
+        for listener in list(self._motion_callbacks.values()):
+            name, callback, threshold, reached = listener
+            fraction = metrics["fractions"].get(name, 0.0)
+            listener[3] = fraction >= threshold
+            if listener[3] and not reached:
+                if self.debug:
+                    print("{:.0%} of wands made {}".format(fraction, name))
+                callback(metrics)
+        return metrics
+
+    def start(self):
+        """Tick in a background thread
+        """
+        if self._thread is None:
+            self.running = True
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop ticking and wait for the thread to finish
+        """
+        self.running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        """Tick every tick_ms in the current thread until stopped
+        """
+        if self.debug:
+            print("Aggregator started")
+
+        self.running = True
+        self._wake.clear()
+        due = time.monotonic()
+        while self.running:
+            self.tick()
+            # Ticks stay on a fixed schedule, one that runs late is skipped rather than bunched up
+            due += self.tick_ms / 1000
+            now = time.monotonic()
+            if due < now:
+                due += math.ceil((now - due) * 1000 / self.tick_ms) * self.tick_ms / 1000
+            self._wake.wait(due - now)
+
+        if self.debug:
+            print("Aggregator stopped")
+
+    def stats(self):
+        """Get how long ticks take
+
+        Returns {dict} -- wands, motions and a summary of tick durations in milliseconds
+        """
+        return {
+            "wands": len(self.wands),
+            "motions": len(self.motions),
+            "tick": self.tick_time.stats(),
+        }
+
+# Trace files are a header followed by (monotonic_ns, cHandle, length) records, each followed by its payload
+_TRACE_MAGIC = b"KWTR"
+_TRACE_VERSION = 1
+_TRACE_HEADER = struct.Struct("<4sHH")
+_TRACE_RECORD = struct.Struct("<QHH")
+
+class TraceWriter(object):
+    """Append notifications to a binary trace file
+    """
+
+    def __init__(self, path):
+        """Open a trace file for appending, creating it if necessary
+
+        Arguments:
+            path {str} -- Path of the trace file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(_TRACE_HEADER.pack(_TRACE_MAGIC, _TRACE_VERSION, 0))
+        else:
+            with open(path, "rb") as existing:
+                _read_trace_header(existing.read(_TRACE_HEADER.size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def write(self, timestamp, handle, data):
+        """Append a notification
+
+        Arguments:
+            timestamp {int} -- Receive time from time.monotonic_ns()
+            handle {int} -- Handle of notification
+            data {bytes} -- Data from device
+        """
+        with self._lock:
+            self._file.write(_TRACE_RECORD.pack(timestamp, handle, len(data)))
+            self._file.write(data)
+
+    def flush(self):
+        """Flush buffered records to disk
+        """
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        """Flush and close the trace file
+        """
+        with self._lock:
+            self._file.close()
+
+def _read_trace_header(header):
+    if len(header) < _TRACE_HEADER.size:
+        raise ValueError("Not a wand trace, file is too short")
+    magic, version, _ = _TRACE_HEADER.unpack_from(header)
+    if magic != _TRACE_MAGIC:
+        raise ValueError("Not a wand trace, bad magic {}".format(magic))
+    if version != _TRACE_VERSION:
+        raise ValueError("Unsupported wand trace version {}".format(version))
+
+class TraceReader(object):
+    """Read notifications from a binary trace file through a memory map
+    """
+
+    def __init__(self, path):
+        """Open a trace file for reading
+
+        Arguments:
+            path {str} -- Path of the trace file
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        _read_trace_header(self._map)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __iter__(self):
+        """Iterate over the records, a truncated record at the end is skipped
+
+        Yields {tuple} -- (timestamp, handle, data) records
+        """
+        offset = _TRACE_HEADER.size
+        end = len(self._map)
+        while offset + _TRACE_RECORD.size <= end:
+            timestamp, handle, length = _TRACE_RECORD.unpack_from(self._map, offset)
+            offset += _TRACE_RECORD.size
+            if offset + length > end:
+                break
+            yield timestamp, handle, self._map[offset:offset + length]
+            offset += length
+
+    def close(self):
+        """Close the memory map and file
+        """
+        self._map.close()
+        self._file.close()
+
+_SHARED_MAGIC = b"KWSM"
+_SHARED_VERSION = 1
+_SHARED_HEADER = struct.Struct("<4sHHI")
+_SHARED_HEADER_SIZE = 64
+_SHARED_COUNT_OFFSET = 16
+def _attach_shared_memory(name):
+    """Open existing shared memory without letting this process's exit unlink it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    # Before Python 3.13 attaching registers the memory with the resource
+    # tracker, which unlinks it when the reader exits, so take it back off
+    from multiprocessing import resource_tracker
+    memory = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(memory._name, "shared_memory")
+    return memory
+
+def _shared_arrays(buffer, size):
+    """Map the count, timestamps and samples of a shared position ring"""
+    count = numpy.ndarray((1,), dtype=numpy.uint64, buffer=buffer, offset=_SHARED_COUNT_OFFSET)
+    timestamps = numpy.ndarray((size * 2,), dtype=numpy.int64, buffer=buffer, offset=_SHARED_HEADER_SIZE)
+    samples = numpy.ndarray((size * 2, 4), dtype=numpy.int16, buffer=buffer, offset=_SHARED_HEADER_SIZE + size * 16)
+    return count, timestamps, samples
+
+class SharedPositionPublisher(object):
+    """Publish a wand's positions to a shared memory ring for other processes
+
+    The ring is laid out like PositionBuffer, every sample stored twice so any
+    run of samples is one slice, after a header holding the number of samples
+    written. That count is only bumped once a sample is complete, so it works
+    like a seqlock's sequence: readers check it before and after using samples
+    to know if the writer caught up with them, see SharedPositionReader.
+    """
+
+    def __init__(self, wand=None, name=None, size=1024):
+        """Create the shared memory and start publishing
+
+        Keyword Arguments:
+            wand {Wand} -- Wand to publish, see attach (default: {None})
+            name {str} -- Name of the shared memory, a generated one if None (default: {None})
+            size {int} -- Number of samples kept (default: {1024})
+        """
+        self.size = size
+        self._memory = shared_memory.SharedMemory(name=name, create=True, size=_SHARED_HEADER_SIZE + size * 2 * 16)
+        self.name = self._memory.name
+        _SHARED_HEADER.pack_into(self._memory.buf, 0, _SHARED_MAGIC, _SHARED_VERSION, 0, size)
+        self._count, self._timestamps, self._samples = _shared_arrays(self._memory.buf, size)
+        self._count[0] = 0
+        self.count = 0
+        self._wand = None
+        self._id = None
+        if wand is not None:
+            self.attach(wand)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def publish(self, timestamp, x, y, z, w):
+        """Write a sample to the ring
+
+        Arguments:
+            timestamp {int} -- time.monotonic_ns() of the sample
+            x {int} -- X component of the quaternion
+            y {int} -- Y component of the quaternion
+            z {int} -- Z component of the quaternion
+            w {int} -- W component of the quaternion
+        """
+        i = self.count % self.size
+        j = i + self.size
+        self._timestamps[i] = self._timestamps[j] = timestamp
+        self._samples[i] = self._samples[j] = (x, y, z, w)
+        self.count += 1
+        self._count[0] = self.count
+
+    def attach(self, wand):
+        """Publish every position of a wand
+
+        Arguments:
+            wand {Wand} -- Wand to publish
+
+        Returns {str} -- ID of the position callback
+        """
+        self.detach()
+        self._wand = wand
+        self._id = wand.on("position", lambda x, y, z, w: self.publish(wand.position_buffer.last_timestamp, x, y, z, w))
+        return self._id
+
+    def detach(self):
+        """Stop publishing the attached wand
+
+        Returns {bool} -- If removal was successful or not
+        """
+        if self._wand is None:
+            return False
+        wand, self._wand = self._wand, None
+        return wand.off(self._id)
+
+    def close(self, unlink=True):
+        """Stop publishing and release the shared memory
+
+        Keyword Arguments:
+            unlink {bool} -- Remove the shared memory, readers that are open keep their mapping (default: {True})
+        """
+        self.detach()
+        self._count = self._timestamps = self._samples = None
+        self._memory.close()
+        if unlink:
+            # A reader forked from this process shares its resource tracker and
+            # took the memory off it, so put it back for unlink to take off again
+            from multiprocessing import resource_tracker
+            resource_tracker.register(self._memory._name, "shared_memory")
+            self._memory.unlink()
+
+class SharedPositionReader(object):
+    """Read a SharedPositionPublisher's ring from any process
+
+    Reads return zero-copy views into the shared memory. The publisher keeps
+    writing while they are used, so check valid() once done with them, or copy
+    them first and check then. A reader that falls more than the ring's size
+    behind skips ahead and counts the samples it missed in lost.
+    """
+
+    def __init__(self, name, start=None):
+        """Open a publisher's ring
+
+        Arguments:
+            name {str} -- Name of the shared memory, SharedPositionPublisher.name
+
+        Keyword Arguments:
+            start {int} -- Number of the first sample to read, only new samples if None (default: {None})
+        """
+        self.name = name
+        self._memory = _attach_shared_memory(name)
+        magic, version, _, size = _SHARED_HEADER.unpack_from(self._memory.buf, 0)
+        if magic != _SHARED_MAGIC:
+            self._memory.close()
+            raise ValueError("{} is not a kano_wand position ring".format(name))
+        if version != _SHARED_VERSION:
+            self._memory.close()
+            raise ValueError("Unsupported position ring version {}".format(version))
+        self.size = size
+        self._count, self._timestamps, self._samples = _shared_arrays(self._memory.buf, size)
+        self.next = int(self._count[0]) if start is None else start
+        self.lost = 0
+        self._start = self.next
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    @property
+    def count(self):
+        """Number of samples the publisher has written"""
+        return int(self._count[0])
+
+    @property
+    def behind(self):
+        """Number of samples written but not read yet"""
+        return self.count - self.next
+
+    def read(self, max_count=None):
+        """Get the samples written since the last read
+
+        Arguments:
+            max_count {int} -- Most samples to return, all new ones if None (default: {None})
+
+        Returns {tuple} -- (timestamps, samples) int64 (N,) and int16 (N, 4) zero-copy views
+        """
+        count = self.count
+        if count - self.next >= self.size:
+            # The oldest unread samples are gone, or about to be overwritten
+            skip = count - self.size + 1 - self.next
+            self.lost += skip
+            self.next += skip
+        stop = count if max_count is None else min(count, self.next + max_count)
+        self._start = self.next
+        i = self.next % self.size
+        j = i + stop - self.next
+        self.next = stop
+        return self._timestamps[i:j], self._samples[i:j]
+
+    def latest(self, count):
+        """Get zero-copy views of the newest samples, without moving the read position
+
+        Arguments:
+            count {int} -- Number of samples
+
+        Returns {tuple} -- (timestamps, samples) int64 (N,) and int16 (N, 4) arrays
+        """
+        stop = self.count
+        start = max(stop - min(count, self.size - 1), 0)
+        self._start = start
+        i = start % self.size
+        return self._timestamps[i:i + stop - start], self._samples[i:i + stop - start]
+
+    def valid(self):
+        """Check if the samples of the last read are still intact
+
+        Returns {bool} -- False if the publisher has started overwriting them
+        """
+        # Writing sample n touches the slot of sample n - size before the count moves on
+        return self.count - self._start < self.size
+
+    def close(self):
+        """Release the shared memory
+        """
+        self._count = self._timestamps = self._samples = None
+        self._memory.close()
+
+class RECORD(Enum):
+    """Enum for the record types of bridge frames"""
+    POSITION = 1
+    BUTTON = 2
+    TEMPERATURE = 3
+    BATTERY = 4
+
+_BRIDGE_MAGIC = b"KW"
+_BRIDGE_VERSION = 1
+_BRIDGE_HEADER = struct.Struct("<2sBBH")
+_BRIDGE_RECORD = struct.Struct("<BBHIQ")
+_BRIDGE_PAYLOADS = {
+    RECORD.POSITION: struct.Struct("<4h"),
+    RECORD.BUTTON: struct.Struct("<?"),
+    RECORD.TEMPERATURE: struct.Struct("<h"),
+    RECORD.BATTERY: struct.Struct("<B"),
+}
+_BRIDGE_TYPES = dict((record.value, record) for record in RECORD)
+_WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+def encode_record(type, wand, seq, timestamp, values):
+    """Encode one bridge record
+
+    Arguments:
+        type {kano_wand.RECORD} -- Record type
+        wand {int} -- ID of the wand on the bridge
+        seq {int} -- Sequence number of the record for the wand
+        timestamp {int} -- time.monotonic_ns() on the bridge
+        values {tuple} -- (x, y, z, w) for positions, a one value tuple otherwise
+
+    Returns {bytes} -- Encoded record
+    """
+    return _BRIDGE_RECORD.pack(type.value, 0, wand, seq & 0xffffffff, timestamp) + _BRIDGE_PAYLOADS[type].pack(*values)
 
-        self._battery_subscribed = True
-        with self._lock:
-            if not hasattr(self, "_battery_handle"):
-                handle = self._io_service.getCharacteristics(_IO.BATTERY_CHAR .value)[0]
-                self._battery_handle = handle.getHandle()
+def encode_frame(records):
+    """Put encoded records into a frame
 
-            self.writeCharacteristic(self._battery_handle + 1, bytes([1, 0]))
-        self._start_notification_thread()
+    A frame is a header with the magic "KW", the format version, flags and the
+    record count, then the records. A record is its type, a reserved byte, the
+    wand ID, sequence number and timestamp, then the payload: four int16 for a
+    position, a bool for the button, an int16 temperature or a uint8 battery.
+    Everything is little endian.
 
-    def unsubscribe_battery(self, continue_notifications=False):
-        """Unsubscribe to battery notifications
+    Arguments:
+        records {bytes[]} -- Records from encode_record
+
+    Returns {bytes} -- Frame
+    """
+    return _BRIDGE_HEADER.pack(_BRIDGE_MAGIC, _BRIDGE_VERSION, 0, len(records)) + b"".join(records)
+
+def decode_frame(data):
+    """Decode a bridge frame
+
+    Arguments:
+        data {bytes} -- Frame
+
+    Returns {list} -- (RECORD, wand, seq, timestamp, values) tuples
+    """
+    magic, version, _, count = _BRIDGE_HEADER.unpack_from(data)
+    if magic != _BRIDGE_MAGIC or version != _BRIDGE_VERSION:
+        raise ValueError("Not a version {} bridge frame".format(_BRIDGE_VERSION))
+    records = []
+    offset = _BRIDGE_HEADER.size
+    for _ in range(count):
+        type, _, wand, seq, timestamp = _BRIDGE_RECORD.unpack_from(data, offset)
+        offset += _BRIDGE_RECORD.size
+        type = _BRIDGE_TYPES[type]
+        payload = _BRIDGE_PAYLOADS[type]
+        records.append((type, wand, seq, timestamp, payload.unpack_from(data, offset)))
+        offset += payload.size
+    return records
+
+def _websocket_frame(opcode, payload):
+    """Build an unmasked server to client WebSocket frame"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+class _BridgeClient(object):
+    """A client of a WandBridge and the wands it wants"""
+
+    def __init__(self, address, websocket=None):
+        self.address = address
+        self.websocket = websocket
+        self.wanted = None
+        self.wands = None
+        self.expires = None
+        self.handshaken = False
+        # Closed once outgoing is sent, nothing more is read
+        self.closing = False
+        self.incoming = b""
+        self.outgoing = bytearray()
+        self.dropped = 0
+
+class WandBridge(object):
+    """Stream wand events to other machines over UDP and WebSocket
+
+    Events from the wands are encoded once as they arrive and sent every
+    flush_ms, batched up to max_records per frame, see encode_frame. Every
+    client only gets the wands it subscribed to.
+
+    UDP clients send a JSON datagram {"subscribe": wands} to the UDP port, where
+    wands is a list of wand names or IDs, or null for every wand, and get
+    {"wands": {id: name}} back. They have to subscribe again within
+    client_timeout seconds to keep getting frames, and can send
+    {"unsubscribe": true} to stop. WebSocket clients get the same JSON as a
+    text message on connecting, every wand until they send a subscribe
+    message, and frames as binary messages.
+    """
+
+    def __init__(self, wands=(), host="127.0.0.1", udp_port=None, ws_port=None, flush_ms=10, max_records=64, client_timeout=30, max_buffer=1048576, debug=False):
+        """Create a new bridge
 
         Keyword Arguments:
-            continue_notifications {bool} -- Keep notification thread running (default: {False})
+            wands {Wand[]} -- Wands to stream (default: {()})
+            host {str} -- Address to listen on (default: {"127.0.0.1"})
+            udp_port {int} -- UDP port to listen on, 0 for any free port, None for no UDP (default: {None})
+            ws_port {int} -- WebSocket port to listen on, 0 for any free port, None for no WebSocket (default: {None})
+            flush_ms {float} -- Time between sending batches (default: {10})
+            max_records {int} -- Most records per frame (default: {64})
+            client_timeout {float} -- Seconds a UDP subscription lasts (default: {30})
+            max_buffer {int} -- Most bytes waiting for a WebSocket client before frames are dropped (default: {1048576})
+            debug {bool} -- Print debug messages (default: {False})
         """
-        if self.debug:
-            print("Unsubscribing from battery notification")
+        self.debug = debug
+        self.flush = flush_ms / 1000
+        self.max_records = max_records
+        self.client_timeout = client_timeout
+        self.max_buffer = max_buffer
+        self.running = False
+        self.frames = 0
+        self.records = 0
+        self._wands = {}
+        self._names = {}
+        self._seq = {}
+        self._pending = []
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._thread = None
+        self._selector = selectors.DefaultSelector()
+        self._udp = None
+        self._listener = None
+        # Clients, sockets and the selector are only touched by the bridge's thread, add and remove wake it instead
+        self._catalog_dirty = False
+        self._owner = None
+        self._wake_read, self._wake_write = socket.socketpair()
+        self._wake_read.setblocking(False)
+        self._wake_write.setblocking(False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ, "wake")
+
+        if udp_port is not None:
+            self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._udp.bind((host, udp_port))
+            self._udp.setblocking(False)
+            self._selector.register(self._udp, selectors.EVENT_READ, "udp")
+        if ws_port is not None:
+            self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._listener.bind((host, ws_port))
+            self._listener.listen()
+            self._listener.setblocking(False)
+            self._selector.register(self._listener, selectors.EVENT_READ, "listen")
+
+        for wand in wands:
+            self.add(wand)
+
+    @property
+    def udp_address(self):
+        """Address the UDP socket is bound to, None without UDP"""
+        return None if self._udp is None else self._udp.getsockname()
+
+    @property
+    def ws_address(self):
+        """Address the WebSocket server listens on, None without WebSocket"""
+        return None if self._listener is None else self._listener.getsockname()
+
+    def add(self, wand, events=("position", "button", "temp", "battery")):
+        """Start streaming a wand
 
-        self._battery_subscribed = continue_notifications
+        Arguments:
+            wand {Wand} -- Wand to stream
+
+        Keyword Arguments:
+            events {tuple} -- Events to stream (default: {("position", "button", "temp", "battery")})
+
+        Returns {int} -- ID of the wand in frames
+        """
+        if wand in self._wands:
+            return self._wands[wand][0]
+        with self._lock:
+            id = 0
+            while id in self._names:
+                id += 1
+            self._names[id] = wand.name
+            self._seq[id] = 0
+
+        types = {
+            "position": RECORD.POSITION,
+            "button": RECORD.BUTTON,
+            "temp": RECORD.TEMPERATURE,
+            "battery": RECORD.BATTERY,
+        }
+        callbacks = []
+        for event in events:
+            if event == "position":
+                callback = lambda x, y, z, w: self._record(RECORD.POSITION, id, wand.position_buffer.last_timestamp, (x, y, z, w))
+            else:
+                callback = functools.partial(self._event, types[event], id)
+            callbacks.append(wand.on(event, callback))
+        self._wands[wand] = (id, callbacks)
+        self._catalog_changed()
+        return id
+
+    def remove(self, wand):
+        """Stop streaming a wand
+
+        Arguments:
+            wand {Wand} -- Wand to stop streaming
+
+        Returns {bool} -- If the wand was being streamed
+        """
+        entry = self._wands.pop(wand, None)
+        if entry is None:
+            return False
+        id, callbacks = entry
+        for callback in callbacks:
+            wand.off(callback)
+        with self._lock:
+            del self._names[id]
+            del self._seq[id]
+        self._catalog_changed()
+        return True
+
+    def _event(self, type, id, value):
+        self._record(type, id, time.monotonic_ns(), (value,))
+
+    def _record(self, type, id, timestamp, values):
         with self._lock:
-            if not hasattr(self, "_battery_handle"):
-                handle = self._io_service.getCharacteristics(_IO.BATTERY_CHAR .value)[0]
-                self._battery_handle = handle.getHandle()
+            seq = self._seq.get(id)
+            if seq is None:
+                return
+            self._seq[id] = seq + 1
+            self._pending.append((id, encode_record(type, id, seq, timestamp, values)))
+
+    def start(self):
+        """Serve clients and send frames from a background thread
+        """
+        if self._thread is None:
+            self.running = True
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
 
-            self.writeCharacteristic(self._battery_handle + 1, bytes([0, 0]))
+    def stop(self):
+        """Stop the bridge, close every socket and stop streaming every wand
+        """
+        self.running = False
+        self._wake()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        for wand in list(self._wands):
+            self.remove(wand)
+        self._selector.unregister(self._wake_read)
+        self._wake_read.close()
+        self._wake_write.close()
+        for client in list(self._clients.values()):
+            if client.websocket is not None:
+                self._close_client(client)
+        self._clients.clear()
+        for sock in (self._udp, self._listener):
+            if sock is not None:
+                self._selector.unregister(sock)
+                sock.close()
+        self._udp = self._listener = None
+        self._selector.close()
+
+    def run(self):
+        """Serve clients and send frames until stopped
+        """
+        self.running = True
+        self._owner = threading.current_thread()
+        next_flush = time.monotonic() + self.flush
+        while self.running:
+            for key, mask in self._selector.select(max(0, next_flush - time.monotonic())):
+                if key.data == "wake":
+                    self._drain_wake()
+                    continue
+                if key.data == "udp":
+                    self._read_udp()
+                elif key.data == "listen":
+                    self._accept()
+                elif mask & selectors.EVENT_READ:
+                    self._read_websocket(key.data)
+                if key.data not in ("udp", "listen") and mask & selectors.EVENT_WRITE:
+                    self._write_websocket(key.data)
+
+            now = time.monotonic()
+            if now >= next_flush:
+                self._send_pending(now)
+                next_flush = max(next_flush + self.flush, now)
+        self._owner = None
+
+    def _wake(self):
+        try:
+            self._wake_write.send(b"\0")
+        except (BlockingIOError, OSError):
+            # Already woken, or stopped
+            pass
 
-    def _start_notification_thread(self):
+    def _drain_wake(self):
         try:
-            if self._notification_thread == None:
-                self.reset_position()
-                self._notification_thread = threading.Thread(target=self._notification_wait)
-                self._notification_thread.start()
-        except:
+            while self._wake_read.recv(64):
+                pass
+        except (BlockingIOError, InterruptedError):
             pass
+        if self._catalog_dirty:
+            self._catalog_dirty = False
+            self._apply_catalog()
 
-    def _notification_wait(self):
-        if self.debug:
-            print("Notification thread started")
+    def _catalog(self):
+        with self._lock:
+            names = list(self._names.items())
+        return json.dumps({"wands": dict((str(id), name) for id, name in names)}).encode("utf-8")
+
+    def _catalog_changed(self):
+        owner = self._owner
+        if owner is not None and owner is not threading.current_thread():
+            # Clients are the bridge thread's, it tells them
+            self._catalog_dirty = True
+            self._wake()
+        else:
+            self._apply_catalog()
+
+    def _apply_catalog(self):
+        """Tell every client about added and removed wands, on the bridge's thread"""
+        catalog = self._catalog()
+        for client in list(self._clients.values()):
+            client.wands = self._resolve(client.wanted)
+            if client.websocket is not None and client.handshaken:
+                self._queue_websocket(client, _websocket_frame(0x1, catalog))
+
+    def _resolve(self, wanted):
+        """Get the IDs of the wanted wands, None for every wand"""
+        if wanted is None:
+            return None
+        with self._lock:
+            names = list(self._names.items())
+        return set(id for id, name in names if id in wanted or str(id) in wanted or name in wanted)
 
-        while (self.connected and
-            (self._position_subscribed or
-            self._button_subscribed or
-            self._temperature_subscribed or
-            self._battery_subscribed)):
+    def _subscribe(self, client, message):
+        """Handle a JSON message from a client
+
+        Returns {bool} -- If the client is still subscribed
+        """
+        try:
+            message = json.loads(message)
+        except ValueError:
+            if self.debug:
+                print("Bad message from {}".format(client.address))
+            return True
+        if message.get("unsubscribe"):
+            return False
+        if "subscribe" in message:
+            wanted = message["subscribe"]
+            client.wanted = None if wanted is None else set(wanted)
+            client.wands = self._resolve(client.wanted)
+        return True
+
+    def _read_udp(self):
+        while True:
             try:
-                if super().waitForNotifications(1):
-                    continue
-            except:
+                data, address = self._udp.recvfrom(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            client = self._clients.get(address)
+            if client is None:
+                client = _BridgeClient(address)
+            if not self._subscribe(client, data):
+                self._clients.pop(address, None)
                 continue
+            client.expires = time.monotonic() + self.client_timeout
+            self._clients[address] = client
+            self._udp.sendto(self._catalog(), address)
 
-        if self.debug:
-            print("Notification thread stopped")
+    def _accept(self):
+        try:
+            sock, address = self._listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _BridgeClient(address, sock)
+        self._clients[sock] = client
+        self._selector.register(sock, selectors.EVENT_READ, client)
+
+    def _close_client(self, client):
+        self._clients.pop(client.websocket, None)
+        try:
+            self._selector.unregister(client.websocket)
+        except (KeyError, ValueError):
+            pass
+        client.websocket.close()
 
-    def _on_position(self, data):
-        """Private function for position notification
+    def _read_websocket(self, client):
+        try:
+            data = client.websocket.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close_client(client)
+            return
+        client.incoming += data
+
+        if not client.handshaken:
+            end = client.incoming.find(b"\r\n\r\n")
+            if end < 0:
+                if len(client.incoming) > 65536:
+                    self._close_client(client)
+                return
+            request, client.incoming = client.incoming[:end].decode("latin-1"), client.incoming[end + 4:]
+            headers = dict(
+                (name.strip().lower(), value.strip())
+                for name, _, value in (line.partition(":") for line in request.split("\r\n")[1:])
+            )
+            key = headers.get("sec-websocket-key")
+            if key is None or headers.get("upgrade", "").lower() != "websocket":
+                client.closing = True
+                self._queue_websocket(client, b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+                return
+            accept = base64.b64encode(hashlib.sha1(key.encode("latin-1") + _WEBSOCKET_GUID).digest()).decode("ascii")
+            client.handshaken = True
+            self._queue_websocket(client, (
+                "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                "Sec-WebSocket-Accept: {}\r\n\r\n".format(accept)
+            ).encode("latin-1"))
+            self._queue_websocket(client, _websocket_frame(0x1, self._catalog()))
+
+        while True:
+            frame = self._parse_websocket(client)
+            if frame is None:
+                return
+            opcode, payload = frame
+            if opcode == 0x8:
+                self._queue_websocket(client, _websocket_frame(0x8, payload[:2]))
+                self._write_websocket(client)
+                self._close_client(client)
+                return
+            if opcode == 0x9:
+                self._queue_websocket(client, _websocket_frame(0xA, payload))
+            elif opcode == 0x1 and not self._subscribe(client, payload):
+                client.wanted = set()
+                client.wands = set()
+
+    def _parse_websocket(self, client):
+        """Take one client frame off the incoming buffer, fragments aren't supported
+
+        Returns {tuple} -- (opcode, unmasked payload), None if it hasn't fully arrived
+        """
+        data = client.incoming
+        if len(data) < 2:
+            return None
+        opcode = data[0] & 0x0f
+        length = data[1] & 0x7f
+        offset = 2
+        if length == 126:
+            if len(data) < 4:
+                return None
+            length = struct.unpack_from("!H", data, 2)[0]
+            offset = 4
+        elif length == 127:
+            if len(data) < 10:
+                return None
+            length = struct.unpack_from("!Q", data, 2)[0]
+            offset = 10
+        masked = data[1] & 0x80
+        if masked:
+            offset += 4
+        if len(data) < offset + length:
+            return None
+
+        payload = data[offset:offset + length]
+        if masked:
+            mask = data[offset - 4:offset]
+            payload = bytes(byte ^ mask[i & 3] for i, byte in enumerate(payload))
+        client.incoming = data[offset + length:]
+        return opcode, payload
+
+    def _queue_websocket(self, client, data):
+        if len(client.outgoing) + len(data) > self.max_buffer:
+            client.dropped += 1
+            return
+        was_empty = not client.outgoing
+        client.outgoing += data
+        if was_empty:
+            self._write_websocket(client)
+
+    def _write_websocket(self, client):
+        try:
+            sent = client.websocket.send(client.outgoing) if client.outgoing else 0
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._close_client(client)
+            return
+        del client.outgoing[:sent]
+        if client.closing and not client.outgoing:
+            self._close_client(client)
+        elif client.websocket in self._clients:
+            events = (0 if client.closing else selectors.EVENT_READ) | (selectors.EVENT_WRITE if client.outgoing else 0)
+            self._selector.modify(client.websocket, events, client)
+
+    def _send_pending(self, now):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        self.records += len(pending)
+
+        # Clients that want the same wands share the frames built for them
+        frames = {}
+        for address, client in list(self._clients.items()):
+            if client.websocket is None and client.expires < now:
+                del self._clients[address]
+                continue
+            if client.websocket is not None and not client.handshaken:
+                continue
+            key = None if client.wands is None else frozenset(client.wands)
+            batch = frames.get(key)
+            if batch is None:
+                records = [record for id, record in pending if key is None or id in key]
+                batch = frames[key] = [
+                    encode_frame(records[i:i + self.max_records])
+                    for i in range(0, len(records), self.max_records)
+                ]
+            for frame in batch:
+                self.frames += 1
+                if client.websocket is None:
+                    try:
+                        self._udp.sendto(frame, client.address)
+                    except OSError:
+                        client.dropped += 1
+                else:
+                    self._queue_websocket(client, _websocket_frame(0x2, frame))
+
+_SESSION_MAGIC = b"KWSS"
+_SESSION_VERSION = 1
+_SESSION_HEADER = struct.Struct("<4sHH")
+# Every block is a tag, row count, time range and payload length, then the payload
+_SESSION_BLOCK = struct.Struct("<4sIqqI")
+_SESSION_CHUNK = b"CHNK"
+_SESSION_WANDS = b"WAND"
+# Stored and raw length of each column of a chunk, stored equals raw if it isn't compressed
+_SESSION_COLUMN = struct.Struct("<II")
+# Name, array typecode, numpy dtype and values per row of every column, in file order
+_SESSION_COLUMNS = (
+    ("timestamp", "q", "<i8", 1),
+    ("wand", "H", "<u2", 1),
+    ("type", "B", "u1", 1),
+    ("position", "h", "<i2", 4),
+    ("value", "h", "<i2", 1),
+)
+
+class SessionWriter(object):
+    """Record wand sessions to a chunked, columnar file for offline analysis
+
+    Every row is a timestamp, the wand, the RECORD type, a position (zeros for
+    other events) and a value (the button, temperature or battery level). Rows are
+    appended to typed column arrays, a few bytes each instead of a tuple of
+    Python ints. Every chunk_rows rows the columns are handed to a background
+    thread, which compresses them with zlib and appends the chunk to the file.
+    See SessionReader for reading it back.
+    """
+
+    def __init__(self, path, chunk_rows=65536, level=1, max_pending=8):
+        """Create a session file, replacing any file at path
 
         Arguments:
-            data {bytes} -- Data from device
+            path {str} -- Path of the session file
+
+        Keyword Arguments:
+            chunk_rows {int} -- Rows per chunk (default: {65536})
+            level {int} -- zlib compression level, 0 stores columns so readers map them without copying (default: {1})
+            max_pending {int} -- Most full chunks waiting to be written before recording blocks (default: {8})
         """
-        # I got part of this from Kano's node module and modified it
-        y = numpy.int16(numpy.uint16(int.from_bytes(data[0:2], byteorder='little')))
-        x = -1 * numpy.int16(numpy.uint16(int.from_bytes(data[2:4], byteorder='little')))
-        w = -1 * numpy.int16(numpy.uint16(int.from_bytes(data[4:6], byteorder='little')))
-        z = numpy.int16(numpy.uint16(int.from_bytes(data[6:8], byteorder='little')))
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.level = level
+        self.max_pending = max_pending
+        self.rows = 0
+        self.chunks = 0
+        self.bytes = _SESSION_HEADER.size
+        self._file = open(path, "wb")
+        self._file.write(_SESSION_HEADER.pack(_SESSION_MAGIC, _SESSION_VERSION, 0))
+        self._lock = threading.Lock()
+        self._columns = self._new_columns()
+        self._wands = {}
+        self._attached = {}
+        self._pending = collections.deque()
+        self._writing = False
+        self._closed = False
+        self._error = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def attach(self, wand, events=("position", "button", "temp", "battery")):
+        """Record a wand's events
 
-        if self.debug:
-            pitch = "Pitch: {}".format(z).ljust(16)
-            roll = "Roll: {}".format(w).ljust(16)
-            print("{}{}(x, y): ({}, {})".format(pitch, roll, x, y))
+        Arguments:
+            wand {Wand} -- Wand to record
 
-        self.on_position(x, y, z, w)
-        for callback in self._position_callbacks.values():
-            callback(x, y, z, w)
+        Keyword Arguments:
+            events {tuple} -- Events to record, any of "position", "button", "temp" and "battery" (default: {("position", "button", "temp", "battery")})
 
-    def on_position(self, roll, x, y, z):
-        """Function called on position notification
+        Returns {int} -- Index of the wand in the session's wand column
+        """
+        self.detach(wand)
+        index = self._wand_index(wand)
+        append = self._append
+        callbacks = []
+        for event in events:
+            if event == "position":
+                callback = lambda timestamp, sequence, x, y, z, w: append(index, 1, timestamp, x, y, z, w, 0)
+            else:
+                type = {"button": RECORD.BUTTON, "temp": RECORD.TEMPERATURE, "battery": RECORD.BATTERY}[event].value
+                callback = lambda timestamp, sequence, value, type=type: append(index, type, timestamp, 0, 0, 0, 0, int(value))
+            callbacks.append(wand.on(event, callback, timestamped=True))
+        self._attached[wand] = callbacks
+        return index
+
+    def detach(self, wand):
+        """Stop recording a wand
 
         Arguments:
-            x {int} -- X position of wand (Between -1000 and 1000)
-            y {int} -- Y position of wand (Between -1000 and 1000)
-            pitch {int} -- Pitch of wand (Between -1000 and 1000)
-            roll {int} -- Roll of wand (Between -1000 and 1000)
+            wand {Wand} -- Wand to stop recording
+
+        Returns {bool} -- If the wand was being recorded
         """
-        pass
+        callbacks = self._attached.pop(wand, None)
+        if callbacks is None:
+            return False
+        for callback in callbacks:
+            wand.off(callback)
+        return True
 
-    def reset_position(self):
-        """Reset the quaternains of the wand
+    def write(self, type, wand, timestamp, values):
+        """Record an event by hand
+
+        Arguments:
+            type {kano_wand.RECORD} -- Event type
+            wand {Wand} -- Wand of the event
+            timestamp {int} -- time.monotonic_ns() of the event
+            values {tuple} -- (x, y, z, w) for positions, a one value tuple otherwise
+        """
+        index = self._wand_index(wand)
+        if type == RECORD.POSITION:
+            self._append(index, type.value, timestamp, values[0], values[1], values[2], values[3], 0)
+        else:
+            self._append(index, type.value, timestamp, 0, 0, 0, 0, int(values[0]))
+
+    def _wand_index(self, wand):
+        mac = wand._dev.addr
+        with self._lock:
+            index = self._wands.get(mac)
+            if index is None:
+                index = self._wands[mac] = len(self._wands)
+                payload = json.dumps([{"mac": mac, "name": wand.name}]).encode("utf-8")
+                # Queued in order with the chunks, so it's in the file before any row of the wand
+                self._queue((_SESSION_WANDS, 1, 0, 0, payload))
+        return index
+
+    def _new_columns(self):
+        return [array.array(typecode) for _, typecode, _, _ in _SESSION_COLUMNS]
+
+    def _append(self, wand, type, timestamp, x, y, z, w, value):
+        if self._error is not None:
+            raise self._error
+        with self._lock:
+            timestamps, wands, types, positions, values = self._columns
+            timestamps.append(timestamp)
+            wands.append(wand)
+            types.append(type)
+            positions.extend((x, y, z, w))
+            values.append(value)
+            self.rows += 1
+            if len(timestamps) >= self.chunk_rows:
+                self._queue_chunk()
+
+    def _queue_chunk(self):
+        """Hand the buffered rows to the writer thread, call with the lock held"""
+        columns = self._columns
+        if len(columns[0]) == 0:
+            return
+        self._columns = self._new_columns()
+        self._queue((_SESSION_CHUNK, len(columns[0]), None, None, columns))
+
+    def _queue(self, block):
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._pending) < self.max_pending or self._closed)
+            if self._error is not None:
+                raise self._error
+            self._pending.append(block)
+            self._condition.notify_all()
+
+    def flush(self):
+        """Write every buffered row to disk, waiting until it's written
         """
-        handle = self._sensor_service.getCharacteristics(_SENSOR.QUATERNIONS_RESET_CHAR.value)[0].getHandle()
         with self._lock:
-            self.writeCharacteristic(handle, bytes([1]))
+            self._queue_chunk()
+        with self._condition:
+            self._condition.wait_for(lambda: not self._pending and not self._writing)
+            if self._error is not None:
+                raise self._error
+            self._file.flush()
 
-    def _on_button(self, data):
-        """Private function for button notification
+    def close(self):
+        """Stop recording every wand, write what's buffered and close the file
+
+        Raises the error that stopped the writer thread, if writing failed
+        """
+        for wand in list(self._attached):
+            self.detach(wand)
+        try:
+            self.flush()
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            self._thread.join()
+            self._file.close()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                tag, rows, first, last, payload = self._pending.popleft()
+                self._writing = True
+                self._condition.notify_all()
+
+            try:
+                if tag == _SESSION_CHUNK:
+                    first, last = min(payload[0]), max(payload[0])
+                    payload = self._encode_chunk(payload)
+                    self.chunks += 1
+                self._file.write(_SESSION_BLOCK.pack(tag, rows, first, last, len(payload)))
+                self._file.write(payload)
+                self.bytes += _SESSION_BLOCK.size + len(payload)
+            except Exception as e:
+                # Stop writing, anything waiting on the thread raises the error instead
+                with self._condition:
+                    self._error = e
+                    self._closed = True
+                    self._writing = False
+                    self._pending.clear()
+                    self._condition.notify_all()
+                return
+
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+    def _encode_chunk(self, columns):
+        directory = []
+        data = []
+        for column in columns:
+            if sys.byteorder != "little":
+                column.byteswap()
+            raw = column.tobytes()
+            stored = zlib.compress(raw, self.level) if self.level else raw
+            if len(stored) >= len(raw):
+                stored = raw
+            directory.append(_SESSION_COLUMN.pack(len(stored), len(raw)))
+            data.append(stored)
+        return b"".join(directory + data)
+
+class SessionReader(object):
+    """Read a session file through a memory map, only touching the chunks and columns asked for
+
+    Opening a session only reads the block headers. Columns stored without
+    compression are returned as views of the map, compressed ones are
+    decompressed a chunk at a time.
+    """
+
+    def __init__(self, path):
+        """Open a session file for reading
 
         Arguments:
-            data {bytes} -- Data from device
+            path {str} -- Path of the session file
         """
-        val = data[0] == 1
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _SESSION_HEADER.size:
+            raise ValueError("Not a wand session, file is too short")
+        magic, version, _ = _SESSION_HEADER.unpack_from(self._map)
+        if magic != _SESSION_MAGIC:
+            raise ValueError("Not a wand session, bad magic {}".format(magic))
+        if version != _SESSION_VERSION:
+            raise ValueError("Unsupported wand session version {}".format(version))
 
-        if self.debug:
-            print("Button: {}".format(val))
+        self.wands = []
+        self._chunks = []
+        offset = _SESSION_HEADER.size
+        end = len(self._map)
+        while offset + _SESSION_BLOCK.size <= end:
+            tag, rows, first, last, length = _SESSION_BLOCK.unpack_from(self._map, offset)
+            offset += _SESSION_BLOCK.size
+            if offset + length > end:
+                # A chunk still being written when the file was copied
+                break
+            if tag == _SESSION_WANDS:
+                self.wands.extend((wand["mac"], wand["name"]) for wand in json.loads(self._map[offset:offset + length].decode("utf-8")))
+            elif tag == _SESSION_CHUNK:
+                columns = {}
+                position = offset + _SESSION_COLUMN.size * len(_SESSION_COLUMNS)
+                for i, (name, _, dtype, width) in enumerate(_SESSION_COLUMNS):
+                    stored, raw = _SESSION_COLUMN.unpack_from(self._map, offset + i * _SESSION_COLUMN.size)
+                    columns[name] = (position, stored, raw, dtype, width)
+                    position += stored
+                self._chunks.append((rows, first, last, columns))
+            offset += length
+
+        self.rows = sum(chunk[0] for chunk in self._chunks)
+        self.start = min((chunk[1] for chunk in self._chunks), default=None)
+        self.stop = max((chunk[2] for chunk in self._chunks), default=None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.rows
+
+    def _column(self, chunk, name):
+        rows, _, _, columns = chunk
+        offset, stored, raw, dtype, width = columns[name]
+        if stored == raw:
+            values = numpy.frombuffer(self._map, dtype=dtype, count=rows * width, offset=offset)
+        else:
+            values = numpy.frombuffer(zlib.decompress(self._map[offset:offset + stored]), dtype=dtype)
+        return values.reshape(-1, width) if width > 1 else values
 
-        self.on_button(val)
-        for callback in self._button_callbacks.values():
-            callback(val)
+    def iter_chunks(self, columns=None, start=None, stop=None, wands=None, types=None):
+        """Read a selection a chunk at a time, chunks outside the time range aren't touched
 
-    def on_button(self, value):
-        """Function called on button notification
+        Keyword Arguments:
+            columns {str[]} -- Columns to read, any of "timestamp", "wand", "type", "position" and "value", all if None (default: {None})
+            start {int} -- Earliest time.monotonic_ns() to read, from the start if None (default: {None})
+            stop {int} -- Time to read up to, not including it, to the end if None (default: {None})
+            wands {str[]} -- MACs or names of the wands to read, all if None (default: {None})
+            types {kano_wand.RECORD[]} -- Event types to read, all if None (default: {None})
 
-        Arguments:
-            pressed {bool} -- If button is pressed
+        Yields {dict} -- Arrays of the selected rows of a chunk by column name, read only if stored uncompressed
         """
-        pass
+        columns = [name for name, _, _, _ in _SESSION_COLUMNS] if columns is None else list(columns)
+        if wands is not None:
+            wands = [index for index, (mac, name) in enumerate(self.wands) if mac in wands or name in wands]
+        if types is not None:
+            types = [type.value if isinstance(type, RECORD) else type for type in types]
+
+        for chunk in self._chunks:
+            _, first, last, _ = chunk
+            if (start is not None and last < start) or (stop is not None and first >= stop):
+                continue
 
-    def _on_temperature(self, data):
-        """Private function for temperature notification
+            mask = None
+            if (start is not None and first < start) or (stop is not None and last >= stop):
+                timestamps = self._column(chunk, "timestamp")
+                mask = numpy.ones(len(timestamps), dtype=bool)
+                if start is not None:
+                    mask &= timestamps >= start
+                if stop is not None:
+                    mask &= timestamps < stop
+            if wands is not None:
+                selected = numpy.isin(self._column(chunk, "wand"), wands)
+                mask = selected if mask is None else mask & selected
+            if types is not None:
+                selected = numpy.isin(self._column(chunk, "type"), types)
+                mask = selected if mask is None else mask & selected
+            if mask is not None and not mask.any():
+                continue
+
+            yield dict((name, self._column(chunk, name) if mask is None else self._column(chunk, name)[mask]) for name in columns)
+
+    def read(self, columns=None, start=None, stop=None, wands=None, types=None):
+        """Read a selection into one array per column, see iter_chunks for the arguments
+
+        Returns {dict} -- Arrays of the selected rows by column name
+        """
+        columns = [name for name, _, _, _ in _SESSION_COLUMNS] if columns is None else list(columns)
+        chunks = list(self.iter_chunks(columns, start, stop, wands, types))
+        result = {}
+        for name, _, dtype, width in _SESSION_COLUMNS:
+            if name in columns:
+                if chunks:
+                    result[name] = numpy.concatenate([chunk[name] for chunk in chunks])
+                else:
+                    result[name] = numpy.zeros((0, width) if width > 1 else 0, dtype=dtype)
+        return result
+
+    def to_npz(self, path, columns=None, start=None, stop=None, wands=None, types=None):
+        """Export a selection to a compressed numpy .npz file, see iter_chunks for the arguments
+
+        The MACs of the wand column's indices are saved as "macs".
 
         Arguments:
-            data {bytes} -- Data from device
+            path {str} -- Path of the .npz file
         """
-        val = numpy.int16(numpy.uint16(int.from_bytes(data[0:2], byteorder='little')))
+        numpy.savez_compressed(path, macs=numpy.array([mac for mac, _ in self.wands]),
+            **self.read(columns, start, stop, wands, types))
 
-        if self.debug:
-            print("Temperature: {}".format(val))
+    def close(self):
+        """Close the memory map and file
+        """
+        try:
+            self._map.close()
+        except BufferError:
+            # Arrays read without copying still use the map, it closes once they're gone
+            pass
+        self._file.close()
+
+class FakeDevice(object):
+    """Stand in for a bluepy.ScanEntry"""
+
+    def __init__(self, name="Kano-Wand-00-00-00", addr="00:00:00:00:00:00", rssi=0):
+        self.name = name
+        self.addr = addr
+        self.addrType = "random"
+        self.iface = None
+        self.rssi = rssi
+
+    def getValueText(self, sdid):
+        return self.name if sdid == 9 else None
+
+class _FakeCharacteristic(object):
+    """Stand in for a bluepy.Characteristic"""
+
+    def __init__(self, uuid, handle):
+        self.uuid = uuid
+        self._handle = handle
+
+    def getHandle(self):
+        return self._handle
+
+# Notification value handles match Wand, their CCCDs are the next handle
+_FAKE_HANDLES = {
+    _INFO.ORGANIZATION_CHAR: 11,
+    _INFO.SOFTWARE_CHAR: 13,
+    _INFO.HARDWARE_CHAR: 15,
+    _IO.BATTERY_CHAR: 23,
+    _IO.USER_BUTTON_CHAR: 33,
+    _IO.VIBRATOR_CHAR: 26,
+    _IO.LED_CHAR: 28,
+    _IO.KEEP_ALIVE_CHAR: 30,
+    _SENSOR.QUATERNIONS_CHAR: 41,
+    _SENSOR.QUATERNIONS_RESET_CHAR: 44,
+    _SENSOR.MAGN_CALIBRATE_CHAR: 46,
+    _SENSOR.TEMP_CHAR: 56,
+}
+
+class _FakeConnection(object):
+    """A connection of the fake backend
+
+    Notifications queued with notify() make a pipe readable, so a WandHub picks
+    them up the same way it does a bluepy helper's output.
+    """
 
-        self.on_temperature(val)
-        for callback in self._temperature_callbacks.values():
-            callback(val)
+    def __init__(self, delegate):
+        self.delegate = delegate
+        self.values = {
+            11: b"Kano",
+            13: b"1.0.0",
+            15: b"1",
+            23: b"100",
+            33: bytes([0]),
+            56: b"0",
+        }
+        self.writes = []
+        self.refuse_until = 0
+        # Histograms of notify() to the delegate returning, from when it was sent and when it was queued
+        self.latency = None
+        self.dispatch_latency = None
+        self._pending = collections.deque()
+        self._pipe = None
+        # notify() comes from other threads, the pipe mustn't be closed under a write
+        self._pipe_lock = threading.Lock()
+
+    def connect(self, device):
+        if time.monotonic() < self.refuse_until:
+            raise ConnectionError("{} is out of range".format(device.addr))
+        with self._pipe_lock:
+            self._close_pipe()
+            pipe = os.pipe()
+            os.set_blocking(pipe[0], False)
+            os.set_blocking(pipe[1], False)
+            self._pipe = pipe
 
-    def on_temperature(self, value):
-        """Function called on temperature notification
+    def disconnect(self):
+        with self._pipe_lock:
+            self._close_pipe()
+
+    def _close_pipe(self):
+        """Close the pipe, call with the pipe lock held"""
+        if self._pipe is not None:
+            os.close(self._pipe[0])
+            os.close(self._pipe[1])
+            self._pipe = None
+            self._pending.clear()
+
+    def fileno(self):
+        return None if self._pipe is None else self._pipe[0]
+
+    def notify(self, handle, data, sent=None):
+        """Queue a notification, as if the wand just sent it
 
         Arguments:
-            value {int} -- Temperature of the wand
+            handle {int} -- Handle of the notification
+            data {bytes} -- Payload of the notification
+
+        Keyword Arguments:
+            sent {int} -- time.monotonic_ns() the wand sent it, now if None (default: {None})
+
+        Returns {bool} -- If it was queued, only connected connections get notifications
         """
+        with self._pipe_lock:
+            if self._pipe is None:
+                return False
+            now = time.monotonic_ns()
+            self._pending.append((now if sent is None else sent, now, handle, data))
+            try:
+                os.write(self._pipe[1], b"\0")
+            except BlockingIOError:
+                # A full pipe is already readable
+                pass
+        return True
+
+    def getCharacteristics(self, startHnd=1, endHnd=0xFFFF, uuid=None):
+        return [_FakeCharacteristic(member.value.lower(), handle) for member, handle in _FAKE_HANDLES.items()]
+
+    def readCharacteristic(self, handle):
+        return self.values.get(handle, b"")
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        self.writes.append((handle, bytes(val)))
+        return {"rsp": ["wr"]}
+
+    def waitForNotifications(self, timeout):
+        pipe = self._pipe
+        if pipe is None:
+            return False
+        if not self._pending and timeout:
+            try:
+                select.select([pipe[0]], [], [], timeout)
+            except (OSError, ValueError):
+                # Disconnected while waiting
+                return False
+        with self._pipe_lock:
+            if self._pipe is not pipe:
+                return False
+            try:
+                os.read(pipe[0], 1)
+            except BlockingIOError:
+                pass
+            if not self._pending:
+                return False
+            sent, queued, handle, data = self._pending.popleft()
+
+        self.delegate.handleNotification(handle, data)
+        if self.latency is not None:
+            now = time.monotonic_ns()
+            self.latency.observe((now - sent) / 1000000000)
+            self.dispatch_latency.observe((now - queued) / 1000000000)
+        return True
+
+class _FakeScanner(object):
+    """A scanner of the fake backend, every device of the backend advertises on every process()"""
+
+    def __init__(self, delegate, devices):
+        self.delegate = delegate
+        self.devices = devices
+        self._seen = set()
+
+    def clear(self):
+        self._seen = set()
+
+    def start(self, passive=False):
         pass
 
-    def _on_battery(self, data):
-        """Private function for battery notification
+    def process(self, timeout):
+        for device in list(self.devices):
+            new = device.addr not in self._seen
+            self._seen.add(device.addr)
+            self.delegate.handleDiscovery(device, new, new)
+        sleep(timeout)
 
-        Arguments:
-            data {bytes} -- Data from device
+    def stop(self):
+        pass
+
+class FakeBackend(Backend):
+    """A backend without a radio, for tests, benchmarks and replaying traces
+
+    Reads return values from each connection's values dict, writes are appended
+    to its writes list, and notifications arrive through FakeWand.replay() or
+    Wand.handleNotification() directly, or through FakeWand.notify() and the
+    wand's hub like a real one.
+    """
+
+    errors = (ConnectionError,)
+
+    def __init__(self, devices=None):
+        """Create a new fake backend
+
+        Keyword Arguments:
+            devices {FakeDevice[]} -- Devices scans find, a single made up wand if None (default: {None})
         """
-        val = data[0]
+        self.devices = [FakeDevice()] if devices is None else devices
 
-        if self.debug:
-            print("Battery: {}".format(val))
+    def connection(self, delegate):
+        return _FakeConnection(delegate)
 
-        self.on_battery(val)
-        for callback in self._battery_callbacks.values():
-            callback(val)
+    def scanner(self, delegate):
+        return _FakeScanner(delegate, self.devices)
 
-    def on_battery(self, value):
-        """Function called on battery notification
+    def fileno(self, connection):
+        return connection.fileno()
 
-        Arguments:
-            value {int} -- Battery level of the wand
+register_backend("fake", FakeBackend)
+
+class FakeWand(Wand):
+    """A wand on the fake backend, for tests, benchmarks and replaying traces
+
+    Reads return values from the values dict, writes are appended to writes, and
+    notifications arrive through replay() or handleNotification() directly, or
+    through notify() and the wand's hub.
+    """
+
+    def __init__(self, device=None, debug=False, buffer_size=256, handle_cache=None, telemetry=False, backend="fake", daemon=False):
+        """Create a new fake wand
+
+        Keyword Arguments:
+            device {bluepy.ScanEntry} -- Device information, a made up one if None (default: {None})
+            debug {bool} -- Print debug messages (default: {False})
+            buffer_size {int} -- Number of position samples kept in position_buffer (default: {256})
+            handle_cache {kano_wand.HandleCache} -- Cache of characteristic handles (default: {None})
+            telemetry {bool} -- Record performance metrics, see stats (default: {False})
+            backend {str|kano_wand.Backend} -- Fake backend or its name (default: {"fake"})
+            daemon {bool} -- Let the program exit while the wand is connected (default: {False})
         """
+        super().__init__(device if device is not None else FakeDevice(), debug=debug, buffer_size=buffer_size, handle_cache=handle_cache, telemetry=telemetry, backend=backend, daemon=daemon)
 
-    def handleNotification(self, cHandle, data):
-        """Handle notifications subscribed to
+    @property
+    def values(self):
+        """Values reads return, by handle
+        """
+        return self._connection.values
+
+    @property
+    def writes(self):
+        """(handle, data) of every write so far
+        """
+        return self._connection.writes
+
+    def notify(self, handle, data, sent=None):
+        """Send a notification through the wand's hub, as if the wand sent it
 
         Arguments:
-            cHandle {int} -- Handle of notification
-            data {bytes} -- Data from device
+            handle {int} -- Handle of the notification
+            data {bytes} -- Payload of the notification
+
+        Keyword Arguments:
+            sent {int} -- time.monotonic_ns() the wand sent it, now if None (default: {None})
+
+        Returns {bool} -- If it was sent, only connected wands send notifications
         """
-        if cHandle == self._position_notification_handle:
-            self._on_position(data)
-        elif cHandle == self._button_notification_handle:
-            self._on_button(data)
-        elif cHandle == self._temp_notification_handle:
-            self._on_temperature(data)
-        elif cHandle == self._battery_notification_handle:
-            self._on_battery(data)
+        return self._connection.notify(handle, data, sent)
 
-class Shop(DefaultDelegate):
-    """A scanner class to connect to wands
-    """
-    def __init__(self, wand_class=Wand, debug=False):
-        """Create a new scanner
+    def drop(self, down=0.0):
+        """Simulate the connection dropping, as if the wand went out of range
 
         Keyword Arguments:
-            wand_class {class} -- Class to use when connecting to wand (default: {Wand})
-            debug {bool} -- Print debug messages (default: {False})
+            down {float} -- Seconds before the wand accepts a connection again (default: {0.0})
         """
-        super().__init__()
-        self.wand_class = wand_class
-        self.debug = debug
-        self._name = None
-        self._prefix = None
-        self._mac = None
-        self._scanner = Scanner().withDelegate(self)
+        self._connection.refuse_until = time.monotonic() + down
+        self._on_disconnected()
+        if self._hub is not None:
+            self._hub.wake()
 
-    def scan(self, name=None, prefix="Kano-Wand", mac=None, timeout=1.0, connect=False):
-        """Scan for devices
+    def replay(self, trace, speed=1.0):
+        """Feed a recorded trace through handleNotification
+
+        Arguments:
+            trace {str|kano_wand.TraceReader} -- Path or reader of the trace
 
         Keyword Arguments:
-            name {str} -- Name of the device to scan for (default: {None})
-            prefix {str} -- Prefix of name of device to scan for (default: {"Kano-Wand"})
-            mac {str} -- MAC Address of the device to scan for (default: {None})
-            timeout {float} -- Timeout before returning from scan (default: {1.0})
-            connect {bool} -- Connect to the wands automatically (default: {False})
+            speed {float} -- Playback speed relative to real time, None to replay as fast as possible (default: {1.0})
 
-        Returns {Wand[]} -- Array of wand objects
+        Returns {int} -- Number of notifications replayed
         """
+        reader = trace if isinstance(trace, TraceReader) else TraceReader(trace)
+        count = 0
+        try:
+            start = None
+            for timestamp, handle, data in reader:
+                if speed is not None:
+                    if start is None:
+                        start = (timestamp, time.monotonic_ns())
+                    delay = (timestamp - start[0]) / speed - (time.monotonic_ns() - start[1])
+                    if delay > 0:
+                        sleep(delay / 1000000000)
+                self.handleNotification(handle, data)
+                count += 1
+        finally:
+            if reader is not trace:
+                reader.close()
 
         if self.debug:
-            print("Scanning for {} seconds...".format(timeout))
-        try:
-            name_check = not (name is None)
-            prefix_check = not (prefix is None)
-            mac_check = not (mac is None)
-            assert name_check or prefix_check or mac_check
-        except AssertionError as e:
-            print("Either a name, prefix, or mac address must be provided to find a wand")
-            raise e
+            print("Replayed {} notifications".format(count))
+        return count
+
+# Simulated quaternions are unit quaternions scaled to this, which int16 holds with room to spare
+_SIMULATOR_SCALE = 16384
+# Shortest sleep of the simulator's driver in nanoseconds, notifications due within it go out together
+_SIMULATOR_TICK = 1000000
+
+class WandSimulator(object):
+    """Many fake wands sending generated notifications through the real dispatch path
+
+    Each wand turns with a slowly wandering angular velocity, flicks now and
+    then, presses its button and reports its temperature and battery. A
+    notification waits for its wand's next BLE connection event, plus jitter and
+    the odd lost event, then goes through the fake connection to the wands' hub,
+    which calls handleNotification exactly like it does for a real wand. A single
+    driver thread generates the motion of every wand at once with numpy.
+
+    latency is a Histogram from a sample being taken to the wand's inline
+    callbacks for it returning, dispatch_latency from it reaching the host to
+    them returning. driver_cpu is the CPU time the driver has used, which a
+    real fleet wouldn't cost the host.
+    """
 
-        if name is not None:
-            self._name = name
-        elif prefix is not None:
-            self._prefix = prefix
-        elif mac is not None:
-            self._mac = mac
+    def __init__(self, count=10, rate=100, flick_rate=0.2, button_rate=0.2, temperature_rate=1.0, battery_rate=0.1,
+                 connection_interval_ms=7.5, jitter_ms=1.0, loss=0.01, seed=None, hub=None, wand_class=FakeWand, debug=False):
+        """Create a new simulator, its wands connect when it starts
 
-        self.wands = []
-        self._scanner.scan(timeout)
-        if connect:
+        Keyword Arguments:
+            count {int} -- Number of wands (default: {10})
+            rate {float} -- Position notifications per second per wand (default: {100})
+            flick_rate {float} -- Fast flicks per second per wand (default: {0.2})
+            button_rate {float} -- Button presses per second per wand (default: {0.2})
+            temperature_rate {float} -- Temperature notifications per second per wand (default: {1.0})
+            battery_rate {float} -- Battery notifications per second per wand (default: {0.1})
+            connection_interval_ms {float} -- Time between BLE connection events (default: {7.5})
+            jitter_ms {float} -- Mean extra delay of a notification reaching the host (default: {1.0})
+            loss {float} -- Chance a connection event fails, delaying its notifications to the next one (default: {0.01})
+            seed {int} -- Seed of the random motion and timing, random if None (default: {None})
+            hub {kano_wand.WandHub} -- Hub for the wands, a new one if None (default: {None})
+            wand_class {class} -- Class of the wands, a FakeWand or subclass of it (default: {FakeWand})
+            debug {bool} -- Print debug messages (default: {False})
+        """
+        self.count = count
+        self.rate = rate
+        self.flick_rate = flick_rate
+        self.button_rate = button_rate
+        self.temperature_rate = temperature_rate
+        self.battery_rate = battery_rate
+        self.connection_interval_ms = connection_interval_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+        self.debug = debug
+        self.running = False
+        self.driver_cpu = 0.0
+        self._rng = numpy.random.default_rng(seed)
+        self._thread = None
+
+        self.wands = [wand_class(FakeDevice("Kano-Wand-Sim-{:03d}".format(i), "5e:00:00:00:{:02x}:{:02x}".format(i >> 8 & 0xff, i & 0xff)), debug=debug)
+            for i in range(count)]
+        self._own_hub = hub is None
+        self.hub = WandHub(self.wands, debug=debug) if hub is None else hub
+        if hub is not None:
             for wand in self.wands:
+                hub.add(wand)
+        self.reset()
+
+    def reset(self):
+        """Start new latency histograms, and count driver_cpu from zero
+        """
+        self.latency = Histogram()
+        self.dispatch_latency = Histogram()
+        self.driver_cpu = 0.0
+        for wand in self.wands:
+            wand.connection.latency = self.latency
+            wand.connection.dispatch_latency = self.dispatch_latency
+
+    def start(self):
+        """Connect the wands and start sending notifications
+        """
+        if self.running:
+            return
+        if self._own_hub:
+            self.hub.start(daemon=True)
+        for wand in self.wands:
+            if not wand.connected:
                 wand.connect()
-        return self.wands
+        self.running = True
+        self._thread = threading.Thread(target=self._drive, daemon=True)
+        self._thread.start()
 
-    def handleDiscovery(self, device, isNewDev, isNewData):
-        """Check if the device matches
+        if self.debug:
+            print("Simulating {} wands".format(self.count))
 
-        Arguments:
-            device {bluepy.ScanEntry} -- Device data
-            isNewDev {bool} -- Whether the device is new
-            isNewData {bool} -- Whether the device has already been seen
+    def stop(self):
+        """Stop sending notifications and disconnect the wands
         """
-
-        if isNewDev:
-            # Perform initial detection attempt
-            mode = 0
-            found = 0
-            name = device.getValueText(9)
-            if self._name is not None:
-                mode += 1
-                if name == self._name:
-                    found += 1
-            if self._prefix is not None:
-                mode += 1
-                if name is not None and name.startswith(self._prefix):
-                    found += 1
-            if self._mac is not None:
-                mode += 1
-                if device.addr == self._mac:
-                    found += 1
-
-            if found >= mode:
-                self.wands.append(self.wand_class(device, debug=self.debug))
-            elif self.debug:
-                if name != "None":
-                    print("Mac: {}\tCommon Name: {}".format(device.addr, name))
-                else:
-                    print("Mac: {}".format(device.addr))
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for wand in self.wands:
+            if wand.connected:
+                wand.disconnect()
+        if self._own_hub:
+            self.hub.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        """Get what the simulator has measured since it started or was reset
+
+        Returns {dict} -- wands, delivered notifications, latency and dispatch_latency summaries in milliseconds, and driver_cpu_seconds
+        """
+        return {
+            "wands": self.count,
+            "delivered": self.latency.count,
+            "latency": self.latency.stats(),
+            "dispatch_latency": self.dispatch_latency.stats(),
+            "driver_cpu_seconds": self.driver_cpu,
+        }
+
+    def _drive(self):
+        count = self.count
+        rng = self._rng
+        period = 1000000000 // self.rate
+        interval = int(self.connection_interval_ms * 1000000)
+        # Every wand gets connection events at its own phase
+        phases = rng.integers(0, interval, count)
+        last_delivery = numpy.zeros(count, dtype=numpy.int64)
+        orientation = numpy.zeros((count, 4))
+        orientation[:, 3] = 1
+        drift = numpy.zeros((count, 3))
+        flick = numpy.zeros((count, 3))
+        pressed = numpy.zeros(count, dtype=bool)
+        release_at = numpy.zeros(count, dtype=numpy.int64)
+        next_temperature = numpy.zeros(count, dtype=numpy.int64)
+        next_battery = numpy.zeros(count, dtype=numpy.int64)
+        temperature = rng.uniform(20, 30, count)
+        battery = rng.uniform(50, 100, count)
+        order = numpy.array(_POSITION_ORDER)
+        signs = numpy.array(_POSITION_SIGNS)
+
+        dt = 1 / self.rate
+        drift_decay = math.exp(-dt / 0.5)
+        drift_noise = 1.5 * math.sqrt(1 - drift_decay * drift_decay)
+        flick_decay = math.exp(-dt / 0.08)
+
+        handles = [(wand._position_notification_handle, wand._button_notification_handle,
+            wand._temp_notification_handle, wand._battery_notification_handle) for wand in self.wands]
+        # [sent, delivery times, still pending, position payloads, other notifications] of every step not delivered yet
+        steps = collections.deque()
+        cpu_start = time.thread_time()
+        start = time.monotonic_ns()
+        next_sample = start
+        phases += start
+        next_temperature += start + rng.integers(0, int(1000000000 / self.temperature_rate), count) if self.temperature_rate else numpy.iinfo(numpy.int64).max
+        next_battery += start + rng.integers(0, int(1000000000 / self.battery_rate), count) if self.battery_rate else numpy.iinfo(numpy.int64).max
+
+        while self.running:
+            now = time.monotonic_ns()
+            while next_sample <= now:
+                t = next_sample
+                next_sample += period
+
+                # Drift is an Ornstein-Uhlenbeck process around standing still, flicks die out quickly
+                drift = drift * drift_decay + rng.standard_normal((count, 3)) * drift_noise
+                flicks = rng.random(count) < self.flick_rate * dt
+                if flicks.any():
+                    axes = rng.standard_normal((int(flicks.sum()), 3))
+                    flick[flicks] += axes / numpy.linalg.norm(axes, axis=1)[:, None] * 15
+                flick *= flick_decay
+                omega = drift + flick
+                speed = numpy.linalg.norm(omega, axis=1)
+                half = speed * dt / 2
+                step = numpy.empty((count, 4))
+                step[:, :3] = omega * numpy.where(speed > 0, numpy.sin(half) / numpy.where(speed > 0, speed, 1), 0)[:, None]
+                step[:, 3] = numpy.cos(half)
+                ax, ay, az, aw = orientation.T
+                bx, by, bz, bw = step.T
+                orientation = numpy.stack([
+                    aw * bx + ax * bw + ay * bz - az * by,
+                    aw * by - ax * bz + ay * bw + az * bx,
+                    aw * bz + ax * by - ay * bx + az * bw,
+                    aw * bw - ax * bx - ay * by - az * bz,
+                ], 1)
+                orientation /= numpy.linalg.norm(orientation, axis=1)[:, None]
+                payload = numpy.rint(orientation * signs * _SIMULATOR_SCALE)[:, order].astype("<i2").tobytes()
+
+                # Notifications go out at the next connection event, or a later one if it fails
+                delivery = phases + -((phases - t) // interval) * interval
+                if self.loss:
+                    delivery += (rng.geometric(1 - self.loss, count) - 1) * interval
+                if self.jitter_ms:
+                    delivery += rng.exponential(self.jitter_ms * 1000000, count).astype(numpy.int64)
+                numpy.maximum(delivery, last_delivery, out=delivery)
+                last_delivery = delivery
+
+                events = {}
+                presses = ~pressed & (rng.random(count) < self.button_rate * dt)
+                releases = pressed & (release_at <= t)
+                for i in numpy.flatnonzero(presses | releases).tolist():
+                    events.setdefault(i, []).append((1, bytes([1 if presses[i] else 0])))
+                pressed ^= presses | releases
+                release_at[presses] = t + rng.integers(100000000, 500000000, int(presses.sum()))
+                due = next_temperature <= t
+                if due.any():
+                    temperature[due] += rng.normal(0, 0.2, int(due.sum()))
+                    next_temperature[due] += int(1000000000 / self.temperature_rate)
+                    for i in numpy.flatnonzero(due).tolist():
+                        events.setdefault(i, []).append((2, _TEMPERATURE_STRUCT.pack(int(round(temperature[i])))))
+                due = next_battery <= t
+                if due.any():
+                    battery[due] = numpy.maximum(battery[due] - 0.01, 0)
+                    next_battery[due] += int(1000000000 / self.battery_rate)
+                    for i in numpy.flatnonzero(due).tolist():
+                        events.setdefault(i, []).append((3, bytes([int(battery[i])])))
+                steps.append([t, delivery, numpy.ones(count, dtype=bool), payload, events])
+
+            # Steps are delivered in order, so each wand's notifications stay in order
+            now = time.monotonic_ns()
+            wake = next_sample
+            for step in steps:
+                sent, delivery, pending, payload, events = step
+                ready = pending & (delivery <= now)
+                for i in numpy.flatnonzero(ready).tolist():
+                    wand = self.wands[i]
+                    if wand.connected:
+                        wand.notify(handles[i][0], payload[i * 8:i * 8 + 8], sent)
+                        for kind, data in events.get(i, ()):
+                            wand.notify(handles[i][kind], data, sent)
+                pending &= ~ready
+                if pending.any():
+                    wake = min(wake, int(delivery[pending].min()))
+            while steps and not steps[0][2].any():
+                steps.popleft()
+
+            self.driver_cpu = time.thread_time() - cpu_start
+            delay = wake - time.monotonic_ns()
+            if delay > 0:
+                # Waking for every connection event of every wand would cost more than the wands do
+                sleep(max(delay, _SIMULATOR_TICK) / 1000000000)
+
+def __getattr__(name):
+    """Look up names kano_wand used to re-export from bluepy.btle, importing bluepy on first use
+    """
+    if not name.startswith("_"):
+        try:
+            return getattr(importlib.import_module("bluepy.btle"), name)
+        except (ImportError, AttributeError):
+            pass
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))